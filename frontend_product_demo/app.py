@@ -1,182 +1,437 @@
 import gradio as gr
-import requests
-import json
 import random
-import time
 import os
 import io
 import sys
 import logging
+import threading
 from PIL import Image
 
+# Pacchetto condiviso "havas": accanto ad app.py (install) o nella root del repo
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from havas.client import iter_output_files, ComfyError, ApiError, get_api_client
+from havas.uploads import file_digest
+from havas.result_cache import get_cache, make_key
+from havas.templates import TemplateError
+from havas.workflows import get_template, get_preprocess, get_warmup
+from havas.preprocess import prune_prepared
+from havas.batch import BatchRunner, load_items, read_prompts, format_stats
+from havas.tracker import find_output_nodes
+from havas.metrics import Trace, start_metrics_server
+from havas.dispatch import Dispatcher, BackendDown, is_down_error, parse_urls
+from havas.scheduler import FairScheduler, QueueFull, SLOTS
+from havas.storage import get_storage, scope_outputs
+
 # Configurazione Logger
 logging.basicConfig(stream=sys.stdout, level=logging.INFO, format='%(asctime)s - %(message)s')
 
-COMFY_URL = "http://127.0.0.1:8188"
+COMFY_URL = os.environ.get("COMFY_URL", "http://127.0.0.1:8188")
+# Più pod ComfyUI dietro la stessa UI: COMFY_URLS=http://a:8188,http://b:8188 (default: solo COMFY_URL)
+COMFY_URLS = parse_urls(os.environ.get("COMFY_URLS")) or [COMFY_URL]
 WORKFLOW_FILE = "bg-change.json"
+BATCH_OUTPUT_DIR = "/tmp/comfyui/output/batch"
+# Istogrammi Prometheus dei tempi per fase (trace per job in /tmp/havas/traces.jsonl)
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9464"))
+# Secondi di attesa di un job mentre ComfyUI si avvia / scalda i modelli, poi si rifiuta
+READY_TIMEOUT = int(os.environ.get("READY_TIMEOUT", "600"))
+# Job in sospeso (in attesa + in esecuzione) per sessione
+MAX_JOBS_PER_USER = int(os.environ.get("MAX_JOBS_PER_USER", "3"))
+# Anteprime latenti (frame binari di --preview-method auto) mostrate al secondo durante il sampling; 0 = spente
+PREVIEW_FPS = float(os.environ.get("PREVIEW_FPS", "2"))
+# API headless (python -m havas.api): se impostata la UI è solo un client, i job girano lì
+API_URL = os.environ.get("HAVAS_API_URL")
+OUTPUT_DIR = "/tmp/comfyui/output"
+
+# Un backend per URL, ognuno con il suo pool keep-alive e il suo uploader (input con nome =
+# hash del contenuto, caricati una volta sola per istanza); ogni job va al meno carico
+dispatcher = Dispatcher(COMFY_URLS)
+# Turni fair-share per sessione: in ComfyUI entrano al massimo SLOTS job per backend
+scheduler = FairScheduler(SLOTS * len(dispatcher.backends), MAX_JOBS_PER_USER)
+# Risultati dei job con seed fisso (chiave: input, prompt, seed, workflow)
+results = get_cache()
+# Una cartella output/<sessione>/ per job, quota e pulizia LRU (thread avviato in __main__)
+storage = get_storage(OUTPUT_DIR)
+# Health + warm-up in background (il dispatcher, avviato in __main__: chi importa il modulo non viene bloccato)
+readiness = None
 
 # --- HELPERS ---
 def check_server():
-    try: return requests.get(COMFY_URL).status_code == 200
-    except: return False
+    if readiness is not None: return readiness.is_ready()
+    return any(b.client.is_alive() for b in dispatcher.backends)
 
-def get_queue_status():
-    try:
-        res = requests.get(f"{COMFY_URL}/queue")
-        if res.status_code == 200:
-            data = res.json()
-            return len(data.get('queue_pending', [])) + len(data.get('queue_running', []))
-    except: pass
-    return 0
+def session_of(request):
+    # Sessione Gradio; chiamate da codice (es. havas.bench) = un utente per thread
+    if request is not None and getattr(request, "session_hash", None): return request.session_hash
+    return f"local-{threading.get_ident()}"
+
+def server_status(request: gr.Request = None):
+    if API_URL: return api_status()
+    lines = [readiness.describe()] if readiness is not None else []
+    lines.append(get_queue_status(request))
+    lines.append(storage.describe())
+    return "\n\n".join(lines)
+
+def wait_ready():
+    # Messaggi di attesa finché il server non è pronto (o scade READY_TIMEOUT)
+    if readiness is None or readiness.is_ready(): return
+    for msg in readiness.iter_wait(READY_TIMEOUT):
+        yield f"⏳ Server non ancora pronto, il job parte appena possibile\n{msg}"
+
+def get_queue_status(request=None):
+    # Posizione reale di questa sessione nei turni, non la coda globale di ComfyUI
+    return scheduler.describe(session_of(request))
+
+def cancel_jobs(request: gr.Request = None):
+    # Bottone ANNULLA e tab chiuso: via dalla coda di ComfyUI o interrupt se già sul GPU
+    n = scheduler.cancel_user(session_of(request))
+    if n: logging.info(f"🛑 {n} job annullati per la sessione {session_of(request)}")
 
 def load_workflow():
-    if not os.path.exists(WORKFLOW_FILE): return None
-    with open(WORKFLOW_FILE, "r") as f: return json.load(f)
+    # Parsing e validazione una volta sola, poi cache finché il file non cambia
+    # (parametri image/prompt/seed definiti in havas/workflows.py)
+    return get_template("bg-change", WORKFLOW_FILE)
+
+def prepare_input(future, trace):
+    # Ridimensionamento/ricodifica già partiti nel thread pool: qui si aspetta solo il risultato
+    try:
+        with trace.span("preprocess"):
+            return future.result()
+    except Exception as e:
+        logging.warning(f"Preprocessing fallito, carico l'originale: {e}")
+        return None
 
-def upload_image_to_comfy(pil_image):
+def upload_image_to_comfy(image_path, uploader):
+    # Gradio passa sempre lo stesso file in cache: niente ri-encoding né re-upload a ogni click
     try:
-        buffer = io.BytesIO()
-        pil_image.save(buffer, format="PNG")
-        buffer.seek(0)
-        files = {"image": ("input_gradio.png", buffer, "image/png")}
-        res = requests.post(f"{COMFY_URL}/upload/image", files=files, data={"overwrite": "true"})
-        if res.status_code == 200:
-            return res.json().get("name")
-    except:
-        pass
+        return uploader.upload_path(image_path)
+    except Exception as e:
+        if is_down_error(e): raise  # backend giù: run_process riprova su un altro
+        logging.warning(f"Upload fallito: {e}")
     return None
 
+def api_status():
+    try:
+        res = get_api_client(API_URL).request("GET", "status", "/healthz")
+        return f"🌐 API {API_URL}\n\n{res.json().get('comfy', '')}"
+    except Exception as e:
+        return f"🔴 API {API_URL} non raggiungibile: {e}"
+
 # --- MOTORE PRINCIPALE ---
-def run_process(img, prompt, seed, rnd, progress=gr.Progress(track_tqdm=True)):
-    
-    log_txt = "🔵 Inizializzazione..."
+def run_process(img, prompt, seed, rnd, progress=gr.Progress(track_tqdm=True), request: gr.Request = None):
+    if API_URL:
+        yield from run_process_api(img, prompt, seed, rnd, progress)
+        return
+    for msg in wait_ready(): yield None, msg
+    if readiness is not None and not readiness.is_ready():
+        yield None, f"❌ Server non pronto dopo {READY_TIMEOUT}s, riprova più tardi"
+        return
+    # Una trace per click: tempi di upload, coda, esecuzione (per nodo) e download
+    with Trace("bg-change") as trace:
+        log_txt = "🔵 Inizializzazione..."
+        yield None, log_txt
+
+        # 0. CACHE (solo se il seed è fisso il risultato è ripetibile): niente turno né backend
+        cache_key = None
+        if not rnd and img:
+            try:
+                with trace.span("cache"):
+                    cache_key = make_key(file_digest(img), {"prompt": prompt, "seed": int(seed)}, load_workflow().hash,
+                                         get_preprocess("bg-change"))
+                    hit = results.get(cache_key)
+            except Exception as e:
+                logging.warning(f"Cache non disponibile: {e}")
+                cache_key, hit = None, None
+            if hit:
+                st = results.stats()
+                log_txt += f"\n⚡ Risultato da cache (hit {st['hits']} / miss {st['misses']})"
+                trace.set(cache="hit")
+                yield Image.open(hit["files"][0]), log_txt
+                return
+
+        # Preprocessing dell'input (lato lungo, EXIF, alpha) in background mentre si aspetta il turno
+        prep = get_preprocess("bg-change")
+        prepped = prep.submit(img) if prep is not None and img else None
+
+        # TURNO (fair-share tra sessioni, massimo MAX_JOBS_PER_USER job in sospeso a testa)
+        try:
+            ticket = scheduler.submit(session_of(request), "bg-change")
+        except QueueFull as e:
+            trace.fail(e, "rejected")
+            yield None, f"⚠️ {e}"
+            return
+        finished = False
+        try:
+            with trace.span("turn"):
+                for ahead in scheduler.iter_acquire(ticket):
+                    progress(0.05, desc=f"⏳ In attesa del turno: {ahead} job davanti a te" if ahead else "⏳ Sei il prossimo")
+                    yield None, f"{log_txt}\n⏳ In attesa del turno: {ahead} job davanti a te"
+            upload_img = (prepare_input(prepped, trace) if prepped is not None else None) or img
+            if upload_img != img:
+                size_in, size_out = os.path.getsize(img), os.path.getsize(upload_img)
+                trace.set(input_bytes=size_in, upload_bytes=size_out)
+                log_txt += f"\n🪄 Input ridotto: {size_in / 1e6:.1f} MB -> {size_out / 1e6:.2f} MB"
+            tried = []
+            while not ticket.cancelled:
+                try:
+                    # Tutto il job (upload, submit, tracking, download) sul backend scelto
+                    with dispatcher.lease("bg-change", exclude=tried) as node:
+                        trace.set(backend=node.url, retries=len(tried))
+                        yield from _run_process(upload_img, prompt, seed, rnd, progress, trace, node, ticket, log_txt, cache_key)
+                    break
+                except BackendDown as e:
+                    tried.append(e.url)
+                    logging.warning(f"🔁 {e}, riprovo su un altro backend")
+                    yield None, f"🔁 {e}, riprovo su un altro backend..."
+                except ComfyError as e:
+                    trace.fail(e)
+                    yield None, f"❌ {e}"
+                    break
+            if ticket.cancelled:
+                trace.fail("annullato", "cancelled")
+                yield None, "🛑 Job annullato"
+            finished = True
+        finally:
+            # Generatore chiuso a metà (tab chiuso / ANNULLA): il prompt non deve restare sul GPU
+            if not finished: scheduler.cancel(ticket)
+            scheduler.release(ticket, sum(sp["seconds"] for sp in trace.spans if sp["name"] == "executing"))
+
+def run_process_api(img, prompt, seed, rnd, progress):
+    # Client sottile: job su havas.api, qui solo polling dello stato e download del risultato
+    if not img:
+        yield None, "⚠️ Carica un'immagine"
+        return
+    api = get_api_client(API_URL)
+    params = {"prompt": prompt or ""}
+    if not rnd: params["seed"] = int(seed)
+    try:
+        job = api.submit("bg-change", params, files={"image": img})
+    except (ApiError, OSError) as e:
+        yield None, f"❌ Errore API: {e}"
+        return
+    log_txt = f"🌐 Job {job['id']} inviato all'API"
     yield None, log_txt
+    snap = job
+    try:
+        for snap in api.iter_updates(job["id"]):
+            progress(snap["progress"], desc=snap["message"])
+            yield None, f"{log_txt}\n{snap['message']}"
+        if snap["status"] != "done":
+            yield None, f"❌ {snap.get('error') or snap['message']}"
+            return
+        path = api.download(job["id"], storage.session_dir(f"api_{job['id']}"))
+    except (ApiError, OSError) as e:
+        yield None, f"❌ Errore API: {e}"
+        return
+    finally:
+        # Generatore chiuso a metà (tab chiuso / ANNULLA): il job sull'API va fermato
+        if snap["status"] not in ("done", "error", "cancelled"): api.cancel(job["id"])
+    yield Image.open(path), f"{log_txt}\n✨ Fatto!"
 
+def _run_process(img, prompt, seed, rnd, progress, trace, node, ticket, log_txt, cache_key):
     # 1. UPLOAD
     progress(0.1, desc="Upload")
-    fname = upload_image_to_comfy(img)
+    with trace.span("upload"):
+        fname = upload_image_to_comfy(img, node.uploader)
     if not fname: 
+        trace.fail("upload")
         yield None, "❌ Errore Upload"
         return
     log_txt += f"\n✅ Upload OK: {fname}"
     yield None, log_txt
 
     # 2. SETUP WORKFLOW
-    wf = load_workflow()
     s = random.randint(1, 9**15) if rnd else int(seed)
     
-    # --- PATCHING ---
+    # --- PATCHING (copia solo i nodi image/prompt/seed); il SaveImage scrive in output/<sessione>/ ---
+    session = storage.new_session()
     try:
-        # Immagine -> Nodo 49
-        if "49" in wf: wf["49"]["inputs"]["image"] = fname
-        # Prompt -> Nodo 57
-        if "57" in wf: wf["57"]["inputs"]["text"] = prompt
-        # Seed -> Nodo 6
-        if "6" in wf: wf["6"]["inputs"]["seed"] = s
-    except Exception as e:
-        yield None, f"❌ Errore ID Nodi: {e}"
+        clean_wf = scope_outputs(load_workflow().render(image=fname, prompt=prompt, seed=s), session)
+    except TemplateError as e:
+        trace.fail(e)
+        yield None, f"❌ Errore Workflow: {e}"
         return
 
-    # 3. INVIO
+    # 3. INVIO (il WebSocket si apre prima, così non perdiamo nessun evento)
     progress(0.3, desc="Invio richiesta")
-    clean_wf = {k: v for k, v in wf.items() if isinstance(v, dict) and 'class_type' in v}
+    tracker = node.client.tracker(preview_rate=PREVIEW_FPS)
+    tracker.connect()
     
     try:
-        req = requests.post(f"{COMFY_URL}/prompt", data=json.dumps({"prompt": clean_wf}).encode('utf-8'))
-        if req.status_code != 200:
-            yield None, f"❌ Errore Server: {req.text}"
-            return
-        pid = req.json().get("prompt_id")
+        with trace.span("submit"):
+            pid = node.client.submit(clean_wf, client_id=tracker.client_id)
+    except ComfyError as e:
+        tracker.close()
+        trace.fail(e)
+        yield None, f"❌ Errore Server: {e}"
+        return
     except Exception as e:
+        tracker.close()
+        if is_down_error(e): raise
+        trace.fail(e)
         yield None, f"❌ Errore Connessione: {e}"
         return
 
+    # Da qui un ANNULLA (o il tab chiuso) toglie il prompt da ComfyUI; chiudere il socket sblocca il tracking
+    def on_cancel():
+        try: node.client.cancel(pid)
+        finally: tracker.close()
+    ticket.bind(on_cancel)
     log_txt += f"\n✅ In lavorazione (ID: {pid})"
+    trace.watch(clean_wf, pid)
     yield None, log_txt
 
-    # 4. MONITORAGGIO E RECUPERO IMMAGINE
-    start_time = time.time()
-    
-    while True:
-        try:
-            hist = requests.get(f"{COMFY_URL}/history/{pid}").json()
-            if pid in hist:
-                # Abbiamo finito! Cerchiamo l'immagine GIUSTA (Type: output)
-                outputs = hist[pid]["outputs"]
-                target_img = None
-                
-                # Cerca in tutti i nodi di output
-                for nid in outputs:
-                    if "images" in outputs[nid]:
-                        for candidate in outputs[nid]["images"]:
-                            
-                            # --- FILTRO IMPORTANTE: SALTA I FILE TEMP ---
-                            if candidate.get("type") == "temp":
-                                continue 
-                            
-                            # PRENDI SOLO FILE OUTPUT
-                            if candidate.get("type") == "output":
-                                target_img = candidate
-                                break
-                    
-                    if target_img: break 
-                
-                if target_img:
-                    fn = target_img.get("filename")
-                    tp = target_img.get("type")
-                    sf = target_img.get("subfolder", "")
-                    
-                    log_txt += f"\n📥 Scarico Immagine Finale: {fn}"
-                    yield None, log_txt
-                    progress(0.9, desc="Download")
-                    
-                    res = requests.get(f"{COMFY_URL}/view", params={"filename": fn, "subfolder": sf, "type": tp})
-                    final_img = Image.open(io.BytesIO(res.content))
-                    
-                    log_txt += "\n🎉 COMPLETATO!"
-                    yield final_img, log_txt
-                    return
-                else:
-                    yield None, "❌ Errore: Nessuna immagine finale trovata (Solo preview temporanee)."
-                    return
-
-            # Feedback Coda
-            q = get_queue_status()
-            elapsed = int(time.time() - start_time)
-            msg = f"⏳ In coda: {q} lavori davanti a te..." if q > 1 else f"🎨 Generazione in corso... ({elapsed}s)"
-            progress(0.4 + (min(elapsed, 60)/100), desc=msg)
-            
-            time.sleep(1)
-            if elapsed > 600: 
-                yield None, "❌ Timeout (Server troppo lento)"
+    # 4. MONITORAGGIO (eventi executing/progress/executed, polling solo come fallback)
+    outputs = None
+    try:
+        # node.watch: misura il tempo di esecuzione e alza BackendDown se il pod smette di rispondere
+        for ev in node.watch(node.client.wait(pid, tracker=tracker, output_nodes=find_output_nodes(clean_wf), total_nodes=len(clean_wf), timeout=600)):
+            if ticket.cancelled: return
+            trace.feed(ev)
+            if ev["type"] == "queued":
+                ahead = ev["ahead"]
+                progress(0.35, desc=f"⏳ In coda: {ahead} lavori davanti a te..." if ahead else "⏳ In coda...")
+            elif ev["type"] == "progress":
+                progress(0.4 + 0.5 * ev["fraction"], desc=f"🎨 Generazione in corso... step {ev['value']}/{ev['max']}")
+            elif ev["type"] == "preview":
+                # Composizione visibile dopo pochi step: se non va, ANNULLA libera subito il GPU
+                try: yield Image.open(io.BytesIO(ev["image"])), log_txt
+                except Exception as e: logging.debug(f"Anteprima non decodificabile: {e}")
+            elif ev["type"] == "executing":
+                progress(0.4 + 0.5 * ev["fraction"], desc="🎨 Generazione in corso...")
+            elif ev["type"] == "fallback":
+                log_txt += "\n⚠️ WebSocket perso, passo al polling"
+                yield None, log_txt
+            elif ev["type"] == "error":
+                msg = ev["message"]
+                yield None, "❌ Timeout (Server troppo lento)" if msg == "Timeout" else f"❌ Errore: {msg}"
                 return
-                
-        except Exception as e:
-            print(f"Error: {e}")
-            time.sleep(1)
+            elif ev["type"] == "done":
+                outputs = ev["outputs"]
+    finally:
+        tracker.close()
+
+    # 5. RECUPERO IMMAGINE GIUSTA (Type: output, i file temp delle preview sono scartati)
+    target_img = next(iter_output_files(outputs), None)
+    
+    if not target_img:
+        trace.fail("nessun output")
+        yield None, "❌ Errore: Nessuna immagine finale trovata (Solo preview temporanee)."
+        return
+
+    fn = target_img.get("filename")
+    
+    log_txt += f"\n📥 Scarico Immagine Finale: {fn}"
+    yield None, log_txt
+    progress(0.9, desc="Download")
+    
+    try:
+        with trace.span("download"):
+            data = node.client.view(target_img)
+        with trace.span("decode"):
+            final_img = Image.open(io.BytesIO(data))
+            final_img.load()
+    except Exception as e:
+        if is_down_error(e): raise
+        trace.fail(e)
+        yield None, f"❌ Errore Download: {e}"
+        return
+    
+    if cache_key:
+        results.put(cache_key, [(fn, data)], meta={"prompt_id": pid, "prompt": prompt, "seed": int(seed)})
+    if node.backend.local: storage.track(session)
+    
+    log_txt += "\n🎉 COMPLETATO!"
+    yield final_img, log_txt
+
+# --- BATCH (cartella o lista di immagini x prompt) ---
+def run_batch(files, folder, prompts_text, out_dir, max_inflight):
+    prompts = read_prompts(prompts_text or "")
+    if not prompts:
+        yield [], "⚠️ Scrivi almeno un prompt (uno per riga)"
+        return
+    
+    try:
+        if folder and folder.strip():
+            items = load_items(images=folder.strip(), prompts=prompts)
+        else:
+            items = [it for f in (files or []) for it in load_items(images=f, prompts=prompts)]
+        tpl = load_workflow()
+    except (OSError, TemplateError) as e:
+        yield [], f"❌ Errore: {e}"
+        return
+    if not items:
+        yield [], "⚠️ Nessuna immagine trovata"
+        return
+
+    for msg in wait_ready(): yield [], msg
+    if readiness is not None and not readiness.is_ready():
+        yield [], f"❌ Server non pronto dopo {READY_TIMEOUT}s, riprova più tardi"
+        return
+
+    out_dir = (out_dir or "").strip() or BATCH_OUTPUT_DIR
+    runner = BatchRunner(dispatcher, tpl, out_dir, max_inflight=int(max_inflight), cache=results, workflow="bg-change",
+                         preprocess=get_preprocess("bg-change"))
+    gallery = []
+    yield [], f"📦 {len(items)} job -> {out_dir}"
+    for st in runner.run(items):
+        for path in st["last"]:
+            if path not in gallery: gallery.append(path)
+        yield gallery[-24:], format_stats(st)
+    saved = f"\n🪄 {runner.preprocess.describe()}" if runner.preprocess is not None else ""
+    yield gallery[-24:], f"🎉 Batch completato\n{format_stats(st)}{saved}"
 
 # --- UI (SENZA CSS CUSTOM) ---
 with gr.Blocks(title="Havas AI Tool") as demo:
     gr.Markdown("## 🚀 Background Changer")
+    server = gr.Markdown()
+    
+    with gr.Tab("Singola"):
+        with gr.Row():
+            with gr.Column():
+                im = gr.Image(label="Input", type="filepath", height=300)
+                p = gr.Textbox(label="Prompt", lines=3)
+                with gr.Row():
+                    s = gr.Number(value=42, label="Seed")
+                    r = gr.Checkbox(value=True, label="Random")
+                with gr.Row():
+                    btn = gr.Button("GENERA", variant="primary")
+                    stop = gr.Button("ANNULLA", variant="stop")
+                logs = gr.Textbox(label="Log", interactive=False, lines=6)
+                
+            with gr.Column():
+                out = gr.Image(label="Output Finale", interactive=False)
     
-    with gr.Row():
-        with gr.Column():
-            im = gr.Image(label="Input", type="pil", height=300)
-            p = gr.Textbox(label="Prompt", lines=3)
-            with gr.Row():
-                s = gr.Number(value=42, label="Seed")
-                r = gr.Checkbox(value=True, label="Random")
-            btn = gr.Button("GENERA", variant="primary")
-            logs = gr.Textbox(label="Log", interactive=False, lines=6)
+    with gr.Tab("Batch"):
+        with gr.Row():
+            with gr.Column():
+                b_files = gr.File(label="Immagini", file_count="multiple", type="filepath")
+                b_folder = gr.Textbox(label="...oppure cartella sul server", placeholder="/tmp/comfyui/input/catalogo")
+                b_prompts = gr.Textbox(label="Prompt (uno per riga)", lines=4)
+                b_out = gr.Textbox(label="Cartella output (stessa cartella = riprende il batch)", value=BATCH_OUTPUT_DIR)
+                b_inflight = gr.Slider(1, 32, value=8, step=1, label="Max job in volo")
+                b_btn = gr.Button("AVVIA BATCH", variant="primary")
+                b_status = gr.Textbox(label="Stato", interactive=False, lines=2)
             
-        with gr.Column():
-            out = gr.Image(label="Output Finale", interactive=False)
+            with gr.Column():
+                b_gallery = gr.Gallery(label="Risultati", columns=4, height="auto", interactive=False)
     
-    btn.click(run_process, inputs=[im, p, s, r], outputs=[out, logs], show_progress="hidden")
+    run_ev = btn.click(run_process, inputs=[im, p, s, r], outputs=[out, logs], show_progress="hidden")
+    stop.click(cancel_jobs, cancels=[run_ev])
+    demo.unload(cancel_jobs)
+    b_btn.click(run_batch, inputs=[b_files, b_folder, b_prompts, b_out, b_inflight], outputs=[b_gallery, b_status])
+    gr.Timer(3).tick(server_status, outputs=server)
+    demo.load(server_status, outputs=server)
 
-print("🚀 AVVIO SU PORTA 7860...")
-demo.queue().launch(server_name="0.0.0.0", server_port=7860, share=True, allowed_paths=["/tmp"])
+# Errori di binding dei parametri visibili subito, non al primo submit
+try: load_workflow()
+except TemplateError as e: print(f"❌ Workflow non valido: {e}")
 
 if __name__ == "__main__":
-    pass
-EOF
+    # Solo da riga di comando si lancia la UI (importabile, es. da python -m havas.bench)
+    print("🚀 AVVIO SU PORTA 7860...")
+    start_metrics_server(METRICS_PORT)
+    prune_prepared()
+    storage.start()
+    if API_URL: print(f"🌐 Job sull'API {API_URL}")
+    else: readiness = dispatcher.start([("bg-change", load_workflow, get_warmup("bg-change"))])
+    demo.queue().launch(server_name="0.0.0.0", server_port=7860, share=True, allowed_paths=["/tmp"])
@@ -0,0 +1,3 @@
+"""
+🧰 Havas - moduli condivisi tra i frontend Gradio (bg-change, AliExpress)
+"""
@@ -0,0 +1,349 @@
+"""
+🌐 API HTTP headless per le pipeline (bg-change, AliExpress immagini / video / finale)
+
+    python -m havas.api --port 8600 --comfy http://127.0.0.1:8188
+
+    POST   /jobs                    multipart: campo "pipeline", campo "params" (JSON) e i file
+                                    (es. "image"); oppure JSON {"pipeline", "params"} -> 202 + job
+    GET    /jobs/{id}               stato, progresso, messaggio, output
+    GET    /jobs/{id}/result?n=0    download in streaming dell'output n (Range supportato)
+    DELETE /jobs/{id}               annulla (anche se il job gira in un altro processo)
+    GET    /jobs?pipeline=&limit=   ultimi job
+    GET    /healthz                 200 se almeno un backend ComfyUI è pronto
+
+Pipeline e parametri:
+    bg-change           image, prompt, seed
+    aliexpress-images   image, prompt, seed                  (3 varianti)
+    video               image, prompt                        (Kling su fal.ai, serve FAL_KEY)
+    final               video, lines [[testo, "Bold"], ...], x_head, y_head, text_foot, x_foot, y_foot
+
+Un parametro file può essere un upload, un path sotto --allow-dir oppure
+{"job": id, "n": 0} = output n di un job già finito (per concatenare gli step).
+
+Tutti i job girano nel loop asyncio del server: nessun worker Gradio resta
+occupato. Lo stato sta in havas.job_store (SQLite condiviso), quindi più
+processi dietro lo stesso proxy rispondono per tutti i job.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import asyncio
+import hashlib
+import logging
+import argparse
+
+from aiohttp import web
+
+from havas.dispatch import Dispatcher, parse_urls
+from havas.job_store import JobStore, process_owner, STORE_FILE
+from havas.final_jobs import FinalJobManager
+from havas.jobs import TERMINAL
+from havas.metrics import start_metrics_server
+from havas.orchestrator import ImageOrchestrator
+from havas.storage import get_storage
+from havas.video_jobs import VideoJobManager
+from havas.workflows import get_template, get_warmup, get_preprocess
+from havas.preprocess import prune_prepared
+
+log = logging.getLogger(__name__)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+OUT_DIR = "/tmp/comfyui"
+ALLOW_DIRS = ("/tmp/comfyui",)
+# Path di default dei grafi (nel repo; sul pod si passano con --workflow NOME=FILE)
+WORKFLOW_FILES = {
+    "bg-change": os.path.join(ROOT, "frontend_product_demo", "bg-change.json"),
+    "aliexpress-images": os.path.join(ROOT, "workflows", "aliexpress", "aliexpress_api.json"),
+}
+STORE_EVERY = 0.5     # secondi minimi tra due scritture dello stesso job (i cambi di stato passano sempre)
+CANCEL_POLL = 1.0
+OWNER_CHECK = 60.0
+CHUNK = 1 << 20
+HOUSEKEEPING = web.AppKey("housekeeping", asyncio.Task)
+
+
+class RequestError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+# ========================================
+# SERVER
+# ========================================
+
+class JobApi:
+    def __init__(self, store, out_dir=OUT_DIR, allow_dirs=ALLOW_DIRS, readiness=None):
+        self.store = store
+        self.out_dir = out_dir
+        self.allow_dirs = [os.path.realpath(d) for d in (*allow_dirs, out_dir)]
+        self.readiness = readiness
+        self.owner = process_owner()
+        self.storage = get_storage(os.path.join(out_dir, "output"))
+        self.pipelines = {}  # nome -> (manager, submit(params) -> job_id, parametri file)
+
+    def add_pipeline(self, name, manager, submit, files=("image",)):
+        self.pipelines[name] = (manager, submit, files)
+
+    # --- INPUT ---
+    async def _read_request(self, request):
+        """(pipeline, params) da multipart (file salvati in inputs/ con nome = hash) o da JSON."""
+        if not request.content_type.startswith("multipart/"):
+            try: body = await request.json()
+            except ValueError: raise RequestError("body JSON non valido")
+            return body.get("pipeline"), dict(body.get("params") or {})
+        pipeline, params, files = None, {}, {}
+        reader = await request.multipart()
+        async for part in reader:
+            if part.filename:
+                files[part.name] = await self._save_upload(part)
+            elif part.name == "pipeline":
+                pipeline = (await part.text()).strip()
+            elif part.name == "params":
+                try: params.update(json.loads(await part.text() or "{}"))
+                except ValueError: raise RequestError("'params' non è JSON valido")
+            else:
+                params[part.name] = await part.text()
+        params.update(files)
+        return pipeline, params
+
+    async def _save_upload(self, part):
+        """Disco e hash nel thread pool: un upload grande non ferma l'event loop degli altri job."""
+        root = os.path.join(self.out_dir, "input", "api")
+        ext = os.path.splitext(part.filename)[1].lower() or ".bin"
+        tmp = os.path.join(root, f".upload_{uuid.uuid4().hex}{ext}")
+        h = hashlib.sha256()
+        await asyncio.to_thread(os.makedirs, root, exist_ok=True)
+        f = await asyncio.to_thread(open, tmp, "wb")
+
+        def write(chunk):
+            h.update(chunk)
+            f.write(chunk)
+
+        try:
+            try:
+                while True:
+                    chunk = await part.read_chunk(CHUNK)
+                    if not chunk: break
+                    await asyncio.to_thread(write, chunk)
+            finally:
+                await asyncio.to_thread(f.close)
+            dest = os.path.join(root, f"{h.hexdigest()[:32]}{ext}")
+            await asyncio.to_thread(os.replace, tmp, dest)
+        except BaseException:
+            # Upload interrotto: niente file a metà in inputs/
+            try: os.remove(tmp)
+            except OSError: pass
+            raise
+        return dest
+
+    def _resolve_file(self, name, value):
+        if isinstance(value, dict) and "job" in value:
+            snap = self.store.get(value["job"])
+            if snap is None or snap["status"] != "done": raise RequestError(f"{name}: job {value['job']} non finito")
+            try: value = snap["outputs"][int(value.get("n", 0))]
+            except (IndexError, ValueError): raise RequestError(f"{name}: output {value.get('n')} inesistente")
+        if not isinstance(value, str) or not value: raise RequestError(f"'{name}' mancante")
+        path = os.path.realpath(value)
+        if not any(path == d or path.startswith(d + os.sep) for d in self.allow_dirs):
+            raise RequestError(f"{name}: path fuori dalle cartelle consentite", 403)
+        if not os.path.isfile(path): raise RequestError(f"{name}: file inesistente", 404)
+        return path
+
+    # --- HANDLER ---
+    async def create_job(self, request):
+        try:
+            name, params = await self._read_request(request)
+            if name not in self.pipelines: raise RequestError(f"pipeline sconosciuta: {name}", 404)
+            manager, submit, files = self.pipelines[name]
+            for key in files: params[key] = await asyncio.to_thread(self._resolve_file, key, params.get(key))
+            try: job_id = await submit(params)
+            except (TypeError, ValueError) as e: raise RequestError(f"parametri non validi: {e}")
+        except RequestError as e:
+            return web.json_response({"error": str(e)}, status=e.status)
+        snap = manager.get(job_id)
+        await asyncio.to_thread(self.store.create, snap, name, self.owner, params)
+        asyncio.ensure_future(self._follow(manager, job_id))
+        log.info(f"🌐 Job {job_id} ({name}) creato")
+        return web.json_response(dict(snap, pipeline=name, url=f"/jobs/{job_id}"), status=202)
+
+    async def get_job(self, request):
+        snap = await asyncio.to_thread(self.store.get, request.match_info["id"])
+        if snap is None: return web.json_response({"error": "job inesistente"}, status=404)
+        return web.json_response(snap)
+
+    async def list_jobs(self, request):
+        try: limit = int(request.query.get("limit", 50))
+        except ValueError: limit = 0
+        if limit < 1: return web.json_response({"error": "limit deve essere un intero positivo"}, status=400)
+        jobs = await asyncio.to_thread(self.store.list, request.query.get("pipeline"), min(limit, 500))
+        return web.json_response(jobs)
+
+    async def get_result(self, request):
+        snap = await asyncio.to_thread(self.store.get, request.match_info["id"])
+        if snap is None: return web.json_response({"error": "job inesistente"}, status=404)
+        if snap["status"] != "done": return web.json_response({"error": f"job {snap['status']}"}, status=409)
+        try: path = snap["outputs"][int(request.query.get("n", 0))]
+        except (IndexError, ValueError): return web.json_response({"error": "output inesistente"}, status=404)
+        if not os.path.isfile(path): return web.json_response({"error": "file non più disponibile"}, status=410)
+        return web.FileResponse(path, chunk_size=CHUNK, headers={
+            "Content-Disposition": f'attachment; filename="{os.path.basename(path)}"'})
+
+    async def delete_job(self, request):
+        job_id = request.match_info["id"]
+        for manager, _, _ in self.pipelines.values():
+            if job_id in manager.jobs:
+                return web.json_response({"id": job_id, "cancelled": await manager.cancel(job_id)})
+        # Job di un altro processo: lo ferma il proprietario al prossimo giro
+        if await asyncio.to_thread(self.store.get, job_id) is None:
+            return web.json_response({"error": "job inesistente"}, status=404)
+        return web.json_response({"id": job_id, "cancelled": await asyncio.to_thread(self.store.request_cancel, job_id)}, status=202)
+
+    async def healthz(self, request):
+        ready = self.readiness is None or self.readiness.is_ready()
+        body = {"ready": ready, "owner": self.owner, "pipelines": sorted(self.pipelines)}
+        if self.readiness is not None: body["comfy"] = self.readiness.describe()
+        body["storage"] = await asyncio.to_thread(self.storage.usage)
+        return web.json_response(body, status=200 if ready else 503)
+
+    # --- STATO CONDIVISO ---
+    async def _follow(self, manager, job_id):
+        last, status, snap = 0.0, None, None
+        try:
+            async for snap in manager.subscribe(job_id):
+                now = time.time()
+                if snap["status"] != status or snap["status"] in TERMINAL or now - last >= STORE_EVERY:
+                    await asyncio.to_thread(self.store.update, snap)
+                    last, status = now, snap["status"]
+            # Il risultato resta scaricabile (e usabile come input di un altro job) anche oltre la quota
+            if snap is not None and snap["status"] == "done" and snap["outputs"]:
+                await asyncio.to_thread(self.storage.hold, self.storage.session_of(snap["outputs"][0]))
+        except Exception:
+            log.exception(f"Stato del job {job_id} non salvato")
+
+    async def _housekeeping(self, app):
+        host, checked = socket.gethostname(), 0.0
+        while True:
+            try:
+                for job_id in await asyncio.to_thread(self.store.cancel_requested, self.owner):
+                    for manager, _, _ in self.pipelines.values():
+                        if job_id in manager.jobs: await manager.cancel(job_id)
+                if time.time() - checked >= OWNER_CHECK:
+                    checked = time.time()
+                    for owner in await asyncio.to_thread(self.store.active_owners):
+                        o_host, _, pid = owner.rpartition(":")
+                        if o_host == host and owner != self.owner and not _alive(int(pid)):
+                            n = await asyncio.to_thread(self.store.fail_owner, owner, "Processo API terminato")
+                            log.warning(f"🌐 {n} job di {owner} (processo morto) segnati come falliti")
+                    await asyncio.to_thread(self.store.purge)
+            except Exception as e:
+                log.warning(f"Housekeeping API: {e}")
+            await asyncio.sleep(CANCEL_POLL)
+
+    async def _start_housekeeping(self, app):
+        app[HOUSEKEEPING] = asyncio.ensure_future(self._housekeeping(app))
+
+    async def _stop_housekeeping(self, app):
+        task = app[HOUSEKEEPING]
+        task.cancel()
+        try: await task
+        except asyncio.CancelledError: pass
+
+    def app(self):
+        app = web.Application(client_max_size=256 * 1024 * 1024)
+        r = app.router
+        r.add_post("/jobs", self.create_job)
+        r.add_get("/jobs", self.list_jobs)
+        r.add_get("/jobs/{id}", self.get_job)
+        r.add_get("/jobs/{id}/result", self.get_result)
+        r.add_delete("/jobs/{id}", self.delete_job)
+        r.add_get("/healthz", self.healthz)
+        app.on_startup.append(self._start_housekeeping)
+        app.on_cleanup.append(self._stop_housekeeping)
+        return app
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+# ========================================
+# PIPELINE
+# ========================================
+
+def build(store, urls, out_dir=OUT_DIR, allow_dirs=ALLOW_DIRS, workflow_files=None, fal_key=None, warmup=True):
+    files = dict(WORKFLOW_FILES, **(workflow_files or {}))
+    dispatcher = Dispatcher(urls)
+    templates = {name: get_template(name, files[name]) for name in ("bg-change", "aliexpress-images")}
+    readiness = dispatcher.start([(n, t, get_warmup(n)) for n, t in templates.items()] if warmup else ())
+    api = JobApi(store, out_dir, allow_dirs, readiness)
+
+    for name, tpl in templates.items():
+        orch = ImageOrchestrator(None, tpl, comfy_dir=out_dir, dispatcher=dispatcher, workflow=name,
+                                 preprocess=get_preprocess(name))
+
+        async def submit(params, orch=orch):
+            seed = params.get("seed")
+            return await orch.submit(params["image"], params.get("prompt") or "", int(seed) if seed not in (None, "") else None)
+        api.add_pipeline(name, orch, submit)
+
+    if fal_key:
+        from havas.client import AsyncFalClient, FAL_URL
+        videos = VideoJobManager({"fal": AsyncFalClient(os.environ.get("FAL_URL", FAL_URL), key=fal_key)})
+
+        async def submit_video(params):
+            dest = await asyncio.to_thread(api.storage.unique_path, api.storage.session_of(params["image"]), "video", ".mp4")
+            return await videos.submit(params["image"], params.get("prompt") or "Cinematic zoom", dest)
+        api.add_pipeline("video", videos, submit_video)
+
+    finals = FinalJobManager()
+
+    async def submit_final(params):
+        lines = params.get("lines") or []
+        if isinstance(lines, str): lines = json.loads(lines)
+        dest = await asyncio.to_thread(api.storage.unique_path, api.storage.session_of(params["video"]), "final", ".mp4")
+        layout = {k: float(params[k]) for k in ("x_head", "y_head", "x_foot", "y_foot") if k in params}
+        return await finals.submit(params["video"], lines, dest, text_foot=params.get("text_foot") or "", **layout)
+    api.add_pipeline("final", finals, submit_final, files=("video",))
+    return api
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="API HTTP headless per le pipeline havas")
+    ap.add_argument("--host", default="0.0.0.0")
+    ap.add_argument("--port", type=int, default=int(os.environ.get("API_PORT", "8600")))
+    ap.add_argument("--comfy", action="append", default=[], help="URL ComfyUI (ripetibile o separati da virgola)")
+    ap.add_argument("--out", default=OUT_DIR, help="cartella ComfyUI (input/ e output/ condivise)")
+    ap.add_argument("--allow-dir", action="append", default=[], help="cartelle da cui si possono passare path come input")
+    ap.add_argument("--store", default=os.environ.get("HAVAS_JOB_STORE", STORE_FILE))
+    ap.add_argument("--workflow", action="append", default=[], metavar="NOME=FILE", help="grafo API-format di una pipeline")
+    ap.add_argument("--no-warmup", action="store_true")
+    ap.add_argument("--metrics-port", type=int, default=int(os.environ.get("METRICS_PORT", "0")))
+    args = ap.parse_args(argv)
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO, format='%(asctime)s - %(message)s')
+
+    urls = [u for value in args.comfy for u in parse_urls(value)] \
+        or parse_urls(os.environ.get("COMFY_URLS")) or [os.environ.get("COMFY_URL", "http://127.0.0.1:8188")]
+    files = dict(spec.split("=", 1) for spec in args.workflow)
+    api = build(JobStore(args.store), urls, args.out, tuple(args.allow_dir) or ALLOW_DIRS, files,
+                os.environ.get("FAL_KEY"), warmup=not args.no_warmup)
+    prune_prepared()
+    api.storage.start()
+    if args.metrics_port: start_metrics_server(args.metrics_port)
+    print(f"🌐 API su :{args.port} ({', '.join(sorted(api.pipelines))}) -> ComfyUI {', '.join(urls)}")
+    web.run_app(api.app(), host=args.host, port=args.port, access_log=None, print=None)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
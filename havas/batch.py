@@ -0,0 +1,388 @@
+"""
+📦 Batch bg-change: tante immagini x tanti prompt in un colpo solo
+
+    python -m havas.batch --images ./foto --prompts prompts.txt --out ./risultati
+    python -m havas.batch --manifest lista.csv --out ./risultati
+
+Il manifest è un CSV (o JSONL) con colonne image, prompt e seed opzionale.
+I job vengono inviati a ComfyUI tenendo al massimo `target_pending` lavori in
+attesa nella coda del server (così il GPU non resta mai fermo ma gli utenti
+interattivi non finiscono dietro a centinaia di job) e al massimo `max_inflight`
+nostri in volo. I risultati vengono scritti in --out appena pronti.
+
+Il giornale batch_state.jsonl in --out rende il batch riprendibile: al riavvio
+gli elementi già completati vengono saltati e quelli inviati ma non ancora
+scaricati vengono ricollegati al loro prompt_id (e al backend che lo esegue).
+
+Con più istanze (--comfy ripetibile, o un havas.dispatch.Dispatcher) ogni
+invio va al backend con l'attesa stimata più bassa, rispettando
+`target_pending` per ciascuno; i job di un backend che smette di rispondere
+vengono reinviati su un altro.
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import random
+import hashlib
+import logging
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from havas.client import iter_output_files, COMFY_URL
+from havas.dispatch import Dispatcher, Backend, BackendDown, is_down_error, parse_urls
+from havas.metrics import Trace
+from havas.uploads import file_digest
+from havas.result_cache import get_cache, make_key
+from havas.workflows import get_template, get_preprocess
+
+log = logging.getLogger(__name__)
+
+IMAGE_EXT = (".png", ".jpg", ".jpeg", ".webp")
+STATE_FILE = "batch_state.jsonl"
+
+
+# ========================================
+# INPUT
+# ========================================
+
+def load_items(images=None, prompts=None, manifest=None, seed=None):
+    """Lista di {"image", "prompt", "seed"} da cartella x prompt oppure da manifest."""
+    if manifest:
+        base = os.path.dirname(os.path.abspath(manifest))
+        if manifest.endswith(".jsonl"):
+            with open(manifest, "r", encoding="utf-8") as f:
+                rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            with open(manifest, "r", encoding="utf-8", newline="") as f:
+                rows = list(csv.DictReader(f))
+        items = []
+        for row in rows:
+            s = row.get("seed")
+            items.append({"image": os.path.join(base, row["image"]), "prompt": row["prompt"],
+                          "seed": int(s) if s not in (None, "") else seed})
+        return items
+
+    if os.path.isdir(images):
+        paths = sorted(os.path.join(images, n) for n in os.listdir(images) if n.lower().endswith(IMAGE_EXT))
+    else:
+        paths = [images]
+    if isinstance(prompts, str): prompts = [prompts]
+    return [{"image": p, "prompt": pr, "seed": seed} for p in paths for pr in prompts]
+
+
+def read_prompts(path_or_text):
+    """File con un prompt per riga, oppure testo diretto (una riga = un prompt)."""
+    if os.path.isfile(path_or_text):
+        with open(path_or_text, "r", encoding="utf-8") as f: text = f.read()
+    else:
+        text = path_or_text
+    return [line.strip() for line in text.splitlines() if line.strip()]
+
+
+# ========================================
+# GIORNALE (ripresa dopo crash)
+# ========================================
+
+class BatchJournal:
+    def __init__(self, path):
+        self.path = path
+        self.state = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try: rec = json.loads(line)
+                    except ValueError: continue  # riga troncata da un crash
+                    self.state.setdefault(rec["id"], {}).update(rec)
+        self.f = open(path, "a", encoding="utf-8")
+
+    def get(self, item_id):
+        return self.state.get(item_id)
+
+    def write(self, item_id, **rec):
+        rec["id"] = item_id
+        self.state.setdefault(item_id, {}).update(rec)
+        self.f.write(json.dumps(rec) + "\n")
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+# ========================================
+# RUNNER
+# ========================================
+
+class BatchRunner:
+    def __init__(self, client, template, out_dir, max_inflight=8, target_pending=2,
+                 poll_interval=1.0, uploader=None, cache=None, download_workers=4, workflow="bg-change",
+                 preprocess=None):
+        # client: ComfyClient (un solo server) oppure Dispatcher (più istanze)
+        if isinstance(client, Dispatcher): self.dispatcher = client
+        else: self.dispatcher = Dispatcher([Backend(client.base_url, client=client, uploader=uploader)])
+        self.template = template
+        self.workflow = workflow
+        self.out_dir = out_dir
+        self.max_inflight = max_inflight
+        self.target_pending = target_pending
+        self.poll_interval = poll_interval
+        self.cache = cache
+        self.download_workers = download_workers
+        self.preprocess = preprocess
+
+    def item_id(self, n, item):
+        blob = json.dumps([n, file_digest(item["image"]), item["prompt"], item["seed"], self.template.hash])
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()[:16]
+
+    def output_name(self, n, item, meta):
+        stem = os.path.splitext(os.path.basename(item["image"]))[0]
+        ext = os.path.splitext(meta.get("filename", ".png"))[1] or ".png"
+        return f"{n:05d}_{stem}{ext}"
+
+    def run(self, items):
+        """Generatore di stati di avanzamento fino alla fine del batch."""
+        os.makedirs(self.out_dir, exist_ok=True)
+        journal = BatchJournal(os.path.join(self.out_dir, STATE_FILE))
+        pool = ThreadPoolExecutor(max_workers=self.download_workers)
+        stats = {"total": len(items), "done": 0, "errors": 0, "skipped": 0, "cached": 0,
+                 "inflight": 0, "rate": 0.0, "eta": None, "last": []}
+
+        todo = deque()
+        inflight = {}   # prompt_id -> (n, item_id, item)
+        leases = {}     # prompt_id -> Lease del backend che lo esegue
+        missing = {}    # prompt_id -> tick consecutivi senza traccia in coda/history
+        traces = {}     # prompt_id -> Trace (queued / executing visti dal polling di /queue)
+        started = {}    # prompt_id -> primo tick in cui è risultato in esecuzione
+        downloads = []
+        for n, item in enumerate(items):
+            item_id = self.item_id(n, item)
+            rec = journal.get(item_id) or {}
+            if rec.get("status") == "done":
+                stats["skipped"] += 1
+            elif rec.get("status") == "submitted":
+                item = dict(item, seed=rec.get("seed", item["seed"]))
+                inflight[rec["prompt_id"]] = (n, item_id, item)
+                leases[rec["prompt_id"]] = self.dispatcher.attach(rec.get("backend"), self.workflow)
+                traces[rec["prompt_id"]] = Trace("batch", item_id, prompt_id=rec["prompt_id"], resumed=True)
+                traces[rec["prompt_id"]].begin("queued")
+            else:
+                todo.append((n, item_id, item))
+
+        start = time.time()
+        finished_now = 0
+        try:
+            while todo or inflight or downloads:
+                queues = {}  # url -> (running, pending) dei backend che rispondono
+                for b in self.dispatcher.backends:
+                    q = self.dispatcher.queue(b)
+                    if q is not None:
+                        queues[b.url] = ({x[1] for x in q.get("queue_running", [])}, {x[1] for x in q.get("queue_pending", [])})
+                if not queues:
+                    log.warning("/queue non raggiungibile")
+                    time.sleep(self.poll_interval)
+                    continue
+
+                # 1. Job usciti dalla coda -> download in background
+                for pid in list(inflight):
+                    lease = leases[pid]
+                    n, item_id, item = inflight[pid]
+                    running_ids, pending_ids = queues.get(lease.url, (None, None))
+                    entry = None
+                    if running_ids is not None:
+                        if pid in running_ids:
+                            traces[pid].switch("queued", "executing")
+                            started.setdefault(pid, time.time())
+                        if pid in running_ids or pid in pending_ids: continue
+                        try:
+                            entry = lease.client.history(pid)
+                        except Exception as e:
+                            log.warning(f"/history non raggiungibile su {lease.url}: {e}")
+                            continue
+                    if entry is None:
+                        # Né in coda né in history (server riavviato) o backend giù: si reinvia
+                        missing[pid] = missing.get(pid, 0) + 1
+                        if missing[pid] >= 2:
+                            del inflight[pid]
+                            started.pop(pid, None)
+                            lost = running_ids is None
+                            leases.pop(pid).release(BackendDown(lease.url) if lost else None)
+                            traces.pop(pid).finish("retry", f"{lease.url} non risponde" if lost else "prompt perso dal server")
+                            todo.appendleft((n, item_id, item))
+                        continue
+                    del inflight[pid]
+                    lease = leases.pop(pid)
+                    if pid in started: lease.seconds = time.time() - started.pop(pid)
+                    trace = traces.pop(pid)
+                    trace.end("queued")
+                    trace.end("executing")
+                    if (entry.get("status") or {}).get("status_str") == "error":
+                        journal.write(item_id, status="error", prompt_id=pid)
+                        lease.release()
+                        trace.finish("error", "errore di esecuzione")
+                        stats["errors"] += 1
+                        continue
+                    downloads.append(pool.submit(self._download, n, item_id, item, entry.get("outputs", {}), journal, trace, lease))
+
+                # 2. Download completati
+                for fut in [f for f in downloads if f.done()]:
+                    downloads.remove(fut)
+                    try:
+                        paths = fut.result()
+                        stats["done"] += 1
+                        finished_now += 1
+                        stats["last"] = paths
+                    except Exception as e:
+                        log.warning(f"Download fallito: {e}")
+                        stats["errors"] += 1
+
+                # 3. Nuovi invii al backend meno carico, finché la sua coda ha spazio
+                depth = {url: len(pending) for url, (_, pending) in queues.items()}
+                while todo and len(inflight) < self.max_inflight:
+                    full = [b.url for b in self.dispatcher.backends if depth.get(b.url, self.target_pending) >= self.target_pending]
+                    if len(full) == len(self.dispatcher.backends): break
+                    n, item_id, item = todo.popleft()
+                    if self._from_cache(n, item_id, item, journal, stats):
+                        finished_now += 1
+                        continue
+                    trace = Trace("batch", item_id)
+                    lease = self.dispatcher.lease(self.workflow, exclude=full)
+                    try:
+                        pid, item = self._submit(item, trace, lease)
+                    except Exception as e:
+                        lease.release(e)
+                        if is_down_error(e):
+                            # Backend caduto proprio ora: l'elemento torna in testa per un altro
+                            log.warning(f"{lease.url} non risponde: {e}")
+                            trace.finish("retry", e)
+                            depth.pop(lease.url, None)
+                            todo.appendleft((n, item_id, item))
+                            continue
+                        log.warning(f"Invio fallito per {item['image']}: {e}")
+                        journal.write(item_id, status="error", message=str(e))
+                        trace.finish("error", e)
+                        stats["errors"] += 1
+                        continue
+                    journal.write(item_id, status="submitted", prompt_id=pid, seed=item["seed"], backend=lease.url)
+                    inflight[pid] = (n, item_id, item)
+                    leases[pid] = lease
+                    trace.set(prompt_id=pid, backend=lease.url)
+                    trace.begin("queued")
+                    traces[pid] = trace
+                    depth[lease.url] += 1
+
+                elapsed = time.time() - start
+                remaining = len(todo) + len(inflight) + len(downloads)
+                stats["inflight"] = len(inflight)
+                stats["rate"] = finished_now / elapsed if elapsed > 0 else 0.0
+                stats["eta"] = remaining / stats["rate"] if stats["rate"] > 0 else None
+                yield dict(stats)
+
+                if todo or inflight or downloads: time.sleep(self.poll_interval)
+        finally:
+            pool.shutdown(wait=True)
+            journal.close()
+            for lease in leases.values(): lease.release()
+            for trace in traces.values(): trace.finish("cancelled")
+
+    def _submit(self, item, trace, lease):
+        if item["seed"] is None: item = dict(item, seed=random.randint(1, 9**15))
+        image = item["image"]
+        if self.preprocess is not None:
+            with trace.span("preprocess"):
+                image = self.preprocess.prepare(image)
+        with trace.span("upload"):
+            name = lease.uploader.upload_path(image)
+        prompt = self.template.render(image=name, prompt=item["prompt"], seed=item["seed"])
+        with trace.span("submit"):
+            return lease.client.submit(prompt), item
+
+    def _cache_key(self, item):
+        return make_key(file_digest(item["image"]), {"prompt": item["prompt"], "seed": int(item["seed"])}, self.template.hash,
+                        self.preprocess)
+
+    def _from_cache(self, n, item_id, item, journal, stats):
+        if self.cache is None or item["seed"] is None: return False
+        hit = self.cache.get(self._cache_key(item))
+        if not hit or not hit["files"]: return False
+        dest = os.path.join(self.out_dir, self.output_name(n, item, {"filename": hit["files"][0]}))
+        with open(hit["files"][0], "rb") as src, open(dest, "wb") as f: f.write(src.read())
+        journal.write(item_id, status="done", files=[dest], cached=True)
+        stats["done"] += 1
+        stats["cached"] += 1
+        stats["last"] = [dest]
+        return True
+
+    def _download(self, n, item_id, item, outputs, journal, trace, lease):
+        # Gli output si scaricano dal backend che ha eseguito il job
+        with lease, trace:
+            with trace.span("download"):
+                return self._save_outputs(n, item_id, item, outputs, journal, lease.client)
+
+    def _save_outputs(self, n, item_id, item, outputs, journal, client):
+        paths = []
+        metas = list(iter_output_files(outputs))
+        for i, meta in enumerate(metas):
+            data = client.view(meta)
+            name = self.output_name(n, item, meta)
+            if i: name = f"{os.path.splitext(name)[0]}_{i}{os.path.splitext(name)[1]}"
+            dest = os.path.join(self.out_dir, name)
+            tmp = dest + ".part"
+            with open(tmp, "wb") as f: f.write(data)
+            os.replace(tmp, dest)
+            paths.append(dest)
+            if i == 0 and self.cache is not None:
+                self.cache.put(self._cache_key(item), [(meta.get("filename", name), data)], meta={"prompt": item["prompt"], "seed": item["seed"]})
+        journal.write(item_id, status="done", files=paths)
+        return paths
+
+
+def format_stats(st):
+    eta = f"{int(st['eta'] // 60)}m{int(st['eta'] % 60):02d}s" if st.get("eta") is not None else "--"
+    return (f"{st['done'] + st['skipped']}/{st['total']} completati · {st['inflight']} in volo · "
+            f"{st['errors']} errori · {st['rate'] * 60:.1f} img/min · ETA {eta}")
+
+
+# ========================================
+# CLI
+# ========================================
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Batch bg-change su ComfyUI")
+    ap.add_argument("--images", help="cartella (o singola immagine)")
+    ap.add_argument("--prompts", help="file con un prompt per riga, o un prompt")
+    ap.add_argument("--manifest", help="CSV/JSONL con colonne image,prompt[,seed]")
+    ap.add_argument("--out", required=True, help="cartella di output")
+    ap.add_argument("--seed", type=int, default=None, help="seed fisso per tutti (default: casuale)")
+    ap.add_argument("--workflow", default="bg-change", help="nome nel registro havas.workflows")
+    ap.add_argument("--workflow-file", default=None, help="path del JSON (default: quello del registro)")
+    ap.add_argument("--comfy", action="append", default=[], help=f"URL ComfyUI, ripetibile o separati da virgola (default {COMFY_URL})")
+    ap.add_argument("--max-inflight", type=int, default=8)
+    ap.add_argument("--target-pending", type=int, default=2, help="lavori in attesa da mantenere nella coda del server")
+    ap.add_argument("--no-cache", action="store_true")
+    args = ap.parse_args(argv)
+
+    if not args.manifest and not (args.images and args.prompts):
+        ap.error("servono --manifest oppure --images e --prompts")
+
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO, format='%(asctime)s - %(message)s')
+    items = load_items(args.images, read_prompts(args.prompts) if args.prompts else None, args.manifest, args.seed)
+    urls = [u for value in args.comfy for u in parse_urls(value)] or [COMFY_URL]
+    runner = BatchRunner(Dispatcher(urls), get_template(args.workflow, args.workflow_file), args.out,
+                         max_inflight=args.max_inflight, target_pending=args.target_pending,
+                         cache=None if args.no_cache else get_cache(), workflow=args.workflow,
+                         preprocess=get_preprocess(args.workflow))
+    print(f"📦 {len(items)} job -> {args.out}")
+    last = None
+    for st in runner.run(items):
+        line = format_stats(st)
+        if line != last: print(line)
+        last = line
+    if runner.preprocess is not None: print(f"🪄 {runner.preprocess.describe()}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,275 @@
+"""
+⏱️ Benchmark end-to-end dei frontend contro il mock ComfyUI/n8n (niente GPU)
+
+    python -m havas.bench --scenario all --users 8 --jobs 3 --gpu-time 1
+
+Avvia havas.mock_comfy in-process, importa i due app.py (senza lanciare la UI)
+e chiama le stesse funzioni dei bottoni Gradio con N utenti in parallelo:
+- bg-change:  run_process
+- aliexpress: generate_images -> generate_video_base -> generate_final_video
+
+Per ogni scenario: latenza p50/p95/p99 (job e singoli step), job/s,
+richieste e byte per job (per endpoint). Con --backends N partono N mock
+ComfyUI su porte consecutive dietro havas.dispatch (COMFY_URLS) e il report
+mostra come si sono distribuiti i prompt. Il risultato viene aggiunto a
+benchmarks/results.jsonl insieme al commit git e confrontato con l'ultimo
+run con la stessa configurazione, così le regressioni si vedono nel tempo.
+"""
+
+import os
+import json
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from havas.mock_comfy import MockBackend
+from havas.storage import get_storage
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_FILE = os.path.join(ROOT, "benchmarks", "results.jsonl")
+APPS = {
+    "bg-change": os.path.join(ROOT, "frontend_product_demo", "app.py"),
+    "aliexpress": os.path.join(ROOT, "workflows", "aliexpress", "app.py"),
+}
+
+
+def noop(*args, **kw):
+    pass
+
+
+def percentile(values, p):
+    if not values: return None
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def summarize(values):
+    if not values: return {}
+    return {"n": len(values), "mean": sum(values) / len(values), "p50": percentile(values, 50),
+            "p95": percentile(values, 95), "p99": percentile(values, 99), "max": max(values)}
+
+
+def load_app(name):
+    """Importa app.py come modulo a sé (i due file si chiamano uguale)."""
+    path = APPS[name]
+    spec = importlib.util.spec_from_file_location(f"bench_app_{name.replace('-', '_')}", path)
+    mod = importlib.util.module_from_spec(spec)
+    cwd = os.getcwd()
+    os.chdir(os.path.dirname(path))  # come in produzione: i path dei workflow sono relativi all'app
+    try: spec.loader.exec_module(mod)
+    finally: os.chdir(cwd)
+    if name == "bg-change": mod.WORKFLOW_FILE = os.path.join(os.path.dirname(path), "bg-change.json")
+    return mod
+
+
+def make_input(path, size=768):
+    im = Image.frombytes("RGB", (size, size), os.urandom(size * size * 3))
+    im.save(path, "PNG")
+    return path
+
+
+def git_commit():
+    """Commit misurato; "-dirty" se il working tree ha modifiche non committate."""
+    try:
+        return subprocess.run(["git", "-C", ROOT, "describe", "--always", "--dirty"], capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+# ========================================
+# SCENARI (un job = un click dell'utente, step per step)
+# ========================================
+
+def job_bg_change(app, image, steps):
+    t0 = time.time()
+    last = (None, "")
+    for last in app.run_process(image, "prodotto su un tavolo di marmo", 42, True, progress=noop): pass
+    steps["total"] = time.time() - t0
+    if last[0] is None: raise RuntimeError(last[1].splitlines()[-1] if last[1] else "nessun output")
+
+
+def job_aliexpress(app, image, steps):
+    t0 = time.time()
+    for _, session_id, paths, msg in app.generate_images(image, "scena lifestyle luminosa", 42, True, progress=noop): pass
+    steps["images"] = time.time() - t0
+    if not paths: raise RuntimeError(f"images: {msg}")
+
+    t1 = time.time()
+    video, msg = None, ""
+    for video, msg in app.generate_video_base(paths[0], session_id, "slow zoom", progress=noop): pass
+    steps["video"] = time.time() - t1
+    if not video: raise RuntimeError(f"video: {msg}")
+
+    t2 = time.time()
+    final, msg = app.generate_final_video(video, "Offerta", "Bold", "Solo oggi", "Normal", "", "Normal", "", "Normal",
+                                          "", "Normal", 50, 15, "Prodotto", 50, 85, progress=noop)
+    steps["final"] = time.time() - t2
+    if not final: raise RuntimeError(f"final: {msg}")
+
+
+SCENARIOS = {"bg-change": job_bg_change, "aliexpress": job_aliexpress}
+
+
+def run_scenario(name, app, backends, users, jobs, workdir):
+    for b in backends: b.reset()
+    lock = threading.Lock()
+    records = []
+
+    def user(u):
+        image = make_input(os.path.join(workdir, f"{name}_user{u}.png"))
+        for _ in range(jobs):
+            steps = {}
+            t0 = time.time()
+            try:
+                SCENARIOS[name](app, image, steps)
+                error = None
+            except Exception as e:
+                error = str(e)
+            with lock: records.append({"latency": time.time() - t0, "steps": steps, "error": error})
+
+    t0 = time.time()
+    with ThreadPoolExecutor(users) as pool: list(pool.map(user, range(users)))
+    wall = time.time() - t0
+
+    ok = [r for r in records if not r["error"]]
+    per_backend = [b.stats() for b in backends]
+    counts = {}
+    for st in per_backend:
+        for k, v in st.items():
+            c = counts.setdefault(k, {"requests": 0, "bytes_in": 0, "bytes_out": 0})
+            for f in c: c[f] += v[f]
+    n = max(len(records), 1)
+    step_names = sorted({s for r in ok for s in r["steps"]})
+    return {
+        "jobs": len(records),
+        "errors": len(records) - len(ok),
+        "error_samples": sorted({r["error"] for r in records if r["error"]})[:3],
+        "wall": wall,
+        "throughput": len(ok) / wall if wall else 0.0,
+        "latency": summarize([r["latency"] for r in ok]),
+        "steps": {s: summarize([r["steps"][s] for r in ok if s in r["steps"]]) for s in step_names},
+        "requests_per_job": sum(c["requests"] for c in counts.values()) / n,
+        "bytes_in_per_job": sum(c["bytes_in"] for c in counts.values()) / n,
+        "bytes_out_per_job": sum(c["bytes_out"] for c in counts.values()) / n,
+        "endpoints": {k: {"requests": v["requests"] / n, "bytes_in": v["bytes_in"] / n, "bytes_out": v["bytes_out"] / n}
+                      for k, v in sorted(counts.items())},
+        "prompts_per_backend": [st.get("POST /prompt", {}).get("requests", 0) for st in per_backend],
+    }
+
+
+# ========================================
+# REPORT E STORICO
+# ========================================
+
+def _fmt(v, unit="s"):
+    return "-" if v is None else f"{v:.2f}{unit}"
+
+
+def print_report(name, res, previous=None):
+    lat = res["latency"]
+    print(f"\n📊 {name}: {res['jobs']} job, {res['errors']} errori, {res['throughput']:.2f} job/s (wall {res['wall']:.1f}s)")
+    print(f"   latenza  p50 {_fmt(lat.get('p50'))}  p95 {_fmt(lat.get('p95'))}  p99 {_fmt(lat.get('p99'))}")
+    for step, st in res["steps"].items():
+        print(f"   · {step:<8} p50 {_fmt(st.get('p50'))}  p95 {_fmt(st.get('p95'))}  p99 {_fmt(st.get('p99'))}")
+    print(f"   richieste/job {res['requests_per_job']:.1f}   KB in/job {res['bytes_in_per_job'] / 1024:.0f}   "
+          f"KB out/job {res['bytes_out_per_job'] / 1024:.0f}")
+    for ep, c in res["endpoints"].items():
+        print(f"     {ep:<36} {c['requests']:6.1f} req  {c['bytes_in'] / 1024:8.0f} KB in  {c['bytes_out'] / 1024:8.0f} KB out")
+    if len(res.get("prompts_per_backend", [])) > 1:
+        print(f"   prompt per backend: {' / '.join(str(x) for x in res['prompts_per_backend'])}")
+    for err in res["error_samples"]: print(f"   ❌ {err}")
+    if previous:
+        def delta(a, b): return f"{(a - b) / b * 100:+.0f}%" if a is not None and b else "-"
+        p = previous["latency"]
+        print(f"   Δ vs {previous.get('_commit') or 'precedente'}: p50 {delta(lat.get('p50'), p.get('p50'))}  "
+              f"p95 {delta(lat.get('p95'), p.get('p95'))}  req/job {delta(res['requests_per_job'], previous['requests_per_job'])}")
+
+
+def load_previous(path, config, name):
+    """Ultimo risultato dello scenario con la stessa configurazione."""
+    if not os.path.exists(path): return None
+    found = None
+    with open(path, "r") as f:
+        for line in f:
+            try: rec = json.loads(line)
+            except ValueError: continue
+            if rec.get("config") == config and name in rec.get("scenarios", {}):
+                found = dict(rec["scenarios"][name], _commit=rec.get("commit"))
+    return found
+
+
+def save(path, record):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a") as f: f.write(json.dumps(record, sort_keys=True) + "\n")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmark dei frontend contro il mock ComfyUI/n8n")
+    ap.add_argument("--scenario", choices=["all"] + list(SCENARIOS), default="all")
+    ap.add_argument("--users", type=int, default=4, help="utenti in parallelo")
+    ap.add_argument("--jobs", type=int, default=3, help="job per utente")
+    ap.add_argument("--gpu-time", type=float, default=1.0)
+    ap.add_argument("--steps", type=int, default=8)
+    ap.add_argument("--latency", type=float, default=0.005)
+    ap.add_argument("--image-size", type=int, default=512)
+    ap.add_argument("--video-time", type=float, default=1.0)
+    ap.add_argument("--final-time", type=float, default=0.5)
+    ap.add_argument("--n8n", action="store_true", help="AliExpress: anche lo step immagini via webhook n8n")
+    ap.add_argument("--comfy-port", type=int, default=18188)
+    ap.add_argument("--n8n-port", type=int, default=15678)
+    ap.add_argument("--backends", type=int, default=1, help="istanze mock ComfyUI (porte consecutive) dietro havas.dispatch")
+    ap.add_argument("--label", default="", help="etichetta libera salvata col risultato")
+    ap.add_argument("--out", default=RESULTS_FILE)
+    ap.add_argument("--no-save", action="store_true")
+    args = ap.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="havas_bench_")
+    # Gli app.py leggono gli URL all'import: vanno impostati prima
+    os.environ["COMFY_URL"] = f"http://127.0.0.1:{args.comfy_port}"
+    os.environ["N8N_URL"] = f"http://127.0.0.1:{args.n8n_port}"
+    os.environ["COMFY_URLS"] = ",".join(f"http://127.0.0.1:{args.comfy_port + i}" for i in range(args.backends))
+    os.environ.pop("FAL_KEY", None)
+
+    # Stessa cartella di output per tutti: è quella che l'app AliExpress legge in locale
+    backends = [MockBackend(args.gpu_time, args.steps, args.latency, args.image_size, args.video_time,
+                            args.final_time, output_dir=os.path.join(workdir, "comfyui")) for _ in range(args.backends)]
+    for i, b in enumerate(backends): b.start("127.0.0.1", args.comfy_port + i, args.n8n_port + i)
+    backend = backends[0]
+
+    config = {k: getattr(args, k) for k in ("users", "jobs", "gpu_time", "steps", "latency", "image_size",
+                                            "video_time", "final_time", "n8n")}
+    if args.backends > 1: config["backends"] = args.backends
+    record = {"ts": time.time(), "commit": git_commit(), "label": args.label, "config": config, "scenarios": {}}
+    names = list(SCENARIOS) if args.scenario == "all" else [args.scenario]
+    for name in names:
+        app = load_app(name)
+        # Sessioni nella cartella del mock, non in /tmp/comfyui/output
+        app.storage = get_storage(os.path.join(backend.output_dir, "output"))
+        if name == "aliexpress":
+            app.BASE_OUTPUT_DIR = backend.output_dir
+            app.USE_N8N_IMAGES = args.n8n
+            app.USE_N8N_FINAL = True  # il mock restituisce un MP4 finto: niente ffmpeg locale
+            app.FONT_MAP = {k: os.path.join(os.path.dirname(APPS[name]), os.path.basename(v)) for k, v in app.FONT_MAP.items()}
+            if app.orchestrator: app.orchestrator.comfy_dir, app.orchestrator.storage = backend.output_dir, app.storage
+        print(f"▶️  {name}: {args.users} utenti x {args.jobs} job")
+        res = run_scenario(name, app, backends, args.users, args.jobs, workdir)
+        print_report(name, res, load_previous(args.out, config, name))
+        record["scenarios"][name] = res
+
+    if not args.no_save:
+        save(args.out, record)
+        print(f"\n💾 Salvato in {args.out}")
+    return record
+
+
+if __name__ == "__main__":
+    main()
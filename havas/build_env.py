@@ -0,0 +1,380 @@
+"""
+🧱 Ambiente ComfyUI al cold start: nodi con commit fissato, lockfile unico, cache wheel
+
+    python -m havas.build_env --nodes workflows/aliexpress/custom_nodes.txt --comfy-dir /tmp/comfyui
+
+Sostituisce rm -rf + git clone di ogni nodo, i pip install -r uno per uno e
+cm-cli.py restore-dependencies degli install.sh:
+
+1. nodi     clone/checkout in parallelo; un nodo viene toccato solo se il suo
+            commit fissato è cambiato (senza pin resta quello già in cache:
+            HEAD remoto solo alla prima installazione o con --update)
+2. lock     requirements di ComfyUI + di tutti i nodi risolti INSIEME con pip
+            (--dry-run --report) in un lockfile; il lock è in cache per
+            (requirements, python, pacchetti già presenti)
+3. wheel    solo le wheel che mancano nella cache (riusabile tra un pod e
+            l'altro) vengono scaricate/compilate, in parallelo
+4. install  pip install --no-index dalla cache; saltato se l'ambiente è già
+            quello dell'ultimo run
+5. setup    install.py solo dei nodi cambiati
+
+Manifest nodi: una riga `nome|repo|commit` (# = commento, commit opzionale;
+`--pin` scrive i commit installati, o l'HEAD remoto dei nodi non installati). Tempi per fase a fine run e nella trace
+JSONL di havas.metrics.
+"""
+
+import os
+import re
+import sys
+import json
+import shutil
+import hashlib
+import logging
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from havas.metrics import Trace
+
+log = logging.getLogger(__name__)
+
+COMFY_DIR = "/tmp/comfyui"
+# Su RunPod /workspace sopravvive al pod (se c'è un volume): lì la cache vale tra un boot e l'altro
+CACHE_DIR = os.environ.get("HAVAS_CACHE_DIR") or ("/workspace/.havas-cache" if os.path.isdir("/workspace") else "/tmp/havas-cache")
+STATE_FILE = ".havas_env.json"
+WORKERS = 6
+
+
+class BuildError(Exception):
+    pass
+
+
+def run(cmd, cwd=None, timeout=1800):
+    res = subprocess.run(cmd, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=timeout)
+    if res.returncode != 0:
+        raise BuildError(f"{' '.join(cmd[:4])}... ({res.returncode}): {res.stderr.strip()[-600:]}")
+    return res.stdout
+
+
+def sha256_text(*parts):
+    h = hashlib.sha256()
+    for p in parts: h.update(p.encode("utf-8") + b"\0")
+    return h.hexdigest()
+
+
+def normalize(name):
+    return re.sub(r"[-_.]+", "_", name).lower()
+
+
+# ========================================
+# MANIFEST E STATO
+# ========================================
+
+def parse_nodes(path):
+    nodes = []
+    with open(path, "r", encoding="utf-8") as f:
+        for n, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"): continue
+            parts = [p.strip() for p in line.split("|")] + [""]
+            if not parts[0] or not parts[1]: raise BuildError(f"{path}:{n}: servono almeno nome|repo")
+            nodes.append({"name": parts[0], "repo": parts[1], "commit": parts[2] or None})
+    return nodes
+
+
+def load_state(comfy_dir):
+    try:
+        with open(os.path.join(comfy_dir, STATE_FILE), "r") as f: return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(comfy_dir, state):
+    path = os.path.join(comfy_dir, STATE_FILE)
+    with open(path + ".tmp", "w") as f: json.dump(state, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+# ========================================
+# 1. NODI
+# ========================================
+
+def remote_head(repo):
+    out = run(["git", "ls-remote", repo, "HEAD"], timeout=60)
+    return out.split()[0] if out.strip() else None
+
+
+def local_head(path):
+    if not os.path.isdir(os.path.join(path, ".git")): return None
+    try: return run(["git", "rev-parse", "HEAD"], cwd=path, timeout=30).strip()
+    except BuildError: return None
+
+
+def checkout(repo, commit, dest):
+    """Clone shallow in dest (solo quel commit se fissato: GitHub permette il fetch per sha)."""
+    tmp = f"{dest}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    if commit:
+        os.makedirs(tmp)
+        run(["git", "init", "-q"], cwd=tmp)
+        run(["git", "remote", "add", "origin", repo], cwd=tmp)
+        run(["git", "fetch", "-q", "--depth", "1", "origin", commit], cwd=tmp, timeout=600)
+        run(["git", "checkout", "-q", "FETCH_HEAD"], cwd=tmp)
+    else:
+        run(["git", "clone", "-q", "--depth", "1", repo, tmp], timeout=600)
+    shutil.rmtree(dest, ignore_errors=True)
+    os.replace(tmp, dest)
+
+
+def sync_node(node, nodes_dir, cache_dir=CACHE_DIR, update=False):
+    """Porta il nodo al commit voluto. Ritorna (commit, cambiato).
+
+    La copia in cache_dir/nodes sopravvive al pod: a commit invariato il
+    nodo si copia da lì invece di riclonarlo. Un nodo senza pin resta al
+    commit già installato/in cache: niente ls-remote a ogni boot e niente
+    push upstream che cambia l'ambiente di nascosto (update=True riallinea).
+    """
+    path = os.path.join(nodes_dir, node["name"])
+    cached = os.path.join(cache_dir, "nodes", node["name"])
+    have, head = local_head(path), local_head(cached)
+    want = node["commit"] or (None if update else have or head) or remote_head(node["repo"])
+    if have and want and have.startswith(want): return have, False
+    if not (head and want and head.startswith(want)):
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        checkout(node["repo"], node["commit"], cached)
+    tmp = f"{path}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    shutil.copytree(cached, tmp, symlinks=True)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp, path)
+    return local_head(path), True
+
+
+def sync_nodes(nodes, nodes_dir, cache_dir=CACHE_DIR, workers=WORKERS, update=False):
+    os.makedirs(nodes_dir, exist_ok=True)
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(sync_node, node, nodes_dir, cache_dir, update): node for node in nodes}
+        for fut, node in futures.items():
+            try:
+                commit, changed = fut.result()
+                results[node["name"]] = {"commit": commit, "changed": changed}
+                print(f"{'📥 Aggiornato' if changed else '✓ Invariato'}: {node['name']} @ {(commit or '?')[:10]}")
+            except Exception as e:
+                results[node["name"]] = {"commit": None, "changed": False, "error": str(e)}
+                print(f"✗ {node['name']}: {e}")
+    return results
+
+
+# ========================================
+# 2-4. REQUIREMENTS: LOCK, WHEEL, INSTALL
+# ========================================
+
+def requirement_files(comfy_dir, nodes):
+    files = [os.path.join(comfy_dir, "requirements.txt")]
+    files += [os.path.join(comfy_dir, "custom_nodes", n["name"], "requirements.txt") for n in nodes]
+    return [f for f in files if os.path.exists(f)]
+
+
+def interpreter(python):
+    """(sys.version, tag ABI-piattaforma) dell'interprete di ComfyUI, non di chi esegue il builder."""
+    out = run([python, "-c", "import sys, sysconfig; print(sys.implementation.cache_tag + '-' + sysconfig.get_platform()); "
+                             "print(sys.version)"], timeout=60)
+    tag, _, version = out.partition("\n")
+    return version.strip(), re.sub(r"[^A-Za-z0-9_.-]", "_", tag.strip())
+
+
+def pip_freeze(python):
+    return run([python, "-m", "pip", "freeze", "--all"], timeout=120)
+
+
+def resolve_lock(python, req_files, lock_path):
+    """Risoluzione unica di tutti i requirements: solo i pacchetti da installare, con versione esatta."""
+    report = lock_path + ".report.json"
+    cmd = [python, "-m", "pip", "install", "--dry-run", "--quiet", "--report", report]
+    for f in req_files: cmd += ["-r", f]
+    run(cmd)
+    with open(report, "r") as f: data = json.load(f)
+    os.remove(report)
+    lines = []
+    for item in data.get("install", []):
+        meta = item["metadata"]
+        line = f"{meta['name']}=={meta['version']}"
+        if item.get("is_direct"): line += f"  # {direct_ref(item.get('download_info') or {})}"
+        lines.append(line)
+    tmp = lock_path + ".tmp"
+    with open(tmp, "w") as f: f.write("\n".join(sorted(lines, key=str.lower)) + ("\n" if lines else ""))
+    os.replace(tmp, lock_path)
+    return lines
+
+
+def direct_ref(info):
+    """URL installabile di un requisito diretto del report pip (git con commit esatto)."""
+    vcs = info.get("vcs_info")
+    if vcs: return f"{vcs['vcs']}+{info['url']}@{vcs['commit_id']}"
+    return info.get("url", "")
+
+
+def read_lock(lock_path):
+    with open(lock_path, "r") as f:
+        return [line.rstrip("\n") for line in f if line.strip() and not line.startswith("#")]
+
+
+def cached_wheels(wheel_dir):
+    have = set()
+    for name in os.listdir(wheel_dir) if os.path.isdir(wheel_dir) else []:
+        if name.endswith(".whl"):
+            dist, version = name.split("-")[:2]
+            have.add((normalize(dist), version))
+    return have
+
+
+def build_wheels(python, lock, wheel_dir, workers=WORKERS):
+    """Scarica/compila in parallelo solo le wheel che non sono già in cache."""
+    os.makedirs(wheel_dir, exist_ok=True)
+    have = cached_wheels(wheel_dir)
+    missing = []
+    for line in lock:
+        spec, _, comment = line.partition("  # ")
+        name, version = spec.split("==", 1)
+        if (normalize(name), version) in have: continue
+        missing.append(f"{name} @ {comment}" if comment else spec)
+
+    def wheel(req):
+        run([python, "-m", "pip", "wheel", "--quiet", "--no-deps", "--wheel-dir", wheel_dir,
+             "--find-links", wheel_dir, req])
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool: list(pool.map(wheel, missing))
+    return len(missing)
+
+
+def install_lock(python, lock, wheel_dir):
+    if not lock: return
+    reqs = [line.partition("  # ")[0] for line in lock]
+    run([python, "-m", "pip", "install", "--quiet", "--no-index", "--no-deps", "--find-links", wheel_dir] + reqs)
+
+
+# ========================================
+# 5. SETUP DEI NODI CAMBIATI
+# ========================================
+
+def run_node_setup(python, nodes_dir, names):
+    """install.py in sequenza: spesso fanno pip install, che non regge run concorrenti."""
+    failed = []
+    for name in names:
+        script = os.path.join(nodes_dir, name, "install.py")
+        if not os.path.exists(script): continue
+        print(f"⚙️ Configuro nodo: {name}")
+        try: run([python, "install.py"], cwd=os.path.dirname(script))
+        except BuildError as e:
+            print(f"⚠️ install.py di {name}: {e}")
+            failed.append(name)
+    return failed
+
+
+# ========================================
+# BUILD
+# ========================================
+
+def build(nodes, comfy_dir=COMFY_DIR, cache_dir=CACHE_DIR, python=sys.executable, workers=WORKERS, force=False, update=False):
+    nodes_dir = os.path.join(comfy_dir, "custom_nodes")
+    state = {} if force else load_state(comfy_dir)
+    installed = state.get("nodes", {})
+
+    with Trace("build-env", comfy_dir=comfy_dir) as trace:
+        with trace.span("nodes"):
+            synced = sync_nodes(nodes, nodes_dir, cache_dir, workers, update)
+        failed = [k for k, v in synced.items() if v.get("error")]
+        # Da (ri)configurare: aggiornati ora, o mai arrivati in fondo al setup
+        changed = [k for k, v in synced.items()
+                   if not v.get("error") and (v["changed"] or installed.get(k, {}).get("commit") != v["commit"])]
+
+        req_files = requirement_files(comfy_dir, nodes)
+        reqs_blob = "".join(open(f, "r", encoding="utf-8", errors="replace").read() for f in req_files)
+        with trace.span("freeze"):
+            version, tag = interpreter(python)
+            freeze = pip_freeze(python)
+        env_key = sha256_text(reqs_blob, version, freeze)
+        # Wheel in cache per interprete: una cp311 non vale per un ComfyUI cp312 (il volume sopravvive ai pod)
+        wheel_dir = os.path.join(cache_dir, "wheels", tag)
+
+        if state.get("env") == env_key:
+            print("✓ Requirements invariati: niente pip")
+        else:
+            lock_path = os.path.join(cache_dir, "locks", f"{env_key[:16]}.lock")
+            os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+            with trace.span("lock"):
+                if os.path.exists(lock_path):
+                    lock = read_lock(lock_path)
+                    print(f"✓ Lock in cache: {lock_path} ({len(lock)} pacchetti)")
+                else:
+                    lock = resolve_lock(python, req_files, lock_path)
+                    print(f"🔒 Lock risolto: {lock_path} ({len(lock)} pacchetti da installare)")
+            with trace.span("wheels"):
+                built = build_wheels(python, lock, wheel_dir, workers)
+            print(f"📦 Wheel: {len(lock) - built} dalla cache, {built} nuove")
+            with trace.span("install"):
+                install_lock(python, lock, wheel_dir)
+            trace.set(packages=len(lock), wheels_built=built)
+
+        with trace.span("setup"):
+            failed += run_node_setup(python, nodes_dir, changed)
+
+        # Stato: commit configurati + impronta dell'ambiente risultante
+        for name, res in synced.items():
+            if name not in failed and res.get("commit"): installed[name] = {"commit": res["commit"]}
+        save_state(comfy_dir, {"nodes": installed, "env": sha256_text(reqs_blob, version, pip_freeze(python))})
+        trace.set(nodes=len(nodes), changed=len(changed), failed=failed)
+        if failed: trace.fail(f"nodi falliti: {', '.join(failed)}")
+
+    spans = {s["name"]: s["seconds"] for s in trace.spans}
+    print("⏱️ " + "  ".join(f"{k} {v:.1f}s" for k, v in spans.items()) + f"  | totale {sum(spans.values()):.1f}s")
+    return {"nodes": synced, "changed": changed, "failed": failed, "timings": spans}
+
+
+def pin_nodes(path, comfy_dir=COMFY_DIR):
+    """Scrive nel manifest il commit dei nodi senza pin: quello installato, o l'HEAD remoto."""
+    nodes_dir = os.path.join(comfy_dir, "custom_nodes")
+    out, pinned = [], 0
+    with open(path, "r", encoding="utf-8") as f: raw = f.read().splitlines()
+    for line in raw:
+        parts = [p.strip() for p in line.split("|")]
+        if line.strip() and not line.strip().startswith("#") and len(parts) >= 2 and not (parts[2:] and parts[2]):
+            commit = local_head(os.path.join(nodes_dir, parts[0])) or remote_head(parts[1])
+            if commit:
+                line = f"{parts[0]}|{parts[1]}|{commit}"
+                pinned += 1
+        out.append(line)
+    with open(path + ".tmp", "w", encoding="utf-8") as f: f.write("\n".join(out) + "\n")
+    os.replace(path + ".tmp", path)
+    return pinned
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Ambiente ComfyUI: nodi, lockfile unico, cache wheel")
+    ap.add_argument("--nodes", action="append", required=True, help="manifest nome|repo|commit (ripetibile)")
+    ap.add_argument("--comfy-dir", default=COMFY_DIR)
+    ap.add_argument("--cache-dir", default=CACHE_DIR)
+    ap.add_argument("--python", default=sys.executable, help="interprete di ComfyUI")
+    ap.add_argument("--workers", type=int, default=WORKERS)
+    ap.add_argument("--force", action="store_true", help="ignora lo stato del run precedente")
+    ap.add_argument("--update", action="store_true", help="riallinea all'HEAD remoto i nodi senza commit fissato")
+    ap.add_argument("--pin", action="store_true", help="scrive nei manifest i commit installati (o l'HEAD remoto), senza build")
+    args = ap.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    if args.pin:
+        for path in args.nodes: print(f"📌 {path}: {pin_nodes(path, args.comfy_dir)} nodi fissati")
+        return 0
+    nodes, seen = [], set()
+    for path in args.nodes:
+        for node in parse_nodes(path):
+            if node["name"] not in seen:
+                seen.add(node["name"])
+                nodes.append(node)
+    res = build(nodes, args.comfy_dir, args.cache_dir, args.python, args.workers, args.force, args.update)
+    return 1 if res["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
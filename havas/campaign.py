@@ -0,0 +1,339 @@
+"""
+🏭 Campagna AliExpress in pipeline: immagini -> video -> video finale
+
+    python -m havas.campaign --manifest campagna.jsonl --out ./campagna
+    python -m havas.campaign --manifest campagna.csv --out ./campagna --images 2 --videos 4 --finals 2
+
+I tre step dell'app usano risorse diverse (GPU ComfyUI, Kling remoto, CPU
+locale per ffmpeg): qui ogni prodotto passa da uno stadio all'altro con una
+coda limitata in mezzo, così le varianti del prodotto N+1 si generano mentre
+il prodotto N è su Kling o in ffmpeg. Ogni stadio ha il suo numero di worker;
+se lo stadio dopo è pieno il worker aspetta (niente accumulo illimitato).
+
+Manifest JSONL, una riga per prodotto:
+
+    {"image": "sku1.jpg", "prompt": "...", "seed": 42, "variant": 0,
+     "video_prompt": "Cinematic zoom", "lines": [["SALDI", "Bold"], ["fino al -50%", "Normal"]],
+     "text_foot": "Solo su AliExpress", "x_head": 50, "y_head": 15, "x_foot": 50, "y_foot": 85}
+
+oppure CSV con colonne image, prompt, seed, variant, video_prompt, headline
+(righe separate da "|": la prima in Bold, le altre Normal), text_foot.
+
+Il giornale campaign_state.jsonl in --out segna ogni stadio completato: al
+riavvio un prodotto riparte dal primo stadio che gli manca. In --out:
+images/ (variante scelta), video/ (video base) e i video finali.
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import shutil
+import asyncio
+import hashlib
+import logging
+import argparse
+
+from havas import overlays
+from havas.batch import BatchJournal
+from havas.client import COMFY_URL, FAL_URL, N8N_URL, AsyncFalClient, get_n8n_client
+from havas.dispatch import Dispatcher, parse_urls
+from havas.final_jobs import FinalJobManager
+from havas.orchestrator import ImageOrchestrator, COMFY_DIR
+from havas.uploads import file_digest
+from havas.video_jobs import VideoJobManager
+from havas.workflows import get_template, get_preprocess
+
+log = logging.getLogger(__name__)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMAGES_WORKFLOW = os.path.join(ROOT, "workflows", "aliexpress", "aliexpress_api.json")
+STATE_FILE = "campaign_state.jsonl"
+STAGES = ("images", "video", "final")
+STAGE_ICONS = {"images": "🖼️", "video": "🎬", "final": "✍️"}
+CONCURRENCY = {"images": 2, "video": 4, "final": 2}
+QUEUE_SIZE = 2            # prodotti in attesa tra uno stadio e il successivo
+REPORT_EVERY = 2.0
+DEFAULT_VIDEO_PROMPT = "Cinematic zoom"
+LAYOUT_KEYS = ("x_head", "y_head", "x_foot", "y_foot")
+
+
+class CampaignError(Exception):
+    pass
+
+
+# ========================================
+# MANIFEST
+# ========================================
+
+def parse_lines(value):
+    """[(testo, font)] da lista JSON (stringhe o coppie) o da "riga 1|riga 2"; senza font: Bold la prima, Normal le altre."""
+    if isinstance(value, str): value = [t.strip() for t in value.split("|")]
+    lines = []
+    for i, line in enumerate(value or []):
+        text, font = (line, None) if isinstance(line, str) else (line[0], line[1] if len(line) > 1 else None)
+        lines.append((text, font or ("Bold" if i == 0 else "Normal")))
+    return lines
+
+
+def load_campaign(manifest):
+    base = os.path.dirname(os.path.abspath(manifest))
+    if manifest.endswith(".jsonl"):
+        with open(manifest, "r", encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+    else:
+        with open(manifest, "r", encoding="utf-8", newline="") as f:
+            rows = list(csv.DictReader(f))
+    items = []
+    for row in rows:
+        s = row.get("seed")
+        item = {"image": os.path.join(base, row["image"]), "prompt": row["prompt"],
+                "seed": int(s) if s not in (None, "") else None, "variant": int(row.get("variant") or 0),
+                "video_prompt": row.get("video_prompt") or DEFAULT_VIDEO_PROMPT,
+                "lines": parse_lines(row.get("lines") or row.get("headline")), "text_foot": row.get("text_foot") or ""}
+        item.update({k: float(row[k]) for k in LAYOUT_KEYS if row.get(k) not in (None, "")})
+        items.append(item)
+    return items
+
+
+async def wait_outputs(manager, job_id):
+    """Output del job; se la campagna viene interrotta il job viene annullato (ComfyUI / fal)."""
+    try:
+        snap = await manager.wait(job_id)
+    except asyncio.CancelledError:
+        await manager.cancel(job_id)
+        raise
+    if snap["status"] != "done": raise CampaignError(snap["error"] or snap["message"])
+    return snap["outputs"]
+
+
+# ========================================
+# RUNNER
+# ========================================
+
+class CampaignRunner:
+    def __init__(self, images, videos, finals, out_dir, concurrency=None, queue_size=QUEUE_SIZE, n8n=None):
+        # videos = None: video base dal webhook n8n (come l'app senza FAL_KEY)
+        self.images = images
+        self.videos = videos
+        self.finals = finals
+        self.out_dir = out_dir
+        self.concurrency = dict(CONCURRENCY, **(concurrency or {}))
+        self.queue_size = queue_size
+        self.n8n = n8n
+        self.queues = {}
+        self.stages = {}
+        self.totals = {}
+        self.start = None
+
+    def item_id(self, n, item):
+        blob = json.dumps([n, file_digest(item["image"]), {k: v for k, v in item.items() if k != "image"}], sort_keys=True)
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()[:16]
+
+    def output_path(self, task, folder, ext):
+        stem = os.path.splitext(os.path.basename(task["item"]["image"]))[0]
+        path = os.path.join(self.out_dir, folder, f"{task['n']:05d}_{stem}{ext}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def _entry(self, rec):
+        """Primo stadio che manca a un prodotto del giornale (None = già finito)."""
+        for stage in reversed(STAGES):
+            if rec.get(stage) and os.path.exists(rec[stage]):
+                i = STAGES.index(stage) + 1
+                return STAGES[i] if i < len(STAGES) else None
+        return STAGES[0]
+
+    async def arun(self, items, on_stats=None, every=REPORT_EVERY):
+        """Esegue la campagna; on_stats(snapshot) ogni `every` secondi e alla fine."""
+        os.makedirs(self.out_dir, exist_ok=True)
+        journal = BatchJournal(os.path.join(self.out_dir, STATE_FILE))
+        self.start = time.time()
+        self.queues = {s: asyncio.Queue(self.queue_size) for s in STAGES}
+        self.stages = {s: {"done": 0, "errors": 0, "active": 0, "blocked": 0, "busy": 0.0} for s in STAGES}
+        self.totals = {"total": len(items), "done": 0, "skipped": 0, "resumed": 0}
+        workers = [asyncio.ensure_future(self._worker(s, journal)) for s in STAGES for _ in range(self.concurrency[s])]
+        reporter = asyncio.ensure_future(self._report(on_stats, every)) if on_stats else None
+        try:
+            for n, item in enumerate(items):
+                item_id = self.item_id(n, item)
+                rec = journal.get(item_id) or {}
+                stage = self._entry(rec)
+                if stage is None:
+                    self.totals["skipped"] += 1
+                    continue
+                if stage != STAGES[0]: self.totals["resumed"] += 1
+                task = {"n": n, "id": item_id, "item": item}
+                task.update({k: rec[k] for k in (*STAGES, "source") if rec.get(k)})
+                await self.queues[stage].put(task)
+            # Un worker segna task_done solo dopo aver passato il prodotto allo stadio successivo
+            for s in STAGES: await self.queues[s].join()
+        finally:
+            for t in workers + ([reporter] if reporter else []): t.cancel()
+            await asyncio.gather(*workers, *([reporter] if reporter else []), return_exceptions=True)
+            journal.close()
+        st = self.snapshot()
+        if on_stats: on_stats(st)
+        return st
+
+    async def _worker(self, stage, journal):
+        q, st = self.queues[stage], self.stages[stage]
+        nxt = STAGES[STAGES.index(stage) + 1] if stage != STAGES[-1] else None
+        run = getattr(self, f"_{stage}")
+        while True:
+            task = await q.get()
+            st["active"] += 1
+            t0 = time.time()
+            try:
+                path = await run(task)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning(f"🏭 {os.path.basename(task['item']['image'])}: {stage} fallito: {e}")
+                journal.write(task["id"], status="error", stage=stage, error=str(e))
+                st["errors"] += 1
+                path = None
+            finally:
+                st["active"] -= 1
+                st["busy"] += time.time() - t0
+            if path is not None:
+                task[stage] = path
+                extra = {"source": task["source"]} if stage == "images" else {}
+                journal.write(task["id"], status=stage, **{stage: path}, **extra)
+                st["done"] += 1
+                if nxt is None:
+                    self.totals["done"] += 1
+                else:
+                    # Stadio successivo pieno: questo worker aspetta (backpressure)
+                    st["blocked"] += 1
+                    try: await self.queues[nxt].put(task)
+                    finally: st["blocked"] -= 1
+            q.task_done()
+
+    # --- STADI ---
+    async def _images(self, task):
+        item = task["item"]
+        job_id = await self.images.submit(item["image"], item["prompt"], item["seed"])
+        outputs = await wait_outputs(self.images, job_id)
+        src = outputs[min(item["variant"], len(outputs) - 1)]
+        # Copia in --out: la cartella di sessione può essere ripulita prima del riavvio
+        dest = self.output_path(task, "images", os.path.splitext(src)[1])
+        await asyncio.to_thread(shutil.copyfile, src, dest)
+        task["source"] = src
+        return dest
+
+    async def _video(self, task):
+        dest = self.output_path(task, "video", ".mp4")
+        if self.videos is None: return await self._video_n8n(task, dest)
+        job_id = await self.videos.submit(task["images"], task["item"]["video_prompt"], dest)
+        return (await wait_outputs(self.videos, job_id))[0]
+
+    async def _video_n8n(self, task, dest):
+        # Il flow n8n legge la variante da output/<sessione>/<nome> di ComfyUI
+        src = task.get("source") or task["images"]
+        payload = {"session_id": os.path.basename(os.path.dirname(src)), "image_filename": os.path.basename(src),
+                   "prompt": task["item"]["video_prompt"]}
+        res = await asyncio.to_thread(self.n8n.webhook, "generate-video", json=payload)
+        if res.status_code != 200 or len(res.content) <= 1000: raise CampaignError(f"n8n video: HTTP {res.status_code}")
+        with open(dest + ".part", "wb") as f: f.write(res.content)
+        os.replace(dest + ".part", dest)
+        return dest
+
+    async def _final(self, task):
+        item = task["item"]
+        dest = self.output_path(task, "", ".mp4")
+        layout = {k: item[k] for k in LAYOUT_KEYS if k in item}
+        job_id = await self.finals.submit(task["video"], item["lines"], dest, text_foot=item["text_foot"], **layout)
+        return (await wait_outputs(self.finals, job_id))[0]
+
+    # --- STATISTICHE ---
+    def snapshot(self):
+        elapsed = time.time() - self.start
+        stages = {}
+        for s in STAGES:
+            st, slots = dict(self.stages[s]), self.concurrency[s]
+            st.update(queued=self.queues[s].qsize(), slots=slots, rate=st["done"] / elapsed * 60 if elapsed > 0 else 0.0,
+                      avg=st["busy"] / st["done"] if st["done"] else None,
+                      util=st["busy"] / (elapsed * slots) if elapsed > 0 else 0.0)
+            stages[s] = st
+        out = dict(self.totals, elapsed=elapsed, stages=stages, errors=sum(st["errors"] for st in stages.values()))
+        remaining = out["total"] - out["done"] - out["skipped"] - out["errors"]
+        rate = out["done"] / elapsed if elapsed > 0 else 0.0
+        out["eta"] = remaining / rate if rate > 0 and remaining > 0 else None
+        return out
+
+    async def _report(self, on_stats, every):
+        while True:
+            await asyncio.sleep(every)
+            on_stats(self.snapshot())
+
+
+def format_stats(st):
+    eta = f"{int(st['eta'] // 60)}m{int(st['eta'] % 60):02d}s" if st.get("eta") is not None else "--"
+    lines = [f"{st['done'] + st['skipped']}/{st['total']} prodotti pronti · {st['errors']} errori · "
+             f"{int(st['elapsed'] // 60)}m{int(st['elapsed'] % 60):02d}s · ETA {eta}"]
+    for name, s in st["stages"].items():
+        avg = f"{s['avg']:.1f}s/prodotto" if s["avg"] is not None else "--"
+        blocked = f" · {s['blocked']} fermi (stadio dopo pieno)" if s["blocked"] else ""
+        lines.append(f"   {STAGE_ICONS[name]} {name:<6} in coda {s['queued']} · attivi {s['active']}/{s['slots']} · "
+                     f"fatti {s['done']} · {s['rate']:.1f}/min · {avg} · uso {s['util'] * 100:.0f}%{blocked}")
+    return "\n".join(lines)
+
+
+# ========================================
+# CLI
+# ========================================
+
+async def run_campaign(args, items):
+    urls = [u for value in args.comfy for u in parse_urls(value)] or [COMFY_URL]
+    dispatcher = Dispatcher(urls).start()
+    images = ImageOrchestrator(None, get_template("aliexpress-images", args.workflow_file), comfy_dir=args.comfy_dir,
+                               max_concurrent=args.images, dispatcher=dispatcher, workflow="aliexpress-images",
+                               preprocess=get_preprocess("aliexpress-images"))
+    fal_key = os.environ.get("FAL_KEY")
+    fal = AsyncFalClient(os.environ.get("FAL_URL", FAL_URL), key=fal_key) if fal_key else None
+    videos = VideoJobManager({"fal": fal}, limits={"fal": args.videos}) if fal else None
+    fonts = dict(overlays.FONT_MAP, **dict(spec.split("=", 1) for spec in args.font))
+    finals = FinalJobManager(fonts, args.footer_font, max_concurrent=args.finals)
+    runner = CampaignRunner(images, videos, finals, args.out, queue_size=args.queue, n8n=get_n8n_client(args.n8n),
+                            concurrency={"images": args.images, "video": args.videos, "final": args.finals})
+    print(f"🏭 {len(items)} prodotti -> {args.out} (video: {'fal.ai' if videos else 'n8n'})")
+    last = [None]
+
+    def show(st):
+        text = format_stats(st)
+        if text != last[0]: print(text)
+        last[0] = text
+
+    try:
+        return await runner.arun(items, on_stats=show)
+    finally:
+        for b in dispatcher.backends: await b.aclient.close()
+        if fal is not None: await fal.close()
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Campagna AliExpress in pipeline (immagini -> video -> finale)")
+    ap.add_argument("--manifest", required=True, help="JSONL o CSV, un prodotto per riga")
+    ap.add_argument("--out", required=True, help="cartella della campagna (stessa cartella = riprende)")
+    ap.add_argument("--comfy", action="append", default=[], help=f"URL ComfyUI, ripetibile o separati da virgola (default {COMFY_URL})")
+    ap.add_argument("--comfy-dir", default=COMFY_DIR, help="cartella ComfyUI locale (input/ e output/)")
+    ap.add_argument("--workflow-file", default=IMAGES_WORKFLOW, help="grafo API-format dello step immagini")
+    ap.add_argument("--n8n", default=os.environ.get("N8N_URL", N8N_URL), help="n8n per il video senza FAL_KEY")
+    ap.add_argument("--images", type=int, default=CONCURRENCY["images"], help="job immagini contemporanei")
+    ap.add_argument("--videos", type=int, default=CONCURRENCY["video"], help="video Kling contemporanei")
+    ap.add_argument("--finals", type=int, default=CONCURRENCY["final"], help="render ffmpeg contemporanei")
+    ap.add_argument("--queue", type=int, default=QUEUE_SIZE, help="prodotti in attesa tra due stadi")
+    ap.add_argument("--font", action="append", default=[], metavar="NOME=FILE", help="font delle headline (Bold, Normal)")
+    ap.add_argument("--footer-font", default=None)
+    args = ap.parse_args(argv)
+
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO, format='%(asctime)s - %(message)s')
+    items = load_campaign(args.manifest)
+    st = asyncio.run(run_campaign(args, items))
+    return 0 if not st["errors"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
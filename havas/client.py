@@ -0,0 +1,500 @@
+"""
+🔌 Client condivisi per ComfyUI e n8n (sync + asyncio)
+
+Un solo pool di connessioni keep-alive per backend, timeout per endpoint e
+retry con backoff. I frontend usano get_client() / get_n8n_client() invece di
+chiamare requests.get/post a ogni upload, submit, polling o download.
+"""
+
+import io
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from havas.metrics import Trace
+from havas.tracker import JobTracker, AsyncJobTracker
+
+log = logging.getLogger(__name__)
+
+COMFY_URL = "http://127.0.0.1:8188"
+N8N_URL = "http://127.0.0.1:5678"
+FAL_URL = "https://queue.fal.run"
+API_URL = "http://127.0.0.1:8600"
+
+# Timeout (connessione, lettura) in secondi per endpoint
+COMFY_TIMEOUTS = {
+    "default": (3, 30),
+    "upload": (3, 60),
+    "prompt": (3, 30),
+    "history": (3, 10),
+    "queue": (3, 5),
+    "view": (3, 120),
+    "interrupt": (3, 5),
+}
+
+N8N_TIMEOUTS = {
+    "default": (3, 600),
+    "generate-images-2": (3, 600),
+    "generate-video": (3, 600),
+    "generate-final-video": (3, 300),
+}
+
+FAL_TIMEOUTS = {
+    "default": (5, 30),
+    "submit": (5, 120),      # l'immagine viaggia come data URI nel body
+    "status": (5, 15),
+    "download": (5, 60),     # tra un chunk e l'altro, non sul totale
+}
+
+API_TIMEOUTS = {
+    "default": (3, 30),
+    "submit": (3, 120),      # upload dell'input nel body multipart
+    "status": (3, 10),
+    "download": (3, 60),     # tra un chunk e l'altro, non sul totale
+}
+
+POOL_SIZE = 16
+RETRIES = 3
+BACKOFF = 0.5
+RETRY_STATUS = (500, 502, 503, 504)
+
+
+class ComfyError(Exception):
+    pass
+
+
+class FalError(Exception):
+    pass
+
+
+class ApiError(Exception):
+    pass
+
+
+# ========================================
+# SYNC (requests)
+# ========================================
+
+class _PooledBackend:
+    def __init__(self, base_url, timeouts, pool_size=POOL_SIZE, retries=RETRIES, backoff=BACKOFF):
+        self.base_url = base_url.rstrip("/")
+        self.timeouts = dict(timeouts)
+        self.session = requests.Session()
+        # Le POST non vengono ripetute su errori di lettura (solo connessione / 5xx sui GET)
+        retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=RETRY_STATUS)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def timeout(self, endpoint):
+        return self.timeouts.get(endpoint, self.timeouts["default"])
+
+    def url(self, path):
+        if path.startswith("http://") or path.startswith("https://"): return path
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def request(self, method, endpoint, path, **kw):
+        kw.setdefault("timeout", self.timeout(endpoint))
+        return self.session.request(method, self.url(path), **kw)
+
+    def close(self):
+        self.session.close()
+
+
+class ComfyClient(_PooledBackend):
+    def __init__(self, base_url=COMFY_URL, timeouts=None, **kw):
+        super().__init__(base_url, timeouts or COMFY_TIMEOUTS, **kw)
+
+    def is_alive(self):
+        try: return self.request("GET", "queue", "/").status_code == 200
+        except Exception: return False
+
+    def system_stats(self):
+        """Health vero (risponde solo a server avviato, con i device visti da torch)."""
+        res = self.request("GET", "queue", "/system_stats")
+        res.raise_for_status()
+        return res.json()
+
+    def queue(self):
+        res = self.request("GET", "queue", "/queue")
+        res.raise_for_status()
+        return res.json()
+
+    def queue_size(self):
+        try:
+            data = self.queue()
+            return len(data.get("queue_pending", [])) + len(data.get("queue_running", []))
+        except Exception:
+            return 0
+
+    def upload_image(self, data, filename, overwrite=True, image_type="input", mime="image/png"):
+        """Carica bytes (o file-like) in input/ e restituisce il nome assegnato da ComfyUI."""
+        if isinstance(data, bytes): data = io.BytesIO(data)
+        files = {"image": (filename, data, mime)}
+        form = {"overwrite": "true" if overwrite else "false", "type": image_type}
+        res = self.request("POST", "upload", "/upload/image", files=files, data=form)
+        if res.status_code != 200: raise ComfyError(f"Upload fallito ({res.status_code}): {res.text}")
+        return res.json().get("name")
+
+    def submit(self, prompt, client_id=None):
+        body = {"prompt": prompt}
+        if client_id: body["client_id"] = client_id
+        res = self.request("POST", "prompt", "/prompt", data=json.dumps(body).encode("utf-8"),
+                           headers={"Content-Type": "application/json"})
+        if res.status_code != 200: raise ComfyError(res.text)
+        return res.json().get("prompt_id")
+
+    def history(self, prompt_id):
+        res = self.request("GET", "history", f"/history/{prompt_id}")
+        res.raise_for_status()
+        return res.json().get(prompt_id)
+
+    def tracker(self, **kw):
+        """JobTracker che usa il pool di questo client per il fallback in polling."""
+        return JobTracker(self.base_url, session=self.session, **kw)
+
+    def wait(self, prompt_id, tracker=None, output_nodes=None, total_nodes=None, timeout=600):
+        """Eventi del job (vedi havas.tracker); senza tracker connesso si va in polling."""
+        tracker = tracker or self.tracker()
+        return tracker.track(prompt_id, output_nodes=output_nodes, total_nodes=total_nodes, timeout=timeout)
+
+    def view(self, meta):
+        params = {"filename": meta.get("filename"), "subfolder": meta.get("subfolder", ""),
+                  "type": meta.get("type", "output")}
+        res = self.request("GET", "view", "/view", params=params)
+        res.raise_for_status()
+        return res.content
+
+    def fetch_outputs(self, outputs, types=("output",)):
+        """Scarica i file prodotti dai nodi di output: lista di (meta, bytes)."""
+        return [(meta, self.view(meta)) for meta in iter_output_files(outputs, types)]
+
+    def interrupt(self):
+        self.request("POST", "interrupt", "/interrupt")
+
+    def delete_from_queue(self, prompt_ids):
+        self.request("POST", "queue", "/queue", json={"delete": list(prompt_ids)})
+
+    def cancel(self, prompt_id):
+        """Toglie il prompt dalla coda o interrompe l'esecuzione se è già sul GPU (solo se è il suo)."""
+        q = self.queue()
+        if any(item[1] == prompt_id for item in q.get("queue_running", [])): self.interrupt()
+        else: self.delete_from_queue([prompt_id])
+
+
+class N8nClient(_PooledBackend):
+    def __init__(self, base_url=N8N_URL, timeouts=None, **kw):
+        super().__init__(base_url, timeouts or N8N_TIMEOUTS, **kw)
+
+    def webhook(self, url, **kw):
+        """POST a un webhook (URL completo o nome, es. 'generate-video')."""
+        name = url.rstrip("/").rsplit("/", 1)[-1]
+        path = url if "://" in url else f"/webhook/{url}"
+        # Il webhook n8n è tutto il job (risponde a lavoro finito): una trace con un solo span
+        with Trace(f"n8n-{name}") as trace:
+            with trace.span("webhook"):
+                res = self.request("POST", name, path, **kw)
+            if res.status_code != 200: trace.fail(f"HTTP {res.status_code}")
+            return res
+
+
+class ApiClient(_PooledBackend):
+    """Client dell'API headless (havas.api): i frontend diventano client sottili."""
+
+    def __init__(self, base_url=API_URL, timeouts=None, **kw):
+        super().__init__(base_url, timeouts or API_TIMEOUTS, **kw)
+
+    def _json(self, res):
+        if res.status_code >= 400:
+            try: msg = res.json().get("error")
+            except ValueError: msg = res.text
+            raise ApiError(f"{res.status_code}: {msg}")
+        return res.json()
+
+    def submit(self, pipeline, params=None, files=None):
+        """Crea un job; files = {nome parametro: path locale}. Restituisce lo snapshot (con "id")."""
+        handles = {name: open(path, "rb") for name, path in (files or {}).items()}
+        try:
+            parts = {name: (os.path.basename(files[name]), f) for name, f in handles.items()}
+            form = {"pipeline": pipeline, "params": json.dumps(params or {})}
+            return self._json(self.request("POST", "submit", "/jobs", data=form, files=parts))
+        finally:
+            for f in handles.values(): f.close()
+
+    def job(self, job_id):
+        return self._json(self.request("GET", "status", f"/jobs/{job_id}"))
+
+    def iter_updates(self, job_id, every=1.0, timeout=None):
+        """Snapshot del job a ogni cambiamento (polling), fino allo stato finale."""
+        deadline = None if timeout is None else time.time() + timeout
+        last = None
+        while True:
+            snap = self.job(job_id)
+            key = (snap["status"], snap["progress"], snap["message"])
+            if key != last: yield snap
+            last = key
+            if snap["status"] in ("done", "error", "cancelled"): return
+            if deadline is not None and time.time() > deadline: raise TimeoutError(f"Job {job_id} oltre {timeout}s")
+            time.sleep(every)
+
+    def download(self, job_id, dest_dir, n=0, chunk_size=1 << 20):
+        """Scarica in streaming l'output n del job in dest_dir; restituisce il path."""
+        with self.request("GET", "download", f"/jobs/{job_id}/result", params={"n": n}, stream=True) as res:
+            if res.status_code != 200: self._json(res)
+            name = res.headers.get("Content-Disposition", "").partition('filename="')[2].rstrip('"')
+            dest = os.path.join(dest_dir, name or f"{job_id}_{n}")
+            os.makedirs(dest_dir, exist_ok=True)
+            with open(f"{dest}.part", "wb") as f:
+                for chunk in res.iter_content(chunk_size): f.write(chunk)
+        os.replace(f"{dest}.part", dest)
+        return dest
+
+    def cancel(self, job_id):
+        try: return self._json(self.request("DELETE", "status", f"/jobs/{job_id}")).get("cancelled", False)
+        except Exception as e:
+            log.warning(f"Annullamento del job {job_id} fallito: {e}")
+            return False
+
+
+# --- ISTANZE CONDIVISE (una per backend, per processo) ---
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _shared(cls, base_url, **kw):
+    key = (cls.__name__, base_url.rstrip("/"))
+    with _clients_lock:
+        if key not in _clients: _clients[key] = cls(base_url, **kw)
+        return _clients[key]
+
+
+def get_client(base_url=COMFY_URL, **kw):
+    return _shared(ComfyClient, base_url, **kw)
+
+
+def get_n8n_client(base_url=N8N_URL, **kw):
+    return _shared(N8nClient, base_url, **kw)
+
+
+def get_api_client(base_url=API_URL, **kw):
+    return _shared(ApiClient, base_url, **kw)
+
+
+def iter_output_files(outputs, types=("output",)):
+    for node_out in (outputs or {}).values():
+        for key in ("images", "gifs", "videos"):
+            for meta in node_out.get(key, []) or []:
+                if meta.get("type", "output") in types: yield meta
+
+
+# ========================================
+# ASYNCIO (aiohttp)
+# ========================================
+
+class _AsyncPooledBackend:
+    error = ComfyError  # eccezione per le risposte non JSON (pagine di errore del proxy)
+
+    def __init__(self, base_url, timeouts, pool_size=POOL_SIZE, retries=RETRIES, backoff=BACKOFF):
+        if aiohttp is None: raise RuntimeError("aiohttp non installato")
+        self.base_url = base_url.rstrip("/")
+        self.timeouts = dict(timeouts)
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff = backoff
+        self.session = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def open(self):
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60)
+            self.session = aiohttp.ClientSession(connector=connector)
+        return self.session
+
+    async def close(self):
+        if self.session is not None: await self.session.close()
+        self.session = None
+
+    def timeout(self, endpoint):
+        connect, read = self.timeouts.get(endpoint, self.timeouts["default"])
+        return aiohttp.ClientTimeout(total=None, connect=connect, sock_read=read)
+
+    def url(self, path):
+        if path.startswith("http://") or path.startswith("https://"): return path
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    async def request(self, method, endpoint, path, read="json", **kw):
+        """Richiesta con retry: errori di connessione sempre, 5xx solo per i GET."""
+        session = await self.open()
+        kw.setdefault("timeout", self.timeout(endpoint))
+        for attempt in range(self.retries + 1):
+            try:
+                async with session.request(method, self.url(path), **kw) as res:
+                    if res.status in RETRY_STATUS and method == "GET" and attempt < self.retries:
+                        raise _Retry(res.status)
+                    if read == "json" and not 200 <= res.status < 300:
+                        # Un 502 del proxy RunPod è una pagina HTML: niente JSONDecodeError
+                        text = await res.text()
+                        try: return res.status, json.loads(text)
+                        except ValueError: raise self.error(f"{method} {path}: HTTP {res.status}: {text[:200].strip()}")
+                    if read == "json": body = await res.json(content_type=None)
+                    elif read == "text": body = await res.text()
+                    else: body = await res.read()
+                    return res.status, body
+            except (aiohttp.ClientConnectionError, _Retry) as e:
+                if attempt >= self.retries: raise
+                log.warning(f"{method} {path}: {e}, riprovo")
+                await asyncio.sleep(self.backoff * (2 ** attempt))
+
+
+class _Retry(Exception):
+    pass
+
+
+class AsyncComfyClient(_AsyncPooledBackend):
+    def __init__(self, base_url=COMFY_URL, timeouts=None, **kw):
+        super().__init__(base_url, timeouts or COMFY_TIMEOUTS, **kw)
+
+    async def is_alive(self):
+        try: return (await self.request("GET", "queue", "/", read="bytes"))[0] == 200
+        except Exception: return False
+
+    async def queue(self):
+        status, body = await self.request("GET", "queue", "/queue")
+        if status != 200: raise ComfyError(f"/queue: {status}")
+        return body
+
+    async def queue_size(self):
+        try:
+            data = await self.queue()
+            return len(data.get("queue_pending", [])) + len(data.get("queue_running", []))
+        except Exception:
+            return 0
+
+    async def upload_image(self, data, filename, overwrite=True, image_type="input", mime="image/png"):
+        form = aiohttp.FormData()
+        form.add_field("image", data, filename=filename, content_type=mime)
+        form.add_field("overwrite", "true" if overwrite else "false")
+        form.add_field("type", image_type)
+        status, body = await self.request("POST", "upload", "/upload/image", data=form)
+        if status != 200: raise ComfyError(f"Upload fallito ({status}): {body}")
+        return body.get("name")
+
+    async def submit(self, prompt, client_id=None):
+        body = {"prompt": prompt}
+        if client_id: body["client_id"] = client_id
+        status, res = await self.request("POST", "prompt", "/prompt", read="text", json=body)
+        if status != 200: raise ComfyError(res)
+        return json.loads(res).get("prompt_id")
+
+    async def history(self, prompt_id):
+        status, body = await self.request("GET", "history", f"/history/{prompt_id}")
+        if status != 200: raise ComfyError(f"/history: {status}")
+        return body.get(prompt_id)
+
+    async def tracker(self, **kw):
+        return AsyncJobTracker(self.base_url, await self.open(), **kw)
+
+    async def wait(self, prompt_id, tracker=None, output_nodes=None, total_nodes=None, timeout=600):
+        tracker = tracker or await self.tracker()
+        async for ev in tracker.track(prompt_id, output_nodes=output_nodes, total_nodes=total_nodes, timeout=timeout):
+            yield ev
+
+    async def view(self, meta):
+        params = {"filename": meta.get("filename"), "subfolder": meta.get("subfolder", ""),
+                  "type": meta.get("type", "output")}
+        status, body = await self.request("GET", "view", "/view", read="bytes", params=params)
+        if status != 200: raise ComfyError(f"/view: {status}")
+        return body
+
+    async def fetch_outputs(self, outputs, types=("output",)):
+        metas = list(iter_output_files(outputs, types))
+        blobs = await asyncio.gather(*(self.view(m) for m in metas))
+        return list(zip(metas, blobs))
+
+    async def interrupt(self):
+        await self.request("POST", "interrupt", "/interrupt", read="bytes")
+
+    async def delete_from_queue(self, prompt_ids):
+        await self.request("POST", "queue", "/queue", read="bytes", json={"delete": list(prompt_ids)})
+
+
+class AsyncN8nClient(_AsyncPooledBackend):
+    def __init__(self, base_url=N8N_URL, timeouts=None, **kw):
+        super().__init__(base_url, timeouts or N8N_TIMEOUTS, **kw)
+
+    async def webhook(self, url, read="json", **kw):
+        name = url.rstrip("/").rsplit("/", 1)[-1]
+        path = url if "://" in url else f"/webhook/{url}"
+        return await self.request("POST", name, path, read=read, **kw)
+
+
+class AsyncFalClient(_AsyncPooledBackend):
+    """Coda fal.ai: submit -> status_url / response_url / cancel_url restituiti dal server."""
+
+    error = FalError
+
+    def __init__(self, base_url=FAL_URL, key=None, timeouts=None, **kw):
+        super().__init__(base_url, timeouts or FAL_TIMEOUTS, **kw)
+        self.headers = {"Authorization": f"Key {key}"} if key else {}
+
+    async def submit(self, model, payload):
+        status, body = await self.request("POST", "submit", f"/{model}", headers=self.headers, json=payload)
+        if status not in (200, 201, 202): raise FalError(f"fal submit ({status}): {body}")
+        return body
+
+    async def status(self, status_url):
+        status, body = await self.request("GET", "status", status_url, headers=self.headers)
+        if status not in (200, 202): raise FalError(f"fal status ({status}): {body}")
+        return body
+
+    async def result(self, response_url):
+        status, body = await self.request("GET", "status", response_url, headers=self.headers)
+        if status != 200: raise FalError(f"fal result ({status}): {body}")
+        return body
+
+    async def cancel(self, cancel_url):
+        status, _ = await self.request("PUT", "status", cancel_url, read="bytes", headers=self.headers)
+        return status in (200, 202)
+
+    async def stream_to(self, url, dest, chunk_size=1 << 18, on_chunk=None):
+        """Scarica url in dest a chunk (file .part + rename). Ritorna i byte scritti."""
+        session = await self.open()
+        tmp = f"{dest}.part"
+        written = 0
+        try:
+            async with session.get(self.url(url), timeout=self.timeout("download")) as res:
+                if res.status != 200: raise FalError(f"Download {url}: {res.status}")
+                total = res.content_length
+                with open(tmp, "wb") as f:
+                    async for chunk in res.content.iter_chunked(chunk_size):
+                        f.write(chunk)
+                        written += len(chunk)
+                        if on_chunk: on_chunk(written, total)
+            if total is not None and written != total:
+                raise FalError(f"Download {url} incompleto: {written}/{total} byte")
+            os.replace(tmp, dest)
+        except BaseException as e:
+            # Niente .part orfani (anche su cancel del job)
+            try: os.remove(tmp)
+            except FileNotFoundError: pass
+            if isinstance(e, aiohttp.ClientPayloadError): raise FalError(f"Download {url} interrotto: {e}") from e
+            raise
+        return written
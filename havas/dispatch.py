@@ -0,0 +1,306 @@
+"""
+🔀 Dispatcher su più istanze ComfyUI (più pod = più GPU dietro lo stesso frontend)
+
+    COMFY_URLS=http://pod-a:8188,http://pod-b:8188 python app.py
+
+Ogni job prende in prestito (lease) un backend e fa tutto lì: upload, submit,
+tracking e download degli output. La scelta va all'istanza sana con l'attesa
+stimata più bassa:
+
+    (lavori in coda + in volo) x tempo medio di esecuzione del workflow
+    + penalità se il workflow non ha ancora i modelli caricati su quel pod
+
+La coda viene letta da /queue ogni `poll` secondi (thread in background), il
+tempo medio è una media mobile dei job eseguiti lì. Se un'istanza smette di
+rispondere viene marcata down (e dimentica i modelli caricati); il job in
+corso su di lei solleva BackendDown e il chiamante lo rilancia su un'altra.
+
+Con un solo URL si comporta come il client singolo di prima. Il dispatcher
+espone is_ready / wait / iter_wait / describe come havas.readiness, così i
+frontend lo usano al posto di una Readiness singola.
+"""
+
+import time
+import asyncio
+import logging
+import threading
+from urllib.parse import urlparse
+
+import requests
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from havas.client import get_client, ComfyError, AsyncComfyClient
+from havas.readiness import Readiness
+from havas.uploads import InputUploader, AsyncInputUploader
+
+log = logging.getLogger(__name__)
+
+POLL = 1.0
+PROBE_AFTER = 10.0      # un backend down torna candidato dopo questi secondi (anche senza poller)
+COLD_PENALTY = 30.0     # secondi stimati per caricare i modelli di un workflow mai eseguito lì
+DEFAULT_EXEC = 20.0     # tempo di esecuzione ipotizzato prima di averne misurato uno
+EWMA = 0.3
+UNREACHABLE_LIMIT = 5   # eventi "unreachable" di fila dal tracker = backend morto
+POLL_TIMEOUT = (1, 5)
+
+
+class BackendDown(Exception):
+    def __init__(self, url, cause=None):
+        super().__init__(f"{url} non risponde" + (f" ({cause})" if cause else ""))
+        self.url = url
+
+
+def is_down_error(e):
+    """Errori che indicano un backend irraggiungibile (non un errore del workflow)."""
+    if isinstance(e, (BackendDown, requests.ConnectionError, requests.Timeout, ConnectionError, asyncio.TimeoutError)):
+        return True
+    return aiohttp is not None and isinstance(e, aiohttp.ClientConnectionError)
+
+
+def parse_urls(value):
+    return [u.strip().rstrip("/") for u in (value or "").split(",") if u.strip()]
+
+
+# ========================================
+# BACKEND
+# ========================================
+
+class Backend:
+    def __init__(self, url, client=None, uploader=None, aclient=None, auploader=None):
+        self.url = url.rstrip("/")
+        self._client, self._uploader = client, uploader
+        self._aclient, self._auploader = aclient, auploader
+        self.local = urlparse(self.url).hostname in ("127.0.0.1", "localhost")
+        self.healthy = True          # ottimista finché il poller o un errore non dicono il contrario
+        self.down_since = None
+        self.depth = 0               # pending + running letti da /queue
+        self.inflight = 0            # lease aperti da questo processo
+        self.exec_time = {}          # workflow -> media mobile dei secondi di esecuzione
+        self.loaded = set()          # workflow già eseguiti (modelli in VRAM) dall'ultimo avvio
+        self.last_pick = 0.0
+        self.readiness = None
+
+    @property
+    def client(self):
+        if self._client is None: self._client = get_client(self.url)
+        return self._client
+
+    @property
+    def uploader(self):
+        if self._uploader is None: self._uploader = InputUploader(self.client)
+        return self._uploader
+
+    @property
+    def aclient(self):
+        if self._aclient is None: self._aclient = AsyncComfyClient(self.url)
+        return self._aclient
+
+    @property
+    def auploader(self):
+        if self._auploader is None: self._auploader = AsyncInputUploader(self.aclient)
+        return self._auploader
+
+    def available(self):
+        return self.healthy and (self.readiness is None or self.readiness.is_ready())
+
+    def estimate(self, workflow):
+        """Secondi stimati prima che un nuovo job di `workflow` finisca qui."""
+        times = self.exec_time
+        avg = times.get(workflow) or (sum(times.values()) / len(times) if times else DEFAULT_EXEC)
+        wait = (max(self.depth, self.inflight) + 1) * avg
+        if workflow not in self.loaded: wait += COLD_PENALTY
+        return wait
+
+    def describe(self, workflow=None):
+        state = "🟢" if self.available() else ("🔥" if self.healthy else "🔴")
+        eta = f", ~{self.estimate(workflow):.0f}s" if workflow else ""
+        return f"{state} {self.url}: {self.depth} in coda, {self.inflight} in volo{eta}"
+
+
+class Lease:
+    """Un job su un backend: `with dispatcher.lease(workflow) as node:` e poi node.client / node.uploader."""
+
+    def __init__(self, dispatcher, backend, workflow):
+        self.dispatcher = dispatcher
+        self.backend = backend
+        self.workflow = workflow
+        self.url = backend.url
+        self.seconds = None
+        self._started = None
+        self._unreachable = 0
+        self._released = False
+
+    client = property(lambda self: self.backend.client)
+    uploader = property(lambda self: self.backend.uploader)
+    aclient = property(lambda self: self.backend.aclient)
+    auploader = property(lambda self: self.backend.auploader)
+
+    def observe(self, ev):
+        """Da chiamare su ogni evento del tracker: misura l'esecuzione e alza BackendDown se il pod è morto."""
+        t = ev["type"]
+        if t in ("started", "executing", "progress") and self._started is None: self._started = time.time()
+        if t == "done" and self._started is not None: self.seconds = time.time() - self._started
+        self._unreachable = self._unreachable + 1 if t == "unreachable" else 0
+        if not self.backend.healthy or self._unreachable >= UNREACHABLE_LIMIT:
+            raise BackendDown(self.url, ev.get("message"))
+
+    def watch(self, events):
+        for ev in events:
+            self.observe(ev)
+            yield ev
+
+    async def awatch(self, events):
+        async for ev in events:
+            self.observe(ev)
+            yield ev
+
+    def release(self, exc=None):
+        if self._released: return
+        self._released = True
+        self.dispatcher.release(self, exc)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release(exc)
+        # Errori di connessione del client -> BackendDown, così il chiamante sa che può riprovare altrove
+        if exc is not None and not isinstance(exc, BackendDown) and is_down_error(exc):
+            raise BackendDown(self.url, exc) from exc
+
+
+# ========================================
+# DISPATCHER
+# ========================================
+
+class Dispatcher:
+    def __init__(self, backends, poll=POLL, probe_after=PROBE_AFTER):
+        self.backends = [b if isinstance(b, Backend) else Backend(b) for b in backends]
+        if not self.backends: raise ValueError("serve almeno un backend ComfyUI")
+        self.poll = poll
+        self.probe_after = probe_after
+        self.lock = threading.Lock()
+        self.cond = threading.Condition(self.lock)
+        self.http = requests.Session()  # senza retry: un pod morto deve risultare tale subito
+        self.thread = None
+
+    def get(self, url):
+        url = (url or "").rstrip("/")
+        return next((b for b in self.backends if b.url == url), None)
+
+    # --- SCELTA ---
+    def pick(self, workflow=None, exclude=()):
+        """Backend con l'attesa stimata minore; se sono tutti down si riprova quello caduto da più tempo."""
+        with self.lock:
+            now = time.time()
+            candidates = [b for b in self.backends if b.url not in exclude]
+            if not candidates: raise ComfyError("Nessun backend ComfyUI disponibile")
+            ok = [b for b in candidates if b.available()
+                  or (not b.healthy and b.down_since and now - b.down_since >= self.probe_after)]
+            if ok:
+                best = min(ok, key=lambda b: (b.estimate(workflow), b.inflight, b.last_pick))
+            else:
+                best = min(candidates, key=lambda b: (b.down_since or 0, b.last_pick))
+            best.inflight += 1
+            best.last_pick = now
+            return best
+
+    def lease(self, workflow=None, exclude=()):
+        return Lease(self, self.pick(workflow, exclude), workflow)
+
+    def attach(self, url, workflow=None):
+        """Lease su un backend preciso (es. job ripreso dal giornale di un batch)."""
+        b = self.get(url) or self.backends[0]
+        with self.lock: b.inflight += 1
+        return Lease(self, b, workflow)
+
+    def release(self, lease, exc=None):
+        b = lease.backend
+        with self.lock:
+            b.inflight = max(0, b.inflight - 1)
+            if exc is None and lease.seconds is not None:
+                old = b.exec_time.get(lease.workflow)
+                b.exec_time[lease.workflow] = lease.seconds if old is None else old + EWMA * (lease.seconds - old)
+            if exc is None and lease.workflow: b.loaded.add(lease.workflow)
+        if exc is not None and is_down_error(exc): self.mark_down(b, exc)
+
+    def mark_down(self, backend, reason=None):
+        with self.cond:
+            if backend.healthy:
+                log.warning(f"🔴 Backend {backend.url} down: {reason}")
+                backend.down_since = time.time()
+            backend.healthy = False
+            backend.loaded.clear()  # al riavvio i modelli vanno ricaricati
+            self.cond.notify_all()
+
+    def mark_up(self, backend, depth):
+        with self.cond:
+            if not backend.healthy: log.info(f"🟢 Backend {backend.url} di nuovo raggiungibile")
+            backend.healthy, backend.down_since, backend.depth = True, None, depth
+            self.cond.notify_all()
+
+    # --- POLLER ---
+    def start(self, warmups=()):
+        """Avvia il polling di /queue e, con warmups, una Readiness (health + warm-up) per backend."""
+        if self.thread is not None: return self
+        for b in self.backends:
+            if warmups:
+                b.readiness = Readiness(b.client, warmups, uploader=b.uploader).start()
+        self.thread = threading.Thread(target=self._loop, name="havas-dispatch", daemon=True)
+        self.thread.start()
+        return self
+
+    def _loop(self):
+        while True:
+            for b in self.backends: self.refresh(b)
+            time.sleep(self.poll)
+
+    def queue(self, b):
+        """GET /queue senza retry; aggiorna salute e profondità del backend. None se non risponde."""
+        try:
+            res = self.http.get(f"{b.url}/queue", timeout=POLL_TIMEOUT)
+            res.raise_for_status()
+            data = res.json()
+        except Exception as e:
+            self.mark_down(b, e)
+            return None
+        self.mark_up(b, len(data.get("queue_pending", [])) + len(data.get("queue_running", [])))
+        return data
+
+    def refresh(self, b):
+        if self.queue(b) is not None and b.readiness is not None and b.readiness.is_ready():
+            with self.lock: b.loaded.update(b.readiness.timings)
+
+    # --- READINESS (stessa interfaccia di havas.readiness.Readiness) ---
+    def is_ready(self):
+        return any(b.available() for b in self.backends)
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        while not self.is_ready():
+            left = 1.0 if deadline is None else min(1.0, deadline - time.time())
+            if left <= 0: return False
+            with self.cond: self.cond.wait(left)
+        return True
+
+    def iter_wait(self, timeout=None, every=2.0):
+        deadline = None if timeout is None else time.time() + timeout
+        while not self.is_ready():
+            yield self.describe()
+            left = every if deadline is None else min(every, deadline - time.time())
+            if left <= 0: return
+            with self.cond: self.cond.wait(left)
+
+    def describe(self):
+        if len(self.backends) == 1:
+            b = self.backends[0]
+            return b.readiness.describe() if b.readiness is not None else b.describe()
+        ready = sum(b.available() for b in self.backends)
+        lines = [f"{ready}/{len(self.backends)} backend pronti"]
+        lines += [f"{b.url}: {b.readiness.describe()}" if b.readiness is not None and not b.readiness.is_ready()
+                  else b.describe() for b in self.backends]
+        return "\n".join(lines)
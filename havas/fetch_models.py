@@ -0,0 +1,343 @@
+"""
+📥 Download dei modelli da manifest: in parallelo, riprendibile, verificato
+
+    python -m havas.fetch_models --manifest workflows/aliexpress/models.txt --models-dir /tmp/comfyui/models
+
+Manifest (una riga per file, # = commento):
+
+    filename|url|tipo|sha256|size
+
+tipo = cartella sotto models/ (diffusion_models, loras, ...) o uno dei nomi
+di modelli.txt (checkpoint, lora, vae, text_encoder, upscale, controlnet).
+sha256 e size sono opzionali ma consigliati: `--pin` li scrive nel manifest
+a partire dai file presenti o, se mancano, dai metadati LFS di Hugging Face
+(X-Linked-Etag / X-Linked-Size, senza scaricare niente). Per le righe non
+ancora pinnate il download usa comunque l'hash LFS dichiarato dal server.
+
+Rispetto ai wget in sequenza degli install.sh:
+- più file insieme (--workers), ognuno in streaming su file.part
+- download interrotto = si riprende dal byte dove era (header Range)
+- sha256 calcolato mentre si scrive; il file prende il nome finale (rename
+  atomico) solo se hash e dimensione tornano
+- un file già presente viene saltato solo se è valido: con sha256 nel
+  manifest si ricontrolla l'hash una volta, poi fa fede il marker
+  .nome.ok accanto al file; senza sha256 si confronta la dimensione con
+  quella remota (un file troncato da un boot interrotto viene ripreso)
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+log = logging.getLogger(__name__)
+
+MODELS_DIR = "/tmp/comfyui/models"
+CHUNK = 4 * 1024 * 1024
+WORKERS = 4
+RETRIES = 5
+BACKOFF = 2.0
+TIMEOUT = (10, 60)  # connessione, lettura tra un chunk e l'altro
+
+# Tipi di modelli.txt -> cartelle ComfyUI (come get_model_dir in restart-comfyui.sh)
+TYPE_DIRS = {
+    "checkpoint": "checkpoints",
+    "lora": "loras",
+    "vae": "vae",
+    "text_encoder": "clip",
+    "upscale": "upscale_models",
+    "controlnet": "controlnet",
+}
+
+
+class FetchError(Exception):
+    pass
+
+
+# ========================================
+# MANIFEST
+# ========================================
+
+def parse_manifest(path):
+    entries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for n, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"): continue
+            try: entries.append(parse_line(line))
+            except (FetchError, ValueError) as e: raise FetchError(f"{path}:{n}: {e}")
+    return entries
+
+
+def parse_line(line):
+    parts = [p.strip() for p in line.split("|")]
+    if len(parts) < 2 or not parts[0] or not parts[1]: raise FetchError("servono almeno filename|url")
+    parts += [""] * (5 - len(parts))
+    filename, url, kind, sha256, size = parts[:5]
+    return {"filename": filename, "url": url, "type": kind, "sha256": sha256.lower() or None,
+            "size": int(size) if size else None}
+
+
+def target_path(entry, models_dir=MODELS_DIR):
+    kind = entry["type"]
+    sub = TYPE_DIRS.get(kind, kind)
+    return os.path.join(models_dir, sub, entry["filename"]) if sub else os.path.join(models_dir, entry["filename"])
+
+
+# ========================================
+# VERIFICA
+# ========================================
+
+def marker_path(path):
+    return os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.ok")
+
+
+def sha256_file(path, chunk=CHUNK):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""): h.update(block)
+    return h.hexdigest()
+
+
+def read_marker(path):
+    try:
+        with open(marker_path(path), "r") as f: return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_marker(path, entry, sha256):
+    st = os.stat(path)
+    data = {"url": entry["url"], "sha256": sha256, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    tmp = marker_path(path) + ".tmp"
+    with open(tmp, "w") as f: json.dump(data, f)
+    os.replace(tmp, marker_path(path))
+
+
+def remote_size(session, url):
+    try:
+        res = session.head(url, allow_redirects=True, timeout=TIMEOUT)
+        if res.status_code == 200 and res.headers.get("Content-Length"): return int(res.headers["Content-Length"])
+    except requests.RequestException:
+        pass
+    return None
+
+
+def remote_meta(session, url):
+    """(sha256, size) dichiarati dal server: header X-Linked-* dei file LFS di Hugging Face (None se mancano)."""
+    try:
+        res = session.head(url, headers=auth_headers(url), allow_redirects=False, timeout=TIMEOUT)
+    except requests.RequestException:
+        return None, None
+    etag = res.headers.get("X-Linked-Etag", "").removeprefix("W/").strip('"').lower()
+    size = res.headers.get("X-Linked-Size", "")
+    sha256 = etag if len(etag) == 64 and all(c in "0123456789abcdef" for c in etag) else None
+    return sha256, int(size) if size.isdigit() else None
+
+
+def is_valid(session, entry, path):
+    """True se il file finale c'è ed è quello del manifest (hash o dimensione)."""
+    if not os.path.exists(path): return False
+    st = os.stat(path)
+    if entry["size"] is not None and st.st_size != entry["size"]: return False
+    marker = read_marker(path)
+    if marker and marker.get("size") == st.st_size and marker.get("mtime_ns") == st.st_mtime_ns:
+        if entry["sha256"] is None or marker.get("sha256") == entry["sha256"]: return True
+    if entry["sha256"]:
+        digest = sha256_file(path)
+        if digest != entry["sha256"]: return False
+        write_marker(path, entry, digest)
+        return True
+    # Senza hash: dimensione attesa (manifest o Content-Length remoto)
+    expected = entry["size"] or remote_size(session, entry["url"])
+    if expected is None or st.st_size != expected: return False
+    write_marker(path, entry, None)
+    return True
+
+
+# ========================================
+# DOWNLOAD
+# ========================================
+
+def auth_headers(url):
+    token = os.environ.get("HF_TOKEN") or os.environ.get("HUGGING_FACE_HUB_TOKEN")
+    if token and "huggingface.co" in url: return {"Authorization": f"Bearer {token}"}
+    return {}
+
+
+def download(session, entry, path, chunk=CHUNK, on_progress=None):
+    """Scarica in path.part riprendendo da dove era; rename su path solo se verificato. Ritorna i byte scaricati ora."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    part = path + ".part"
+    # Un file finale non valido (es. troncato da wget) diventa il punto di ripresa
+    if os.path.exists(path) and not os.path.exists(part): os.replace(path, part)
+
+    h = hashlib.sha256()
+    offset = fetched = 0
+    if os.path.exists(part):
+        with open(part, "rb") as f:
+            for block in iter(lambda: f.read(chunk), b""):
+                h.update(block)
+                offset += len(block)
+    if entry["size"] and offset > entry["size"]:
+        # Più lungo del previsto (es. revisione vecchia con lo stesso nome): niente da riprendere
+        os.remove(part)
+        h, offset = hashlib.sha256(), 0
+
+    headers = auth_headers(entry["url"])
+    if offset: headers["Range"] = f"bytes={offset}-"
+    with session.get(entry["url"], headers=headers, stream=True, allow_redirects=True, timeout=TIMEOUT) as res:
+        if res.status_code == 416 and offset:
+            total = remote_size(session, entry["url"]) or offset  # già tutto scaricato (se la misura torna)
+            if offset > total:
+                # Range oltre la fine del file remoto: .part non suo, si riparte da zero
+                res.close()
+                os.remove(part)
+                return download(session, entry, path, chunk, on_progress)
+        elif res.status_code == 206 and offset:
+            total = offset + int(res.headers.get("Content-Length", 0)) if res.headers.get("Content-Length") else None
+        elif res.status_code == 200:
+            # Range ignorato dal server: si riparte da zero
+            h, offset = hashlib.sha256(), 0
+            total = int(res.headers["Content-Length"]) if res.headers.get("Content-Length") else None
+        else:
+            raise FetchError(f"HTTP {res.status_code}")
+
+        if res.status_code != 416:
+            with open(part, "ab" if offset else "wb") as f:
+                for block in res.iter_content(chunk):
+                    if not block: continue
+                    f.write(block)
+                    h.update(block)
+                    offset += len(block)
+                    fetched += len(block)
+                    if on_progress: on_progress(offset, total or entry["size"])
+
+    expected = entry["size"] or total
+    if expected is not None and offset != expected:
+        if offset > expected: os.remove(part)  # troppo lungo: riprenderlo non servirebbe mai
+        raise FetchError(f"incompleto ({offset}/{expected} byte)")
+    digest = h.hexdigest()
+    if entry["sha256"] and digest != entry["sha256"]:
+        os.remove(part)  # contenuto sbagliato: non ha senso riprenderlo
+        raise FetchError(f"sha256 {digest} != {entry['sha256']}")
+    os.replace(part, path)
+    write_marker(path, entry, digest)
+    return fetched
+
+
+def fetch(session, entry, models_dir=MODELS_DIR, retries=RETRIES, backoff=BACKOFF):
+    """Ritorna ("skip" | "ok", byte scaricati, secondi)."""
+    path = target_path(entry, models_dir)
+    t0 = time.time()
+    if entry["sha256"] is None:
+        # Riga non pinnata: fa da riferimento l'hash LFS dichiarato da Hugging Face
+        sha256, size = remote_meta(session, entry["url"])
+        if sha256: entry = dict(entry, sha256=sha256, size=entry["size"] or size)
+    if is_valid(session, entry, path): return "skip", 0, 0.0
+    last = None
+    for attempt in range(1, retries + 1):
+        try:
+            size = download(session, entry, path)
+            return "ok", size, time.time() - t0
+        except (requests.RequestException, FetchError) as e:
+            last = e
+            log.warning(f"⚠️ {entry['filename']} tentativo {attempt}/{retries}: {e}")
+            if attempt < retries: time.sleep(backoff * attempt)
+    raise FetchError(str(last))
+
+
+def fetch_all(entries, models_dir=MODELS_DIR, workers=WORKERS, retries=RETRIES, session=None):
+    """Scarica in parallelo; ritorna {filename: stato} (stato = "ok", "skip" o messaggio d'errore)."""
+    session = session or requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=workers, pool_maxsize=workers * 2)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(fetch, session, e, models_dir, retries): e for e in entries}
+        for fut in as_completed(futures):
+            name = futures[fut]["filename"]
+            try:
+                status, size, seconds = fut.result()
+                results[name] = status
+                if status == "skip": print(f"✓ Presente: {name}")
+                else: print(f"✓ Scaricato: {name} ({size / 1e6:.0f} MB in {seconds:.0f}s, {size / 1e6 / max(seconds, 1e-3):.0f} MB/s)")
+            except Exception as e:
+                results[name] = str(e)
+                print(f"✗ Fallito: {name}: {e}")
+    return results
+
+
+def pin_manifest(path, models_dir=MODELS_DIR, session=None):
+    """Completa sha256|size: dal file se è presente (riusa l'hash del marker), altrimenti dai metadati LFS remoti."""
+    session = session or requests.Session()
+    lines, pinned = [], 0
+    with open(path, "r", encoding="utf-8") as f: raw = f.read().splitlines()
+    for line in raw:
+        stripped = line.strip()
+        if not stripped or stripped.startswith("#"):
+            lines.append(line)
+            continue
+        entry = parse_line(stripped)
+        target = target_path(entry, models_dir)
+        if (not entry["sha256"] or entry["size"] is None) and os.path.exists(target):
+            marker = read_marker(target) or {}
+            st = os.stat(target)
+            fresh = marker.get("size") == st.st_size and marker.get("mtime_ns") == st.st_mtime_ns
+            entry["sha256"] = entry["sha256"] or (marker.get("sha256") if fresh and marker.get("sha256") else sha256_file(target))
+            entry["size"] = st.st_size
+            pinned += 1
+        elif not entry["sha256"] or entry["size"] is None:
+            sha256, size = remote_meta(session, entry["url"])
+            if sha256 and size is not None:
+                entry["sha256"], entry["size"] = entry["sha256"] or sha256, size
+                pinned += 1
+            else:
+                log.warning(f"⚠️ {entry['filename']}: file assente e nessun hash LFS remoto, riga non pinnata")
+        lines.append("|".join([entry["filename"], entry["url"], entry["type"], entry["sha256"] or "",
+                               str(entry["size"]) if entry["size"] is not None else ""]))
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f: f.write("\n".join(lines) + "\n")
+    os.replace(tmp, path)
+    return pinned
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Download modelli da manifest (parallelo, riprendibile, sha256)")
+    ap.add_argument("--manifest", action="append", required=True, help="ripetibile")
+    ap.add_argument("--models-dir", default=MODELS_DIR)
+    ap.add_argument("--workers", type=int, default=WORKERS)
+    ap.add_argument("--retries", type=int, default=RETRIES)
+    ap.add_argument("--pin", action="store_true", help="scrive sha256|size nel manifest (file presenti o metadati LFS), senza scaricare")
+    args = ap.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    if args.pin:
+        for manifest in args.manifest: print(f"📌 {manifest}: {pin_manifest(manifest, args.models_dir)} righe completate")
+        return 0
+
+    entries, seen = [], set()
+    for manifest in args.manifest:
+        for e in parse_manifest(manifest):
+            path = target_path(e, args.models_dir)
+            if path not in seen:
+                seen.add(path)
+                entries.append(e)
+    t0 = time.time()
+    results = fetch_all(entries, args.models_dir, args.workers, args.retries)
+    failed = [k for k, v in results.items() if v not in ("ok", "skip")]
+    print(f"📦 {len(entries)} modelli in {time.time() - t0:.0f}s: "
+          f"{sum(v == 'ok' for v in results.values())} scaricati, {sum(v == 'skip' for v in results.values())} già presenti, "
+          f"{len(failed)} falliti")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
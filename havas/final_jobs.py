@@ -0,0 +1,60 @@
+"""
+✍️ Video finale (testi come sprite + overlay ffmpeg) come job asincroni
+
+Stesso render dello step 3 dell'app AliExpress (overlays.campaign_layers +
+overlays.compose), ma dietro l'interfaccia di havas.jobs: lo usano l'API
+headless e il runner di campagna. ffmpeg gira in un thread, al massimo
+max_concurrent render insieme (è lavoro di CPU locale).
+"""
+
+import asyncio
+import logging
+
+from havas import overlays
+from havas.jobs import Job, JobManager
+from havas.metrics import Trace
+
+log = logging.getLogger(__name__)
+
+MAX_CONCURRENT = 2
+
+
+class FinalJob(Job):
+    def __init__(self, video, lines, layout, dest):
+        super().__init__()
+        self.video = video
+        self.lines = lines
+        self.layout = layout
+        self.dest = dest
+
+
+class FinalJobManager(JobManager):
+    def __init__(self, fonts=None, footer_font=None, max_concurrent=MAX_CONCURRENT, timeout=600, job_ttl=3600):
+        super().__init__(timeout, job_ttl)
+        self.fonts = fonts
+        self.footer_font = footer_font
+        self.max_concurrent = max_concurrent
+        self.sem = None
+
+    async def submit(self, video, lines, dest, x_head=50, y_head=15, text_foot="", x_foot=50, y_foot=85):
+        if self.sem is None: self.sem = asyncio.Semaphore(self.max_concurrent)
+        layout = {"x_head": x_head, "y_head": y_head, "text_foot": text_foot, "x_foot": x_foot, "y_foot": y_foot}
+        return self.add(FinalJob(video, [tuple(l) for l in lines], layout, dest))
+
+    async def _run(self, job):
+        # Il thread di ffmpeg non si può fermare: annullare libera il job, il file resta a metà
+        with Trace("final", job.id) as trace:
+            if self.sem.locked(): job.update(message="In attesa di uno slot ffmpeg")
+            with trace.span("slot"):
+                await self.sem.acquire()
+            try:
+                job.update(status="running", progress=0.1, message="Preparo i testi")
+                with trace.span("sprites"):
+                    layers = await asyncio.to_thread(overlays.campaign_layers, job.lines, fonts=self.fonts,
+                                                     footer_font=self.footer_font, **job.layout)
+                job.update(progress=0.3, message="Render video")
+                with trace.span("ffmpeg"):
+                    await asyncio.to_thread(overlays.compose, job.video, layers, job.dest, timeout=self.timeout)
+            finally:
+                self.sem.release()
+            job.update(status="done", progress=1.0, outputs=[job.dest], message="Video finale pronto")
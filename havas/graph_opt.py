@@ -0,0 +1,273 @@
+"""
+🧹 Ottimizzazione del grafo prima dell'invio: via i nodi morti, testo costante piegato
+
+    python -m havas.graph_opt workflows/ frontend_product_demo/
+    python -m havas.graph_opt workflows/bg-change/bg-change.json --write
+
+ComfyUI esegue ogni nodo "output" del prompt, non solo quelli di salvataggio:
+PreviewImage e Image Comparer (rgthree) decodificano, scrivono PNG in temp/ e
+gonfiano /history, ma i frontend scartano le immagini "temp". Qui:
+
+1. pruning   restano solo i nodi da cui dipendono i nodi di output richiesti
+             (di default quelli di havas.tracker.OUTPUT_NODE_TYPES)
+2. folding   CR Text / Text Concatenate / PrimitiveString con input tutti
+             costanti diventano stringhe letterali nei nodi che li usano
+
+plan() analizza il grafo una volta (al caricamento del template), apply() lo
+applica a ogni prompt renderizzato: il folding usa i valori dopo i parametri,
+quindi un CR Text collegato al parametro "prompt" viene piegato col testo vero.
+
+Sui file in formato UI (nodes/links, come scene-builder e WAN) fa solo
+l'analisi di raggiungibilità (Set/Get di KJNodes compresi) e, con --write,
+salva una copia senza i nodi morti.
+"""
+
+import os
+import sys
+import json
+import argparse
+
+from havas.tracker import OUTPUT_NODE_TYPES
+
+
+# ========================================
+# NODI DI TESTO PIEGABILI
+# ========================================
+
+def _concat(delimiter, clean, texts):
+    """Come WAS "Text Concatenate": salta le stringhe vuote, strip se clean_whitespace."""
+    if delimiter in ("\n", "\\n"): delimiter = "\n"
+    parts = [t.strip() if clean else t for t in texts if isinstance(t, str)]
+    return delimiter.join(t for t in parts if t != "")
+
+
+def _text_concatenate(inputs):
+    keys = sorted(k for k in inputs if k.startswith("text_"))
+    return _concat(inputs.get("delimiter", ", "), str(inputs.get("clean_whitespace", "true")) == "true",
+                   [inputs[k] for k in keys])
+
+
+def _cr_text_concatenate(inputs):
+    texts = [t for t in (inputs.get("text1", ""), inputs.get("text2", "")) if t]
+    return inputs.get("separator", "").join(texts)
+
+
+# class_type -> funzione(inputs) che calcola l'uscita 0
+FOLDABLE = {
+    "CR Text": lambda inputs: inputs["text"],
+    "PrimitiveString": lambda inputs: inputs["value"],
+    "PrimitiveStringMultiline": lambda inputs: inputs["value"],
+    "Text Concatenate": _text_concatenate,
+    "CR Text Concatenate": _cr_text_concatenate,
+}
+
+UI_ONLY_TYPES = ("Note", "MarkdownNote", "Label (rgthree)")
+
+
+def is_link(value):
+    return isinstance(value, list) and len(value) == 2 and isinstance(value[0], str) and isinstance(value[1], int)
+
+
+def describe_node(nid, node):
+    title = (node.get("_meta") or {}).get("title")
+    kind = node.get("class_type") or node.get("type")
+    return f"{nid} {kind}" + (f" ({title})" if title and kind not in title else "")
+
+
+# ========================================
+# FORMATO API
+# ========================================
+
+class Plan:
+    def __init__(self, keep, folds, removed, folded):
+        self.keep = keep          # id dei nodi da inviare, nell'ordine del file
+        self.folds = folds        # [(id nodo piegabile, [(id consumatore, input), ...])] in ordine topologico
+        self.removed = removed    # [(id, descrizione)] nodi morti
+        self.folded = folded      # [(id, descrizione)] nodi di testo diventati letterali
+
+    @property
+    def changed(self):
+        return bool(self.removed or self.folded)
+
+    def report(self):
+        if not self.changed: return "niente da ottimizzare"
+        lines = [f"{len(self.keep)} nodi inviati ({len(self.removed) + len(self.folded)} in meno)"]
+        if self.removed: lines.append("rimossi: " + ", ".join(d for _, d in self.removed))
+        if self.folded: lines.append("testo costante: " + ", ".join(d for _, d in self.folded))
+        return "\n".join(lines)
+
+
+def _foldable(prompt):
+    """Nodi di testo con input costanti o collegati (uscita 0) ad altri nodi piegabili."""
+    ok = {}
+
+    def check(nid, stack=()):
+        if nid in ok: return ok[nid]
+        node = prompt.get(nid)
+        if not isinstance(node, dict) or node.get("class_type") not in FOLDABLE or nid in stack:
+            return False
+        ok[nid] = all(not is_link(v) or (v[1] == 0 and check(v[0], stack + (nid,)))
+                      for v in (node.get("inputs") or {}).values())
+        return ok[nid]
+
+    for nid in prompt: check(nid)
+    return {nid for nid, v in ok.items() if v}
+
+
+def plan(prompt, outputs=None, fold=True):
+    """Analizza un prompt API-format: cosa tenere e quali nodi di testo piegare nei consumatori."""
+    prompt = {k: v for k, v in prompt.items() if isinstance(v, dict) and "class_type" in v}
+    if outputs is None:
+        outputs = [nid for nid, node in prompt.items() if node["class_type"] in OUTPUT_NODE_TYPES]
+    foldable = _foldable(prompt) if fold else set()
+
+    # Raggiungibilità all'indietro dagli output; i link (uscita 0) verso nodi piegabili non contano
+    keep, stack, consumers = set(), [str(o) for o in outputs if str(o) in prompt], {}
+    while stack:
+        nid = stack.pop()
+        if nid in keep: continue
+        keep.add(nid)
+        for key, value in (prompt[nid].get("inputs") or {}).items():
+            if not is_link(value) or value[0] not in prompt: continue
+            if value[0] in foldable and value[1] == 0 and nid not in foldable:
+                consumers.setdefault(value[0], []).append((nid, key))
+            elif value[0] not in keep:
+                stack.append(value[0])
+
+    # I nodi piegabili servono solo al calcolo; quelli usati anche su un'uscita != 0 restano nel grafo
+    needed, stack = set(), list(consumers)
+    while stack:
+        nid = stack.pop()
+        if nid in needed: continue
+        needed.add(nid)
+        stack += [v[0] for v in prompt[nid]["inputs"].values() if is_link(v)]
+    order, seen = [], set()
+
+    def visit(nid):
+        if nid in seen: return
+        seen.add(nid)
+        for v in prompt[nid]["inputs"].values():
+            if is_link(v): visit(v[0])
+        order.append(nid)
+
+    for nid in sorted(needed): visit(nid)
+    folds = [(nid, consumers.get(nid, [])) for nid in order]
+    keep_ids = [nid for nid in prompt if nid in keep]
+    folded = [(nid, describe_node(nid, prompt[nid])) for nid in order if nid not in keep_ids]
+    removed = [(nid, describe_node(nid, node)) for nid, node in prompt.items()
+               if nid not in keep_ids and nid not in needed]
+    return Plan(keep_ids, folds, removed, folded)
+
+
+def apply(prompt, plan):
+    """Prompt ottimizzato: copia solo i consumatori dei nodi piegati, gli altri nodi sono condivisi."""
+    values = {}
+    out = {nid: prompt[nid] for nid in plan.keep}
+    for nid, consumers in plan.folds:
+        inputs = {k: values[v[0]] if is_link(v) else v for k, v in prompt[nid]["inputs"].items()}
+        values[nid] = FOLDABLE[prompt[nid]["class_type"]](inputs)
+        for cid, key in consumers:
+            node = out[cid]
+            if node is prompt[cid]:
+                node = out[cid] = dict(node, inputs=dict(node["inputs"]))
+            node["inputs"][key] = values[nid]
+    return out
+
+
+def optimize(prompt, outputs=None, fold=True):
+    p = plan(prompt, outputs, fold)
+    return apply(prompt, p), p
+
+
+# ========================================
+# FORMATO UI (nodes / links)
+# ========================================
+
+def ui_dead_nodes(graph):
+    """Nodi del workflow UI che non contribuiscono agli output attivi (note escluse)."""
+    nodes = {n["id"]: n for n in graph.get("nodes", [])}
+    source = {l[0]: l[1] for l in graph.get("links", []) if l}
+    setters = {}
+    for n in nodes.values():
+        if n.get("type") == "SetNode" and n.get("widgets_values"):
+            setters[n["widgets_values"][0]] = n["id"]
+
+    outputs = [nid for nid, n in nodes.items() if n.get("type") in OUTPUT_NODE_TYPES and n.get("mode", 0) == 0]
+    keep, stack = set(), list(outputs)
+    while stack:
+        nid = stack.pop()
+        if nid in keep or nid not in nodes: continue
+        keep.add(nid)
+        n = nodes[nid]
+        stack += [source[i["link"]] for i in n.get("inputs") or [] if i.get("link") in source]
+        if n.get("type") == "GetNode" and n.get("widgets_values"):
+            stack += [setters[n["widgets_values"][0]]] if n["widgets_values"][0] in setters else []
+    return [n for nid, n in nodes.items() if nid not in keep and n.get("type") not in UI_ONLY_TYPES]
+
+
+def prune_ui(graph, dead):
+    """Copia del workflow UI senza i nodi in `dead` e senza i link che li toccano."""
+    gone = {n["id"] for n in dead}
+    links = [l for l in graph.get("links", []) if l and l[1] not in gone and l[3] not in gone]
+    alive = {l[0] for l in links}
+    nodes = []
+    for n in graph.get("nodes", []):
+        if n["id"] in gone: continue
+        n = dict(n)
+        n["inputs"] = [dict(i, link=i.get("link") if i.get("link") in alive else None) for i in n.get("inputs") or []]
+        n["outputs"] = [dict(o, links=[x for x in o.get("links") or [] if x in alive]) for o in n.get("outputs") or []]
+        nodes.append(n)
+    return dict(graph, nodes=nodes, links=links)
+
+
+# ========================================
+# CLI
+# ========================================
+
+def iter_json(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for f in sorted(files):
+                    if f.endswith(".json") and not f.endswith(".pruned.json"): yield os.path.join(root, f)
+        else:
+            yield path
+
+
+def analyze(path, write=False):
+    with open(path, "r", encoding="utf-8") as f: data = json.load(f)
+    out_path = path[:-5] + ".pruned.json"
+    if isinstance(data, dict) and "nodes" in data and "links" in data:
+        if not any("class_type" in n or "mode" in n for n in data["nodes"]):
+            return "non è un workflow ComfyUI"
+        if not any(n.get("type") in OUTPUT_NODE_TYPES and n.get("mode", 0) == 0 for n in data["nodes"]):
+            return "UI, nessun nodo di output attivo (solo anteprime): niente da potare"
+        dead = ui_dead_nodes(data)
+        if write and dead:
+            with open(out_path, "w", encoding="utf-8") as f: json.dump(prune_ui(data, dead), f, indent=2, ensure_ascii=False)
+        total = sum(n.get("type") not in UI_ONLY_TYPES for n in data["nodes"])
+        if not dead: return f"UI, {total} nodi: niente da ottimizzare"
+        return f"UI, {total} nodi, {len(dead)} morti: " + ", ".join(describe_node(n["id"], n) for n in dead)
+    if not isinstance(data, dict) or not any(isinstance(v, dict) and "class_type" in v for v in data.values()):
+        return "non è un workflow ComfyUI"
+    prompt, p = optimize(data)
+    if write and p.changed:
+        with open(out_path, "w", encoding="utf-8") as f: json.dump(prompt, f, indent=2, ensure_ascii=False)
+    return "API, " + p.report()
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Analizza i workflow ComfyUI e toglie i nodi che non servono agli output")
+    ap.add_argument("paths", nargs="*", default=["workflows"], help="file JSON o cartelle")
+    ap.add_argument("--write", action="store_true", help="salva accanto una copia ottimizzata (.pruned.json)")
+    args = ap.parse_args(argv)
+    for path in iter_json(args.paths):
+        try:
+            print(f"📄 {path}\n   " + analyze(path, args.write).replace("\n", "\n   "))
+        except (OSError, ValueError) as e:
+            print(f"❌ {path}: {e}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+"""
+🗃️ Stato dei job dell'API condiviso tra processi (SQLite in WAL)
+
+Più processi havas.api dietro lo stesso proxy scrivono qui lo snapshot dei
+job che eseguono (status, progress, message, outputs, ...): qualunque
+processo risponde a GET /jobs/{id}. Per annullare un job di un altro processo
+si alza il flag `cancel`; il proprietario (owner = host:pid) lo legge al giro
+successivo e ferma il job.
+
+Gli output sono path su disco: i processi devono condividere la cartella di
+output (stesso pod o volume montato).
+"""
+
+import os
+import json
+import time
+import socket
+import sqlite3
+import threading
+
+STORE_FILE = "/tmp/havas/jobs.db"
+JOB_TTL = 24 * 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    pipeline TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    status TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    message TEXT,
+    outputs TEXT NOT NULL DEFAULT '[]',
+    error TEXT,
+    params TEXT NOT NULL DEFAULT '{}',
+    extra TEXT NOT NULL DEFAULT '{}',
+    cancel INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_owner ON jobs (owner, cancel);
+CREATE INDEX IF NOT EXISTS jobs_updated ON jobs (updated);
+"""
+
+BASE_FIELDS = ("id", "status", "progress", "message", "outputs", "error", "created", "updated")
+
+
+def process_owner():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobStore:
+    def __init__(self, path=STORE_FILE):
+        self.path = path
+        self.local = threading.local()
+        if os.path.dirname(path): os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._conn() as db: db.executescript(SCHEMA)
+
+    def _conn(self):
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = self.local.db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def _row(self, row):
+        if row is None: return None
+        snap = dict(row)
+        for key in ("outputs", "params", "extra"): snap[key] = json.loads(snap[key])
+        snap.update(snap.pop("extra"))
+        snap["cancel"] = bool(snap["cancel"])
+        return snap
+
+    # --- SCRITTURA (solo il processo proprietario) ---
+    def create(self, snap, pipeline, owner, params=None):
+        self._conn().execute(
+            "INSERT INTO jobs (id, pipeline, owner, status, progress, message, params, created, updated) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (snap["id"], pipeline, owner, snap["status"], snap["progress"], snap["message"],
+             json.dumps(params or {}), snap["created"], snap["updated"]))
+
+    def update(self, snap):
+        extra = {k: v for k, v in snap.items() if k not in BASE_FIELDS}
+        self._conn().execute(
+            "UPDATE jobs SET status=?, progress=?, message=?, outputs=?, error=?, extra=?, updated=? WHERE id=?",
+            (snap["status"], snap["progress"], snap["message"], json.dumps(snap["outputs"]), snap["error"],
+             json.dumps(extra, default=str), snap["updated"], snap["id"]))
+
+    # --- LETTURA (qualunque processo) ---
+    def get(self, job_id):
+        return self._row(self._conn().execute("SELECT * FROM jobs WHERE id=?", (job_id,)).fetchone())
+
+    def list(self, pipeline=None, limit=50):
+        if pipeline:
+            rows = self._conn().execute("SELECT * FROM jobs WHERE pipeline=? ORDER BY created DESC LIMIT ?", (pipeline, limit))
+        else:
+            rows = self._conn().execute("SELECT * FROM jobs ORDER BY created DESC LIMIT ?", (limit,))
+        return [self._row(r) for r in rows]
+
+    # --- CANCEL TRA PROCESSI ---
+    def request_cancel(self, job_id):
+        cur = self._conn().execute(
+            "UPDATE jobs SET cancel=1 WHERE id=? AND status NOT IN ('done', 'error', 'cancelled')", (job_id,))
+        return cur.rowcount > 0
+
+    def cancel_requested(self, owner):
+        rows = self._conn().execute(
+            "SELECT id FROM jobs WHERE owner=? AND cancel=1 AND status NOT IN ('done', 'error', 'cancelled')", (owner,))
+        return [r["id"] for r in rows]
+
+    def active_owners(self):
+        rows = self._conn().execute("SELECT DISTINCT owner FROM jobs WHERE status NOT IN ('done', 'error', 'cancelled')")
+        return [r["owner"] for r in rows]
+
+    def fail_owner(self, owner, reason):
+        """Job rimasti a metà da un processo morto: segnati come falliti (nessuno li porterà a termine)."""
+        return self._conn().execute(
+            "UPDATE jobs SET status='error', error=?, message=?, updated=? "
+            "WHERE owner=? AND status NOT IN ('done', 'error', 'cancelled')", (reason, reason, time.time(), owner)).rowcount
+
+    def purge(self, ttl=JOB_TTL):
+        return self._conn().execute("DELETE FROM jobs WHERE updated < ?", (time.time() - ttl,)).rowcount
@@ -0,0 +1,177 @@
+"""
+🧵 Job in background: stato, iscrizioni e loop asyncio in un thread dedicato
+
+Base comune per gli orchestratori (immagini ComfyUI, video remoti): ogni job
+ha un id e uno snapshot; la UI può fare polling con get(job_id) o iscriversi
+agli aggiornamenti (subscribe in asyncio, iter_updates dai thread Gradio).
+"""
+
+import time
+import uuid
+import queue
+import asyncio
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+TERMINAL = ("done", "error", "cancelled")
+
+
+class Job:
+    def __init__(self):
+        self.id = uuid.uuid4().hex[:12]
+        self.status = "queued"
+        self.progress = 0.0
+        self.message = "In attesa"
+        self.outputs = []
+        self.error = None
+        self.created = time.time()
+        self.updated = self.created
+        self.task = None
+        self.subscribers = []
+
+    def extra(self):
+        """Campi specifici della sottoclasse da aggiungere allo snapshot."""
+        return {}
+
+    def snapshot(self):
+        snap = {"id": self.id, "status": self.status, "progress": self.progress, "message": self.message,
+                "outputs": list(self.outputs), "error": self.error, "created": self.created, "updated": self.updated}
+        snap.update(self.extra())
+        return snap
+
+    def update(self, **kw):
+        for k, v in kw.items(): setattr(self, k, v)
+        self.updated = time.time()
+        snap = self.snapshot()
+        for q in self.subscribers: q.put_nowait(snap)
+
+
+class JobManager:
+    """Registro dei job + loop asyncio in background. Le sottoclassi implementano _run(job) e _cancel(job)."""
+
+    def __init__(self, timeout=600, job_ttl=3600):
+        self.timeout = timeout
+        self.job_ttl = job_ttl
+        self.jobs = {}
+        self.loop = None
+        self.thread = None
+
+    # --- API ASYNCIO ---
+    def add(self, job):
+        self._purge()
+        self.jobs[job.id] = job
+        job.task = asyncio.ensure_future(self._guard(job))
+        return job.id
+
+    async def _guard(self, job):
+        try:
+            await self._run(job)
+        except asyncio.CancelledError:
+            if job.status not in TERMINAL: job.update(status="cancelled", message="Annullato")
+        except Exception as e:
+            log.exception(f"Job {job.id} fallito")
+            job.update(status="error", error=str(e), message=f"Errore: {e}")
+
+    def get(self, job_id):
+        job = self.jobs.get(job_id)
+        return job.snapshot() if job else None
+
+    async def subscribe(self, job_id):
+        """Snapshot del job a ogni cambiamento, fino allo stato finale."""
+        job = self.jobs[job_id]
+        q = asyncio.Queue()
+        job.subscribers.append(q)
+        try:
+            snap = job.snapshot()
+            yield snap
+            while snap["status"] not in TERMINAL:
+                snap = await q.get()
+                yield snap
+        finally:
+            job.subscribers.remove(q)
+
+    async def wait(self, job_id):
+        snap = None
+        async for snap in self.subscribe(job_id): pass
+        return snap
+
+    async def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None or job.status in TERMINAL: return False
+        await self._cancel(job)
+        if job.task: job.task.cancel()
+        job.update(status="cancelled", message="Annullato")
+        return True
+
+    async def expire(self, job_id, message="Timeout"):
+        """Job oltre il tempo massimo: annullato (backend liberato) e chiuso in errore."""
+        job = self.jobs.get(job_id)
+        if job is None: return None
+        if job.status not in TERMINAL:
+            await self.cancel(job_id)
+            job.update(status="error", error=message, message=f"Errore: {message}")
+        return job.snapshot()
+
+    async def _run(self, job):
+        raise NotImplementedError
+
+    async def _cancel(self, job):
+        pass
+
+    def _purge(self):
+        now = time.time()
+        for job_id in [j.id for j in self.jobs.values() if j.status in TERMINAL and now - j.updated > self.job_ttl]:
+            del self.jobs[job_id]
+
+    # --- API THREAD-SAFE (callback Gradio sincroni) ---
+    def start(self):
+        if self.thread is not None: return self
+        ready = threading.Event()
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            ready.set()
+            self.loop.run_forever()
+
+        self.thread = threading.Thread(target=run, name=f"havas-{type(self).__name__}", daemon=True)
+        self.thread.start()
+        ready.wait()
+        return self
+
+    def call(self, coro, timeout=None):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def cancel_sync(self, job_id):
+        return self.call(self.cancel(job_id))
+
+    def iter_updates(self, job_id, timeout=None):
+        """Generatore sincrono di snapshot (per i callback Gradio)."""
+        q = queue.Queue()
+
+        async def attach():
+            job = self.jobs[job_id]
+            job.subscribers.append(q)
+            return job.snapshot()
+
+        snap = self.call(attach())
+        limit = timeout or self.timeout + 60
+        deadline = time.time() + limit
+        try:
+            yield snap
+            while snap["status"] not in TERMINAL:
+                try:
+                    snap = q.get(timeout=max(deadline - time.time(), 0.1))
+                except queue.Empty:
+                    # Niente job orfani: il prompt lascia la coda di ComfyUI e la lease si libera
+                    log.warning(f"Job {job_id}: nessun aggiornamento entro {limit:.0f}s, annullo")
+                    snap = self.call(self.expire(job_id, f"Timeout dopo {limit:.0f}s"))
+                yield snap
+        finally:
+            self.loop.call_soon_threadsafe(self._detach, job_id, q)
+
+    def _detach(self, job_id, q):
+        job = self.jobs.get(job_id)
+        if job and q in job.subscribers: job.subscribers.remove(q)
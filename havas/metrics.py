@@ -0,0 +1,281 @@
+"""
+📈 Tempi per fase di ogni job: trace JSONL + istogrammi Prometheus
+
+Ogni job apre una Trace con un id; le fasi (upload, submit, queued,
+executing, download, decode, ...) diventano span con durata. Gli eventi del
+tracker ComfyUI (feed) danno in automatico coda, esecuzione e tempo per
+nodo. A fine job:
+- una riga in TRACE_FILE (JSONL), per l'analisi offline
+- osservazioni negli istogrammi esposti su http://127.0.0.1:<porta>/metrics
+
+    havas_stage_seconds{job="bg-change",stage="upload"}
+    havas_node_seconds{job="bg-change",class_type="KSampler"}
+    havas_jobs_total{job="bg-change",status="ok"}
+"""
+
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+log = logging.getLogger(__name__)
+
+TRACE_FILE = os.environ.get("HAVAS_TRACE_FILE", "/tmp/havas/traces.jsonl")
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+
+
+# ========================================
+# REGISTRO (formato testo Prometheus, senza dipendenze)
+# ========================================
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        self.series = {}  # label tuple -> [conteggi per bucket, somma, totale]
+        self.lock = threading.Lock()  # observe da thread Gradio / JobManager / storage, render dal server HTTP
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            s = self.series.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, b in enumerate(self.buckets):
+                if value <= b: s[0][i] += 1
+            s[1] += value
+            s[2] += 1
+
+    def render(self):
+        with self.lock: series = [(key, (list(counts), total, n)) for key, (counts, total, n) in self.series.items()]
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, n) in sorted(series):
+            for b, c in zip(self.buckets, counts):
+                out.append(f"{self.name}_bucket{_labels(key, le=b)} {c}")
+            out.append(f"{self.name}_bucket{_labels(key, le='+Inf')} {n}")
+            out.append(f"{self.name}_sum{_labels(key)} {total:.6f}")
+            out.append(f"{self.name}_count{_labels(key)} {n}")
+        return out
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def inc(self, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock: self.series[key] = self.series.get(key, 0) + value
+
+    def render(self):
+        with self.lock: series = sorted(self.series.items())
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        out += [f"{self.name}{_labels(key)} {v}" for key, v in series]
+        return out
+
+
+def _labels(key, **extra):
+    items = list(key) + [(k, v) for k, v in extra.items()]
+    if not items: return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def histogram(self, name, help_text, buckets=BUCKETS):
+        with self.lock: return self.metrics.setdefault(name, Histogram(name, help_text, buckets))
+
+    def counter(self, name, help_text):
+        with self.lock: return self.metrics.setdefault(name, Counter(name, help_text))
+
+    def render(self):
+        with self.lock:
+            lines = []
+            for m in self.metrics.values(): lines += m.render()
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+STAGES = REGISTRY.histogram("havas_stage_seconds", "Durata delle fasi di un job")
+NODES = REGISTRY.histogram("havas_node_seconds", "Tempo di esecuzione per nodo ComfyUI (da eventi WebSocket)")
+JOBS = REGISTRY.counter("havas_jobs_total", "Job terminati per esito")
+
+
+# ========================================
+# TRACE DI UN JOB
+# ========================================
+
+class Trace:
+    def __init__(self, job, job_id=None, trace_file=TRACE_FILE, **attrs):
+        self.job = job
+        self.id = job_id or uuid.uuid4().hex[:12]
+        self.trace_file = trace_file
+        self.attrs = dict(attrs)
+        self.start = time.time()
+        self.spans = []
+        self.nodes = []
+        self.status = "ok"
+        self.error = None
+        self.finished = False
+        self._open = {}     # span aperti: nome -> inizio
+        self._node = None   # (node_id, class_type, inizio)
+        self._classes = {}
+
+    # --- SPAN ---
+    def begin(self, name):
+        self._open[name] = time.time()
+
+    def end(self, name, **attrs):
+        t0 = self._open.pop(name, None)
+        if t0 is not None: self.add(name, t0, time.time(), **attrs)
+
+    def switch(self, old, new):
+        """Passaggio di fase (es. queued -> executing), solo se old è ancora aperto."""
+        if old not in self._open: return
+        self.end(old)
+        self.begin(new)
+
+    def add(self, name, t0, t1, **attrs):
+        span = {"name": name, "start": round(t0 - self.start, 4), "seconds": round(t1 - t0, 4)}
+        if attrs: span.update(attrs)
+        self.spans.append(span)
+
+    def span(self, name, **attrs):
+        return _Span(self, name, attrs)
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def fail(self, error, status="error"):
+        self.status = status
+        self.error = str(error)
+
+    # --- EVENTI DEL TRACKER ---
+    def watch(self, prompt, prompt_id=None):
+        """Da chiamare dopo il submit: da qui parte lo span "queued"."""
+        self._classes = {nid: node.get("class_type") for nid, node in prompt.items()}
+        if prompt_id: self.attrs["prompt_id"] = prompt_id
+        self.begin("queued")
+
+    def feed(self, ev):
+        t = ev["type"]
+        if t in ("started", "executing", "progress"): self.switch("queued", "executing")
+        if t == "executing" and ev.get("node") and (self._node is None or self._node[0] != ev["node"]):
+            self._close_node()
+            self._node = (ev["node"], self._classes.get(ev["node"], "?"), time.time())
+        elif t in ("done", "error"):
+            self._close_node()
+            self.end("queued")
+            self.end("executing")
+            if t == "error": self.fail(ev.get("message"))
+        elif t == "fallback":
+            self.attrs["ws_fallback"] = ev.get("reason")
+
+    def _close_node(self):
+        if self._node is None: return
+        nid, cls, t0 = self._node
+        self.nodes.append({"node": nid, "class_type": cls, "seconds": round(time.time() - t0, 4)})
+        self._node = None
+
+    # --- FINE ---
+    def finish(self, status=None, error=None):
+        if self.finished: return
+        self.finished = True
+        if status: self.status = status
+        if error: self.error = str(error)
+        self._close_node()
+        for name in list(self._open): self.end(name, unfinished=True)
+        total = time.time() - self.start
+
+        for span in self.spans: STAGES.observe(span["seconds"], job=self.job, stage=span["name"])
+        for node in self.nodes: NODES.observe(node["seconds"], job=self.job, class_type=node["class_type"])
+        STAGES.observe(total, job=self.job, stage="total")
+        JOBS.inc(job=self.job, status=self.status)
+
+        record = {"ts": self.start, "job": self.job, "id": self.id, "status": self.status, "error": self.error,
+                  "seconds": round(total, 4), "spans": self.spans, "nodes": self.nodes}
+        record.update(self.attrs)
+        write_trace(record, self.trace_file)
+        return record
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type in (GeneratorExit, asyncio.CancelledError): self.finish("cancelled")
+        elif exc_type is not None: self.finish("error", exc)
+        else: self.finish()
+
+
+class _Span:
+    def __init__(self, trace, name, attrs):
+        self.trace, self.name, self.attrs = trace, name, attrs
+
+    def __enter__(self):
+        self.t0 = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None: self.attrs["error"] = str(exc) or exc_type.__name__
+        self.trace.add(self.name, self.t0, time.time(), **self.attrs)
+
+
+_write_lock = threading.Lock()
+
+
+def write_trace(record, path=TRACE_FILE):
+    if not path: return
+    try:
+        with _write_lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "a") as f: f.write(json.dumps(record, default=str) + "\n")
+    except OSError as e:
+        log.warning(f"Trace non scritta: {e}")
+
+
+# ========================================
+# ENDPOINT /metrics
+# ========================================
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+_servers = {}
+
+
+def start_metrics_server(port, host="0.0.0.0"):
+    """Serve /metrics in un thread daemon (una volta per porta; porta occupata = solo warning)."""
+    if port in _servers: return _servers[port]
+    try:
+        server = ThreadingHTTPServer((host, port), _Handler)
+    except OSError as e:
+        log.warning(f"Metrics su :{port} non avviato: {e}")
+        return None
+    threading.Thread(target=server.serve_forever, name=f"havas-metrics-{port}", daemon=True).start()
+    _servers[port] = server
+    return server
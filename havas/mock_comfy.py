@@ -0,0 +1,408 @@
+"""
+🧪 Finto ComfyUI + n8n per benchmark e test senza pod GPU
+
+    python -m havas.mock_comfy --comfy-port 8188 --n8n-port 5678 --gpu-time 2
+
+ComfyUI: /, /prompt, /queue (GET e POST delete), /history/{id}, /upload/image,
+/view (GET e HEAD), /interrupt, /ws (status, execution_start, executing,
+progress, executed, execution_success). Un solo "GPU": i prompt vengono
+eseguiti uno alla volta, nell'ordine di arrivo. A ogni step dei KSampler
+manda anche un frame binario di anteprima come --preview-method auto:
+sintetico, oppure registrato con --preview-dir (immagini jpg/png o frame .bin
+grezzi, header compreso, rimandati in ordine e a ciclo).
+
+n8n: /webhook/generate-images-2, /webhook/generate-video,
+/webhook/generate-final-video con le stesse risposte dei flow veri (i file
+vengono scritti in --output-dir, come fa n8n sul pod).
+
+Ogni richiesta viene contata (numero e byte in/out per endpoint): GET /_stats
+su entrambe le porte, oppure MockBackend.stats() se usato in-process.
+"""
+
+import io
+import os
+import json
+import time
+import uuid
+import random
+import struct
+import asyncio
+import argparse
+import threading
+
+from aiohttp import web
+from PIL import Image
+
+
+class MockBackend:
+    def __init__(self, gpu_time=2.0, steps=8, latency=0.005, image_size=512, video_time=5.0,
+                 final_time=3.0, video_bytes=2 * 1024 * 1024, output_dir="/tmp/comfyui",
+                 previews=True, preview_dir=None):
+        self.gpu_time = gpu_time
+        self.steps = steps
+        self.latency = latency
+        self.video_time = video_time
+        self.final_time = final_time
+        self.video_bytes = video_bytes
+        self.output_dir = output_dir
+        self.png = _noise_png(image_size)
+        self.previews = (load_previews(preview_dir) if preview_dir else _synthetic_previews(steps)) if previews else []
+
+        self.inputs = {}      # nome -> bytes
+        self.outputs = {}     # (type, subfolder, nome) -> bytes
+        self.history = {}
+        self.pending = []     # [prompt_id, ...] in attesa
+        self.running = None
+        self.prompts = {}     # prompt_id -> (client_id, prompt, number)
+        self.sockets = {}     # client_id -> WebSocketResponse
+        self.interrupted = set()
+        self.number = 0
+        self.counts = {}
+        self.lock = threading.Lock()
+        self.loop = None
+        self.wake = None
+        self.url = None
+        self.n8n_url = None
+        self.runners = []
+
+    # ========================================
+    # CONTATORI
+    # ========================================
+
+    def count(self, name, bytes_in=0, bytes_out=0):
+        with self.lock:
+            c = self.counts.setdefault(name, {"requests": 0, "bytes_in": 0, "bytes_out": 0})
+            c["requests"] += 1
+            c["bytes_in"] += bytes_in
+            c["bytes_out"] += bytes_out
+
+    def add_bytes(self, name, bytes_out):
+        with self.lock:
+            self.counts.setdefault(name, {"requests": 0, "bytes_in": 0, "bytes_out": 0})["bytes_out"] += bytes_out
+
+    def stats(self):
+        with self.lock: return json.loads(json.dumps(self.counts))
+
+    def reset(self):
+        with self.lock: self.counts = {}
+
+    @web.middleware
+    async def middleware(self, request, handler):
+        if self.latency: await asyncio.sleep(self.latency)
+        res = await handler(request)
+        route = request.match_info.route.resource.canonical if request.match_info.route.resource else request.path
+        if route != "/_stats" and route != "/ws":
+            body = getattr(res, "body", None)
+            size = len(body) if isinstance(body, (bytes, bytearray)) else (res.content_length or 0)
+            self.count(f"{request.method} {route}", request.content_length or 0, size)
+        return res
+
+    async def get_stats(self, request):
+        return web.json_response(self.stats())
+
+    # ========================================
+    # COMFYUI
+    # ========================================
+
+    def comfy_app(self):
+        app = web.Application(middlewares=[self.middleware], client_max_size=256 * 1024 * 1024)
+        r = app.router
+        r.add_get("/", self.root)
+        r.add_get("/system_stats", self.system_stats)
+        r.add_get("/_stats", self.get_stats)
+        r.add_get("/ws", self.ws)
+        r.add_post("/prompt", self.prompt)
+        r.add_get("/queue", self.queue)
+        r.add_post("/queue", self.queue_delete)
+        r.add_get("/history/{pid}", self.get_history)
+        r.add_post("/upload/image", self.upload)
+        r.add_get("/view", self.view)
+        r.add_post("/interrupt", self.interrupt)
+        app.on_startup.append(self._start_worker)
+        return app
+
+    async def _start_worker(self, app):
+        self.loop = asyncio.get_running_loop()
+        self.wake = asyncio.Event()
+        asyncio.ensure_future(self._worker())
+
+    async def root(self, request):
+        return web.Response(text="mock comfyui")
+
+    async def system_stats(self, request):
+        return web.json_response({"system": {"os": "mock", "comfyui_version": "mock"},
+                                  "devices": [{"name": "mock", "type": "cpu", "vram_total": 0, "vram_free": 0}]})
+
+    def _queue_body(self):
+        running = [[self.prompts[self.running][2], self.running, {}, {}, []]] if self.running else []
+        pending = [[self.prompts[p][2], p, {}, {}, []] for p in self.pending]
+        return {"queue_running": running, "queue_pending": pending}
+
+    async def queue(self, request):
+        return web.json_response(self._queue_body())
+
+    async def queue_delete(self, request):
+        body = await request.json()
+        for pid in body.get("delete", []):
+            if pid in self.pending: self.pending.remove(pid)
+        if body.get("clear"): self.pending.clear()
+        return web.json_response({})
+
+    async def interrupt(self, request):
+        if self.running: self.interrupted.add(self.running)
+        return web.json_response({})
+
+    async def get_history(self, request):
+        pid = request.match_info["pid"]
+        return web.json_response({pid: self.history[pid]} if pid in self.history else {})
+
+    async def upload(self, request):
+        form = await request.post()
+        f = form["image"]
+        data = f.file.read()
+        self.inputs[f.filename] = data
+        return web.json_response({"name": f.filename, "subfolder": "", "type": "input"})
+
+    async def view(self, request):
+        q = request.query
+        kind = q.get("type", "output")
+        if kind == "input":
+            data = self.inputs.get(q.get("filename"))
+        else:
+            data = self.outputs.get((kind, q.get("subfolder", ""), q.get("filename")))
+        if data is None: return web.Response(status=404)
+        return web.Response(body=data, content_type="image/png")
+
+    async def prompt(self, request):
+        body = await request.json()
+        prompt = body.get("prompt")
+        if not isinstance(prompt, dict) or not prompt:
+            return web.json_response({"error": {"type": "invalid_prompt", "message": "Prompt vuoto"}, "node_errors": {}}, status=400)
+        pid = str(uuid.uuid4())
+        self.number += 1
+        self.prompts[pid] = (body.get("client_id"), prompt, self.number)
+        self.pending.append(pid)
+        self.wake.set()
+        await self._broadcast_status()
+        return web.json_response({"prompt_id": pid, "number": self.number, "node_errors": {}})
+
+    async def ws(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        cid = request.query.get("clientId") or uuid.uuid4().hex
+        self.sockets[cid] = ws
+        self.count("GET /ws")
+        await self._send(cid, "status", {"status": {"exec_info": {"queue_remaining": len(self.pending)}}, "sid": cid})
+        try:
+            async for _ in ws: pass
+        finally:
+            if self.sockets.get(cid) is ws: del self.sockets[cid]
+        return ws
+
+    async def _send(self, cid, kind, data):
+        ws = self.sockets.get(cid)
+        if ws is None or ws.closed: return
+        msg = json.dumps({"type": kind, "data": data})
+        self.add_bytes("GET /ws", len(msg))
+        try: await ws.send_str(msg)
+        except ConnectionError: pass
+
+    async def _send_bytes(self, cid, data):
+        ws = self.sockets.get(cid)
+        if ws is None or ws.closed: return
+        self.add_bytes("GET /ws", len(data))
+        try: await ws.send_bytes(data)
+        except ConnectionError: pass
+
+    async def _broadcast_status(self):
+        remaining = len(self.pending) + (1 if self.running else 0)
+        for cid in list(self.sockets):
+            await self._send(cid, "status", {"status": {"exec_info": {"queue_remaining": remaining}}})
+
+    async def _worker(self):
+        while True:
+            if not self.pending:
+                self.wake.clear()
+                await self.wake.wait()
+                continue
+            pid = self.pending.pop(0)
+            self.running = pid
+            try:
+                await self._execute(pid)
+            finally:
+                self.running = None
+                await self._broadcast_status()
+
+    async def _execute(self, pid):
+        cid, prompt, number = self.prompts[pid]
+        await self._send(cid, "execution_start", {"prompt_id": pid})
+        nodes = list(prompt)
+        samplers = [n for n in nodes if "KSampler" in prompt[n].get("class_type", "")]
+        savers = [n for n in nodes if prompt[n].get("class_type") in ("SaveImage", "PreviewImage")]
+        per_step = self.gpu_time / max(len(samplers) * self.steps, 1)
+        outputs = {}
+        for nid in nodes:
+            if pid in self.interrupted:
+                self.history[pid] = {"prompt": [number, pid, prompt, {}, []], "outputs": {},
+                                     "status": {"status_str": "error", "completed": False,
+                                                "messages": [["execution_interrupted", {"prompt_id": pid}]]}}
+                await self._send(cid, "execution_interrupted", {"prompt_id": pid, "node_id": nid})
+                return
+            await self._send(cid, "executing", {"node": nid, "prompt_id": pid})
+            if nid in samplers:
+                for step in range(1, self.steps + 1):
+                    await asyncio.sleep(per_step)
+                    await self._send(cid, "progress", {"value": step, "max": self.steps, "node": nid, "prompt_id": pid})
+                    if self.previews: await self._send_bytes(cid, self.previews[(step - 1) % len(self.previews)])
+            if nid in savers:
+                kind = "output" if prompt[nid]["class_type"] == "SaveImage" else "temp"
+                name = f"mock_{pid[:8]}_{nid}_{random.randint(0, 99999):05d}.png"
+                self.outputs[(kind, "", name)] = self.png
+                outputs[nid] = {"images": [{"filename": name, "subfolder": "", "type": kind}]}
+                await self._send(cid, "executed", {"node": nid, "output": outputs[nid], "prompt_id": pid})
+        self.history[pid] = {"prompt": [number, pid, prompt, {}, []], "outputs": outputs,
+                             "status": {"status_str": "success", "completed": True, "messages": []}}
+        await self._send(cid, "executing", {"node": None, "prompt_id": pid})
+        await self._send(cid, "execution_success", {"prompt_id": pid})
+
+    # ========================================
+    # N8N
+    # ========================================
+
+    def n8n_app(self):
+        app = web.Application(middlewares=[self.middleware], client_max_size=256 * 1024 * 1024)
+        app.router.add_get("/_stats", self.get_stats)
+        app.router.add_post("/webhook/generate-images-2", self.wh_images)
+        app.router.add_post("/webhook/generate-video", self.wh_video)
+        app.router.add_post("/webhook/generate-final-video", self.wh_final)
+        return app
+
+    async def wh_images(self, request):
+        body = await request.json()
+        await asyncio.sleep(self.gpu_time)
+        session = f"session_{int(time.time() * 1000)}"
+        images = []
+        for k in range(3):
+            name = f"mock_{uuid.uuid4().hex[:8]}_{k}.png"
+            self._write(os.path.join(self.output_dir, "output", session, name), self.png)
+            images.append({"filename": name, "subfolder": session, "type": "output"})
+        return web.json_response([{"success": True, "session_id": session, "images": images,
+                                   "prompt": body.get("prompt")}])
+
+    async def wh_video(self, request):
+        await request.json()
+        await asyncio.sleep(self.video_time)
+        return web.Response(body=os.urandom(self.video_bytes), content_type="video/mp4")
+
+    async def wh_final(self, request):
+        body = await request.json()
+        await asyncio.sleep(self.final_time)
+        path = os.path.join(self.output_dir, "output", body.get("output_name", "final_mock.mp4"))
+        self._write(path, os.urandom(self.video_bytes))
+        return web.json_response({"success": True, "video_path": path})
+
+    def _write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f: f.write(data)
+
+    # ========================================
+    # AVVIO
+    # ========================================
+
+    async def _serve(self, host, comfy_port, n8n_port):
+        runners = []
+        for app, port in ((self.comfy_app(), comfy_port), (self.n8n_app(), n8n_port)):
+            runner = web.AppRunner(app, access_log=None)
+            await runner.setup()
+            await web.TCPSite(runner, host, port).start()
+            runners.append(runner)
+        return runners
+
+    def start(self, host="127.0.0.1", comfy_port=8188, n8n_port=5678):
+        """Avvia i due server in un thread (uso in-process, es. benchmark)."""
+        ready = threading.Event()
+
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            self.runners = loop.run_until_complete(self._serve(host, comfy_port, n8n_port))
+            ready.set()
+            loop.run_forever()
+
+        threading.Thread(target=run, name="havas-mock-comfy", daemon=True).start()
+        ready.wait()
+        self.url = f"http://{host}:{comfy_port}"
+        self.n8n_url = f"http://{host}:{n8n_port}"
+        return self
+
+    def stop(self, timeout=10):
+        """Chiude i due server avviati con start() (pod che cade a metà job)."""
+        async def cleanup():
+            for runner in self.runners: await runner.cleanup()
+        asyncio.run_coroutine_threadsafe(cleanup(), self.loop).result(timeout)
+
+
+def _noise_png(size):
+    im = Image.frombytes("RGB", (size, size), os.urandom(size * size * 3))
+    buf = io.BytesIO()
+    im.save(buf, "PNG")
+    return buf.getvalue()
+
+
+def preview_frame(image, kind=2):
+    """Frame PREVIEW_IMAGE come lo manda ComfyUI: tipo evento 1, formato (1 jpeg, 2 png), immagine."""
+    return struct.pack(">II", 1, kind) + image
+
+
+def load_previews(root):
+    """Frame registrati: .bin rimandati così come sono, jpg/png incapsulati."""
+    frames = []
+    for name in sorted(os.listdir(root)):
+        ext = os.path.splitext(name)[1].lower()
+        with open(os.path.join(root, name), "rb") as f: data = f.read()
+        if ext == ".bin": frames.append(data)
+        elif ext in (".jpg", ".jpeg", ".png"): frames.append(preview_frame(data, 1 if ext != ".png" else 2))
+    if not frames: raise ValueError(f"nessun frame di anteprima in {root}")
+    return frames
+
+
+def _synthetic_previews(steps, size=256):
+    """Rumore che diventa un gradiente step dopo step (JPEG, come TAESD/latent2rgb)."""
+    frames = []
+    base = Image.linear_gradient("L").resize((size, size)).convert("RGB")
+    for step in range(1, steps + 1):
+        noise = Image.frombytes("RGB", (size, size), os.urandom(size * size * 3))
+        buf = io.BytesIO()
+        Image.blend(noise, base, step / steps).save(buf, "JPEG", quality=70)
+        frames.append(preview_frame(buf.getvalue(), 1))
+    return frames
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Finto ComfyUI + n8n per benchmark locali")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--comfy-port", type=int, default=8188)
+    ap.add_argument("--n8n-port", type=int, default=5678)
+    ap.add_argument("--gpu-time", type=float, default=2.0, help="secondi di GPU per prompt")
+    ap.add_argument("--steps", type=int, default=8, help="step per KSampler (eventi progress)")
+    ap.add_argument("--latency", type=float, default=0.005, help="latenza aggiunta a ogni richiesta HTTP (s)")
+    ap.add_argument("--image-size", type=int, default=512, help="lato delle immagini di output (px)")
+    ap.add_argument("--video-time", type=float, default=5.0)
+    ap.add_argument("--final-time", type=float, default=3.0)
+    ap.add_argument("--output-dir", default="/tmp/comfyui")
+    ap.add_argument("--no-previews", action="store_true", help="niente frame binari di anteprima")
+    ap.add_argument("--preview-dir", help="frame registrati da rimandare (jpg/png o .bin grezzi)")
+    args = ap.parse_args()
+    backend = MockBackend(args.gpu_time, args.steps, args.latency, args.image_size, args.video_time,
+                          args.final_time, output_dir=args.output_dir, previews=not args.no_previews,
+                          preview_dir=args.preview_dir)
+    backend.start(args.host, args.comfy_port, args.n8n_port)
+    print(f"🧪 Mock ComfyUI su :{args.comfy_port}, n8n su :{args.n8n_port} (Ctrl+C per uscire)")
+    try:
+        while True: time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
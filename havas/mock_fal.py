@@ -0,0 +1,156 @@
+"""
+🧪 Finto fal.ai queue (submit / status / result / cancel / file MP4) per i test locali
+
+    python -m havas.mock_fal --port 8190 --duration 8 --workers 2
+    FAL_URL=http://127.0.0.1:8190 FAL_KEY=test python app.py
+
+Emula il ciclo IN_QUEUE -> IN_PROGRESS -> COMPLETED con un numero limitato di
+worker (i job in più restano in coda con queue_position), e serve un MP4 finto
+di --size byte a chunk (con truncate la connessione cade dopo tanti byte).
+GET /_stats restituisce i contatori delle richieste.
+"""
+
+import time
+import uuid
+import asyncio
+import argparse
+import threading
+
+from aiohttp import web
+
+
+class MockFal:
+    def __init__(self, duration=8.0, workers=2, size=2 * 1024 * 1024, truncate=None):
+        self.duration = duration
+        self.workers = workers
+        self.size = size
+        self.truncate = truncate  # byte inviati prima di chiudere il download (None = file intero)
+        self.url = None
+        self.jobs = {}    # request_id -> {"status", "submitted", "started", "payload"}
+        self.order = []   # request_id in attesa, in ordine di arrivo
+        self.counts = {}
+
+    def app(self):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_get("/_stats", self.stats)
+        app.router.add_get("/requests/{rid}/status", self.status)
+        app.router.add_put("/requests/{rid}/cancel", self.cancel)
+        app.router.add_get("/requests/{rid}", self.result)
+        app.router.add_get("/files/{rid}.mp4", self.file)
+        app.router.add_post("/{model:.+}", self.submit)
+        return app
+
+    def count(self, name):
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def tick(self):
+        """Avanza lo stato: i job finiti liberano worker, i primi in coda partono."""
+        now = time.time()
+        running = 0
+        for job in self.jobs.values():
+            if job["status"] == "IN_PROGRESS":
+                if now - job["started"] >= self.duration: job["status"] = "COMPLETED"
+                else: running += 1
+        while self.order and running < self.workers:
+            job = self.jobs[self.order.pop(0)]
+            job["status"], job["started"] = "IN_PROGRESS", now
+            running += 1
+
+    # --- HANDLER ---
+    async def submit(self, request):
+        self.count("submit")
+        payload = await request.json()
+        rid = uuid.uuid4().hex
+        self.jobs[rid] = {"status": "IN_QUEUE", "submitted": time.time(), "started": None, "payload": payload}
+        self.order.append(rid)
+        self.tick()
+        base = f"{request.scheme}://{request.host}/requests/{rid}"
+        return web.json_response({"request_id": rid, "status_url": f"{base}/status", "response_url": base,
+                                  "cancel_url": f"{base}/cancel", "queue_position": len(self.order)}, status=200)
+
+    async def status(self, request):
+        self.count("status")
+        self.tick()
+        rid = request.match_info["rid"]
+        job = self.jobs.get(rid)
+        if job is None: return web.json_response({"detail": "not found"}, status=404)
+        body = {"status": job["status"], "request_id": rid}
+        if job["status"] == "IN_QUEUE": body["queue_position"] = self.order.index(rid)
+        return web.json_response(body, status=200 if job["status"] == "COMPLETED" else 202)
+
+    async def result(self, request):
+        self.count("result")
+        rid = request.match_info["rid"]
+        job = self.jobs.get(rid)
+        if job is None or job["status"] != "COMPLETED": return web.json_response({"detail": "not ready"}, status=400)
+        return web.json_response({"video": {"url": f"{request.scheme}://{request.host}/files/{rid}.mp4",
+                                            "content_type": "video/mp4", "file_size": self.size}})
+
+    async def cancel(self, request):
+        self.count("cancel")
+        rid = request.match_info["rid"]
+        job = self.jobs.get(rid)
+        if job is None or job["status"] == "COMPLETED": return web.json_response({"status": "ALREADY_COMPLETED"}, status=400)
+        if rid in self.order: self.order.remove(rid)
+        job["status"] = "CANCELLED"
+        return web.json_response({"status": "CANCELLATION_REQUESTED"}, status=202)
+
+    async def file(self, request):
+        self.count("file")
+        res = web.StreamResponse(headers={"Content-Type": "video/mp4", "Content-Length": str(self.size)})
+        await res.prepare(request)
+        chunk = b"\0" * 65536
+        sent = 0
+        limit = self.size if self.truncate is None else min(self.truncate, self.size)
+        while sent < limit:
+            part = chunk[:limit - sent]
+            await res.write(part)
+            sent += len(part)
+            await asyncio.sleep(0)
+        if sent < self.size:
+            request.transport.close()  # connessione persa a metà download
+            return res
+        await res.write_eof()
+        return res
+
+    async def stats(self, request):
+        self.tick()
+        states = {}
+        for job in self.jobs.values(): states[job["status"]] = states.get(job["status"], 0) + 1
+        return web.json_response({"requests": self.counts, "jobs": states})
+
+    def start(self, host="127.0.0.1", port=8190):
+        """Avvia il server in un thread (uso in-process, es. test)."""
+        ready = threading.Event()
+
+        async def serve():
+            runner = web.AppRunner(self.app(), access_log=None)
+            await runner.setup()
+            await web.TCPSite(runner, host, port).start()
+
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(serve())
+            ready.set()
+            loop.run_forever()
+
+        threading.Thread(target=run, name="havas-mock-fal", daemon=True).start()
+        ready.wait()
+        self.url = f"http://{host}:{port}"
+        return self
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Finto fal.ai queue per test locali")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8190)
+    ap.add_argument("--duration", type=float, default=8.0, help="secondi di IN_PROGRESS per job")
+    ap.add_argument("--workers", type=int, default=2, help="job eseguiti in parallelo")
+    ap.add_argument("--size", type=int, default=2 * 1024 * 1024, help="byte dell'MP4 finto")
+    args = ap.parse_args()
+    web.run_app(MockFal(args.duration, args.workers, args.size).app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
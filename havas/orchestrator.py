@@ -0,0 +1,192 @@
+"""
+🎛️ Orchestratore nativo per lo step immagini AliExpress (al posto del loop n8n)
+
+Fa quello che faceva _ALIEXPRESS__01___Image_Generator.json, ma in-process:
+upload dell'input, submit del prompt, tracking a eventi (WebSocket, con
+fallback in polling) e raccolta degli output. Niente Wait fisso, niente
+richiesta HTTP bloccata per 10 minuti.
+
+Ogni job ha un id: la UI può fare polling con get(job_id) oppure iscriversi
+agli aggiornamenti (subscribe / iter_updates).
+
+Il loop asyncio gira in un thread dedicato (start()), così i callback Gradio
+sincroni possono usare submit_sync / iter_updates / cancel_sync.
+
+Con un havas.dispatch.Dispatcher ogni job va all'istanza ComfyUI meno carica;
+se quella muore a metà il job riparte su un'altra.
+"""
+
+import os
+import random
+import asyncio
+import logging
+
+from havas.client import iter_output_files
+from havas.dispatch import Dispatcher, Backend, BackendDown
+from havas.jobs import Job, JobManager
+from havas.metrics import Trace
+from havas.storage import get_storage, scope_outputs
+from havas.tracker import find_output_nodes
+from havas.uploads import AsyncInputUploader
+
+log = logging.getLogger(__name__)
+
+COMFY_DIR = "/tmp/comfyui"
+
+
+class ImageJob(Job):
+    def __init__(self, image_path, prompt, seed, session_id):
+        super().__init__()
+        self.image_path = image_path
+        self.prompt = prompt
+        self.seed = seed
+        self.prompt_id = None
+        self.node = None  # Lease del backend su cui gira
+        self.session_id = session_id  # cartella output/<session_id>/ (havas.storage)
+
+    def extra(self):
+        return {"prompt_id": self.prompt_id, "session_id": self.session_id, "seed": self.seed,
+                "backend": self.node.url if self.node else None}
+
+
+class ImageOrchestrator(JobManager):
+    def __init__(self, client, template, comfy_dir=COMFY_DIR, max_concurrent=4, uploader=None,
+                 timeout=600, job_ttl=3600, dispatcher=None, workflow="aliexpress-images", preprocess=None):
+        super().__init__(timeout, job_ttl)
+        # Un solo AsyncComfyClient oppure un Dispatcher su più istanze
+        if dispatcher is None:
+            uploader = uploader or AsyncInputUploader(client)
+            dispatcher = Dispatcher([Backend(client.base_url, aclient=client, auploader=uploader)])
+        self.dispatcher = dispatcher
+        self.template = template
+        self.workflow = workflow
+        self.comfy_dir = comfy_dir
+        self.max_concurrent = max_concurrent
+        self.preprocess = preprocess  # havas.preprocess.Preprocessor (None = input così com'è)
+        self.storage = get_storage(os.path.join(comfy_dir, "output"))
+        self.sem = None
+
+    async def submit(self, image_path, prompt, seed=None):
+        if self.sem is None: self.sem = asyncio.Semaphore(self.max_concurrent)
+        seed = seed if seed is not None else random.randint(1, 9**15)
+        return self.add(ImageJob(image_path, prompt, seed, self.storage.new_session()))
+
+    def submit_sync(self, image_path, prompt, seed=None):
+        return self.call(self.submit(image_path, prompt, seed))
+
+    async def _cancel(self, job):
+        """Toglie il prompt dalla coda o interrompe l'esecuzione se è già sul GPU."""
+        if not job.prompt_id or job.node is None: return
+        client = job.node.aclient
+        try:
+            q = await client.queue()
+            if any(item[1] == job.prompt_id for item in q.get("queue_running", [])):
+                await client.interrupt()
+            else:
+                await client.delete_from_queue([job.prompt_id])
+        except Exception as e:
+            log.warning(f"Cancel {job.prompt_id} fallito: {e}")
+
+    # ========================================
+    # ESECUZIONE DI UN JOB
+    # ========================================
+
+    def render_params(self, image_name, prompt, seed):
+        params = {"image": image_name, "prompt": prompt, "seed": seed}
+        # Varianti extra: seed_2, seed_3, ... = seed + 1, seed + 2, ...
+        k = 2
+        while f"seed_{k}" in self.template.params:
+            params[f"seed_{k}"] = seed + k - 1
+            k += 1
+        return params
+
+    async def _run(self, job):
+        with Trace(self.workflow, job.id, session_id=job.session_id) as trace:
+            if self.preprocess is not None:
+                # Nel thread pool e prima dello slot: il resize si sovrappone all'attesa
+                job.update(status="preprocessing", progress=0.02, message="Preparazione input")
+                with trace.span("preprocess"):
+                    try: job.image_path = await self.preprocess.aprepare(job.image_path)
+                    except Exception as e: log.warning(f"Job {job.id}: preprocessing fallito, uso l'originale: {e}")
+            with trace.span("slot"):
+                await self.sem.acquire()
+            try:
+                tried = []
+                while True:
+                    try:
+                        with self.dispatcher.lease(self.workflow, exclude=tried) as node:
+                            job.node = node
+                            trace.set(backend=node.url, retries=len(tried))
+                            await self._execute(job, trace, node)
+                        return
+                    except BackendDown as e:
+                        # Pod morto a metà job: si riparte da capo su un'altra istanza
+                        tried.append(e.url)
+                        log.warning(f"Job {job.id}: {e}, riprovo su un altro backend")
+                        job.update(status="queued", progress=0.05, prompt_id=None, message=f"{e}, riprovo su un altro backend")
+            finally:
+                self.sem.release()
+
+    async def _execute(self, job, trace, node):
+        job.update(status="uploading", progress=0.05, message="Upload input")
+        with trace.span("upload"):
+            name = await node.auploader.upload_path(job.image_path)
+        prompt = scope_outputs(self.template.render(**self.render_params(name, job.prompt, job.seed)), job.session_id)
+
+        tracker = await node.aclient.tracker()
+        await tracker.connect()
+        try:
+            job.update(status="submitting", progress=0.1, message="Invio a ComfyUI")
+            with trace.span("submit"):
+                pid = await node.aclient.submit(prompt, client_id=tracker.client_id)
+            job.update(status="queued", prompt_id=pid, message="In coda")
+            trace.watch(prompt, pid)
+            outputs = await self._track(job, tracker, prompt, trace, node)
+        finally:
+            await tracker.close()
+
+        if outputs is None: return
+        job.update(status="collecting", progress=0.95, message="Raccolta output")
+        with trace.span("download"):
+            paths = await self._collect(job, outputs, node)
+        self.storage.track(job.session_id)
+        if not paths:
+            trace.fail("Nessuna immagine trovata")
+            job.update(status="error", error="Nessuna immagine trovata", message="Nessuna immagine trovata")
+            return
+        job.update(status="done", progress=1.0, outputs=paths, message=f"{len(paths)} immagini pronte")
+
+    async def _track(self, job, tracker, prompt, trace, node):
+        events = node.aclient.wait(job.prompt_id, tracker=tracker, output_nodes=find_output_nodes(prompt),
+                                   total_nodes=len(prompt), timeout=self.timeout)
+        async for ev in node.awatch(events):
+            trace.feed(ev)
+            t = ev["type"]
+            if t == "queued":
+                job.update(status="queued", message=f"In coda: {ev['ahead']} lavori davanti" if ev["ahead"] else "In coda")
+            elif t in ("started", "executing"):
+                job.update(status="running", progress=0.15 + 0.8 * ev.get("fraction", 0.0), message="Generazione in corso")
+            elif t == "progress":
+                job.update(status="running", progress=0.15 + 0.8 * ev["fraction"],
+                           message=f"Generazione in corso... step {ev['value']}/{ev['max']}")
+            elif t == "error":
+                job.update(status="error", error=ev["message"], message=f"Errore: {ev['message']}")
+                return None
+            elif t == "done":
+                return ev["outputs"]
+        trace.fail("Tracking interrotto")
+        return None
+
+    async def _collect(self, job, outputs, node):
+        """Path locali degli output (stesso pod); se non ci sono, download via /view dal backend del job."""
+        paths = []
+        for meta in iter_output_files(outputs):
+            local = os.path.join(self.comfy_dir, meta.get("type", "output"), meta.get("subfolder", ""), meta["filename"])
+            # Su un pod remoto un file locale con lo stesso nome è di un altro job
+            if not node.backend.local or not os.path.exists(local):
+                data = await node.aclient.view(meta)
+                local = os.path.join(self.comfy_dir, "output", job.session_id, meta["filename"])
+                os.makedirs(os.path.dirname(local), exist_ok=True)
+                with open(local, "wb") as f: f.write(data)
+            paths.append(local)
+        return paths
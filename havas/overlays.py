@@ -0,0 +1,181 @@
+"""
+✍️ Testi del video finale come sprite RGBA pre-renderizzati (niente catena drawtext)
+
+Ogni frase / footer viene misurata con le metriche vere del font (.otf) e
+disegnata UNA volta in un PNG trasparente. Gli sprite sono in cache per
+(testo, font, dimensione, colore, box): rifare il render con gli stessi testi
+non rasterizza più niente. ffmpeg fa solo overlay + scale/alpha animati.
+
+L'animazione riprende quella del flow n8n: ogni riga "cresce" in 0.15s a
+partire dal suo istante (0.5s, 1.2s, 1.9s, ... ) e il footer entra a 2.5s.
+"""
+
+import os
+import json
+import hashlib
+import logging
+import threading
+import subprocess
+
+from PIL import Image, ImageDraw, ImageFont
+
+log = logging.getLogger(__name__)
+
+SPRITE_DIR = "/tmp/havas/overlay_sprites"
+
+# Font della campagna sul pod (copiati da install.sh): nome scelto in UI -> file
+FONT_MAP = {
+    "Bold": "/tmp/comfyui/AliExpress sans.otf",
+    "Normal": "/tmp/comfyui/AliExpress sans regluar.otf",
+}
+FOOTER_FONT = "/tmp/comfyui/TTNormsPro-Bold.ttf"
+
+FONT_SIZE = 45
+HEAD_COLOR = (255, 255, 255, 255)
+HEAD_START = 0.5     # prima riga
+HEAD_STEP = 0.7      # distanza tra le righe
+HEAD_LINE = 55       # px tra una riga e l'altra
+FOOT_COLOR = (0xE4, 0x32, 0x25, 255)
+FOOT_BOX = (255, 255, 255, 255)
+FOOT_PAD = (40, 12)  # padding orizzontale / verticale del box footer
+FOOT_START = 2.5
+POP = 0.15           # durata dell'animazione di ingresso
+
+# libx264 resta obbligatorio (l'overlay ricodifica), ma senza drawtext basta un preset veloce
+ENCODE_ARGS = ["-c:v", "libx264", "-preset", "veryfast", "-crf", "20", "-pix_fmt", "yuv420p", "-c:a", "copy"]
+
+# Anteprima per iterare sui testi: 480p, 12 fps, ultrafast, senza audio
+PREVIEW_WIDTH = 480
+PREVIEW_FPS = 12
+PREVIEW_ARGS = ["-c:v", "libx264", "-preset", "ultrafast", "-tune", "zerolatency", "-crf", "32",
+                "-pix_fmt", "yuv420p", "-an"]
+
+
+# ========================================
+# 🔤 SPRITE
+# ========================================
+
+_fonts = {}
+_sprites = {}
+_lock = threading.Lock()
+
+
+def load_font(path, size):
+    key = (path, size)
+    if key not in _fonts: _fonts[key] = ImageFont.truetype(path, size)
+    return _fonts[key]
+
+
+def measure(text, font_path, size=FONT_SIZE):
+    """Bounding box reale del testo: (larghezza, altezza, offset_x, offset_y)."""
+    left, top, right, bottom = load_font(font_path, size).getbbox(text)
+    return right - left, bottom - top, left, top
+
+
+def sprite_key(text, font_path, size, color, box, pad):
+    st = os.stat(font_path)
+    blob = json.dumps([text, os.path.abspath(font_path), st.st_mtime_ns, size, color, box, pad])
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()[:32]
+
+
+def render_sprite(text, font_path, size=FONT_SIZE, color=HEAD_COLOR, box=None, pad=(0, 0), root=SPRITE_DIR):
+    """PNG RGBA col solo testo (più l'eventuale box arrotondato). Ritorna (path, larghezza, altezza)."""
+    key = sprite_key(text, font_path, size, color, box, pad)
+    with _lock:
+        if key in _sprites: return _sprites[key]
+
+    path = os.path.join(root, f"{key}.png")
+    if os.path.exists(path):
+        with Image.open(path) as im: result = (path, im.width, im.height)
+    else:
+        w, h, ox, oy = measure(text, font_path, size)
+        px, py = pad
+        im = Image.new("RGBA", (max(w + 2 * px, 1), max(h + 2 * py, 1)), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(im)
+        if box: draw.rounded_rectangle((0, 0, im.width - 1, im.height - 1), radius=im.height // 2, fill=box)
+        draw.text((px - ox, py - oy), text, font=load_font(font_path, size), fill=color)
+        os.makedirs(root, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        im.save(tmp, "PNG")
+        os.replace(tmp, path)
+        result = (path, im.width, im.height)
+
+    with _lock: _sprites[key] = result
+    return result
+
+
+# ========================================
+# 🎞️ LAYER E FILTRO FFMPEG
+# ========================================
+
+def headline_layers(lines, x_pct=50, y_pct=15, size=FONT_SIZE):
+    """lines = [(testo, font_path), ...]; le righe vuote vengono saltate ma tengono il loro tempo."""
+    layers = []
+    for i, (text, font_path) in enumerate(lines):
+        if not text or not text.strip(): continue
+        path, w, h = render_sprite(text.strip(), font_path, size, HEAD_COLOR)
+        layers.append({"sprite": path, "w": w, "h": h, "start": HEAD_START + i * HEAD_STEP,
+                       "x_pct": x_pct, "y_pct": y_pct, "dy": i * HEAD_LINE})
+    return layers
+
+
+def footer_layer(text, font_path, x_pct=50, y_pct=85, size=FONT_SIZE):
+    if not text or not text.strip(): return None
+    path, w, h = render_sprite(text.strip(), font_path, size, FOOT_COLOR, FOOT_BOX, FOOT_PAD)
+    return {"sprite": path, "w": w, "h": h, "start": FOOT_START, "x_pct": x_pct, "y_pct": y_pct, "dy": 0}
+
+
+def campaign_layers(lines, x_head, y_head, text_foot, x_foot, y_foot, fonts=None, footer_font=None):
+    """lines = [(testo, "Bold"/"Normal"), ...] -> headline + footer (font sconosciuto: Bold la prima riga, Normal le altre)."""
+    fonts = fonts or FONT_MAP
+    paths = [fonts.get(f, fonts["Bold" if i == 0 else "Normal"]) for i, (_, f) in enumerate(lines)]
+    layers = headline_layers([(t, p) for (t, _), p in zip(lines, paths)], x_head, y_head)
+    footer_font = footer_font or FOOTER_FONT
+    if not os.path.exists(footer_font): footer_font = fonts["Bold"]
+    foot = footer_layer(text_foot, footer_font, x_foot, y_foot)
+    if foot: layers.append(foot)
+    return layers
+
+
+def build_filter(layers, pop=POP, preview=False):
+    """filter_complex per [0:v] + uno sprite per input (1..n). Lo sprite cresce dal centro e sfuma in entrata.
+
+    In anteprima si riducono i frame prima dell'overlay e la risoluzione alla fine
+    (le posizioni restano calcolate sul formato pieno).
+    """
+    parts = []
+    last = "0:v"
+    if preview:
+        parts.append(f"[0:v]fps={PREVIEW_FPS}[b]")
+        last = "b"
+    for i, layer in enumerate(layers, 1):
+        t0 = layer["start"]
+        k = f"min(max((t-{t0})/{pop}\\,0)\\,1)"
+        parts.append(f"[{i}:v]format=rgba,fade=t=in:st={t0}:d={pop}:alpha=1,"
+                     f"scale=w='max(1\\,{layer['w']}*{k})':h='max(1\\,{layer['h']}*{k})':eval=frame[s{i}]")
+        # Posizione come nel flow n8n: (H - h_testo) * y% (+ interlinea), centrata sulla misura finale
+        x = f"(W-{layer['w']})*{layer['x_pct']}/100+({layer['w']}-w)/2"
+        y = f"(H-{layer['h']})*{layer['y_pct']}/100+{layer['dy']}+({layer['h']}-h)/2"
+        out = f"o{i}"
+        parts.append(f"[{last}][s{i}]overlay=x='{x}':y='{y}':enable='gte(t\\,{t0})':shortest=1[{out}]")
+        last = out
+    parts.append(f"[{last}]scale={PREVIEW_WIDTH}:-2[v]" if preview else f"[{last}]null[v]")
+    return ";".join(parts)
+
+
+def compose_command(input_video, layers, output, ffmpeg="ffmpeg", preview=False):
+    cmd = [ffmpeg, "-y", "-i", input_video]
+    for layer in layers: cmd += ["-loop", "1", "-i", layer["sprite"]]
+    cmd += ["-filter_complex", build_filter(layers, preview=preview), "-map", "[v]"]
+    if preview: return cmd + PREVIEW_ARGS + [output]
+    return cmd + ["-map", "0:a?"] + ENCODE_ARGS + [output]
+
+
+def compose(input_video, layers, output, ffmpeg="ffmpeg", timeout=600, preview=False):
+    """Esegue ffmpeg e ritorna solo a file completo; RuntimeError con la coda di stderr se fallisce."""
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    cmd = compose_command(input_video, layers, output, ffmpeg, preview)
+    res = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=timeout)
+    if res.returncode != 0:
+        raise RuntimeError(f"ffmpeg ({res.returncode}): {res.stderr.decode('utf-8', 'replace')[-800:]}")
+    return output
@@ -0,0 +1,186 @@
+"""
+🪄 Preprocessing degli input prima dell'upload (dimensione che il grafo usa davvero)
+
+Le foto dal telefono arrivano a 12+ megapixel, ma il grafo Qwen-Image-Edit le
+porta comunque a ~1 megapixel (target_size 1024, RMBG process_res 1024): il
+resto è upload, hash e decodifica sprecati su ComfyUI. Per ogni workflow
+(havas.workflows "preprocess") si dichiara cosa consuma il grafo:
+
+    max_side   lato lungo massimo (mai ingrandire)
+    mode       "RGB" / "L"
+    alpha      colore su cui appiattire la trasparenza, None = tenerla (PNG)
+    format     "jpeg" / "png" / "webp" (+ quality)
+
+Poi si corregge l'orientamento EXIF, si ridimensiona e si ricodifica. Il file
+risultato sta in PREP_DIR con nome = hash del sorgente + spec, quindi la stessa
+foto viene lavorata una volta sola e l'upload content-addressed resta stabile.
+Se non c'è niente da fare (o il risultato pesa di più) si usa l'originale.
+prune_prepared() all'avvio (frontend e API) toglie i file non usati da più di MAX_AGE.
+
+Il lavoro gira in un thread pool (submit() / aprepare()) così Gradio e l'event
+loop dell'orchestratore non restano bloccati su Pillow.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from havas.metrics import REGISTRY
+from havas.uploads import file_digest
+
+log = logging.getLogger(__name__)
+
+PREP_DIR = "/tmp/havas/prep"
+WORKERS = 2
+MAX_AGE = 24 * 3600
+
+EXT = {"jpeg": ".jpg", "png": ".png", "webp": ".webp"}
+PIL_FORMAT = {"jpeg": "JPEG", "png": "PNG", "webp": "WEBP"}
+
+BYTES = REGISTRY.counter("havas_preprocess_bytes_total", "Byte degli input prima (in) e dopo (out) il preprocessing")
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None: _pool = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="havas-prep")
+        return _pool
+
+
+def _has_alpha(im):
+    return im.mode in ("RGBA", "LA", "PA") or (im.mode == "P" and "transparency" in im.info)
+
+
+class Preprocessor:
+    def __init__(self, max_side=None, mode="RGB", alpha="#FFFFFF", format="jpeg", quality=95, root=PREP_DIR):
+        if format not in EXT: raise ValueError(f"formato non supportato: {format}")
+        self.max_side = max_side
+        self.mode = mode
+        self.alpha = alpha
+        self.format = format
+        self.quality = quality
+        self.root = root
+        self.tag = f"{max_side or 0}_{mode}_{(alpha or 'keep').lstrip('#')}_{format}{quality}"
+        self.lock = threading.Lock()
+        self.done = {}  # digest del sorgente -> path da caricare
+        self.stats = {"images": 0, "resized": 0, "unchanged": 0, "bytes_in": 0, "bytes_out": 0}
+
+    # --- API ---
+    def prepare(self, path):
+        """Path del file da caricare al posto di `path` (può essere `path` stesso)."""
+        digest = file_digest(path)
+        with self.lock:
+            out = self.done.get(digest)
+        if out is not None and os.path.exists(out): return _touch(out) if out != path else out
+
+        out, resized = self._process(path, digest)
+        size_in, size_out = os.path.getsize(path), os.path.getsize(out)
+        with self.lock:
+            self.done[digest] = out
+            self.stats["images"] += 1
+            self.stats["resized"] += resized
+            self.stats["unchanged"] += out == path
+            self.stats["bytes_in"] += size_in
+            self.stats["bytes_out"] += size_out
+        BYTES.inc(size_in, stage="in")
+        BYTES.inc(size_out, stage="out")
+        if out != path:
+            log.info(f"🪄 {os.path.basename(path)}: {size_in / 1e6:.1f} MB -> {size_out / 1e6:.2f} MB")
+        return out
+
+    def submit(self, path):
+        """Future con il path preprocessato (il lavoro parte subito nel pool)."""
+        return get_pool().submit(self.prepare, path)
+
+    async def aprepare(self, path):
+        return await asyncio.get_running_loop().run_in_executor(get_pool(), self.prepare, path)
+
+    def saved(self):
+        return self.stats["bytes_in"] - self.stats["bytes_out"]
+
+    def describe(self):
+        st = self.stats
+        if not st["images"]: return "Preprocessing: nessuna immagine"
+        pct = 100 * self.saved() / st["bytes_in"] if st["bytes_in"] else 0
+        return (f"Preprocessing: {st['images']} immagini ({st['resized']} ridimensionate), "
+                f"{st['bytes_in'] / 1e6:.1f} MB -> {st['bytes_out'] / 1e6:.1f} MB (-{pct:.0f}%)")
+
+    # --- LAVORO ---
+    def _process(self, path, digest):
+        """(path da caricare, ridimensionata?)"""
+        from PIL import Image, ImageOps
+
+        with Image.open(path) as im:
+            rotated = im.getexif().get(0x0112, 1) not in (1, None)
+            alpha = _has_alpha(im)
+            w, h = im.size
+            scale = min(1.0, self.max_side / max(w, h)) if self.max_side else 1.0
+            fmt = "png" if alpha and self.alpha is None else self.format
+            same_format = (im.format or "").upper() == PIL_FORMAT[fmt]
+            want = ("RGBA" if alpha and self.alpha is None else self.mode)
+            if not rotated and scale == 1.0 and same_format and im.mode == want: return path, False
+
+            out = os.path.join(self.root, f"{digest[:32]}_{self.tag}{EXT[fmt]}")
+            if os.path.exists(out): return _touch(out), scale < 1.0
+
+            im = ImageOps.exif_transpose(im)
+            if alpha and self.alpha is not None:
+                rgba = im.convert("RGBA")
+                flat = Image.new("RGB", rgba.size, self.alpha)
+                flat.paste(rgba, mask=rgba.getchannel("A"))
+                im = flat.convert(self.mode)
+            else:
+                im = im.convert(want)
+            if scale < 1.0:
+                w, h = im.size
+                im = im.resize((max(1, round(w * scale)), max(1, round(h * scale))), Image.LANCZOS)
+
+            os.makedirs(self.root, exist_ok=True)
+            tmp = f"{out}.{os.getpid()}.{threading.get_ident()}.tmp"
+            options = {"quality": self.quality} if fmt in ("jpeg", "webp") else {"optimize": True}
+            im.save(tmp, PIL_FORMAT[fmt], **options)
+        # Solo ricodifica senza guadagno: meglio l'originale (niente perdita di qualità)
+        if scale == 1.0 and not rotated and not alpha and os.path.getsize(tmp) >= os.path.getsize(path):
+            os.remove(tmp)
+            return path, False
+        os.replace(tmp, out)
+        return out, scale < 1.0
+
+
+def _touch(path):
+    """Per prune_prepared(): conta l'ultimo uso, non la creazione."""
+    try: os.utime(path)
+    except OSError: pass
+    return path
+
+
+def prune_prepared(root=PREP_DIR, max_age=MAX_AGE):
+    """Via gli input preprocessati (e i .tmp rimasti) non usati da più di max_age secondi."""
+    if not os.path.isdir(root): return 0
+    cutoff, n = time.time() - max_age, 0
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                n += 1
+        except OSError:
+            pass
+    return n
+
+
+# --- UNO PER WORKFLOW ---
+_preprocessors = {}
+
+
+def get_preprocessor(**spec):
+    key = tuple(sorted(spec.items()))
+    with _pool_lock:
+        if key not in _preprocessors: _preprocessors[key] = Preprocessor(**spec)
+        return _preprocessors[key]
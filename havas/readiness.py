@@ -0,0 +1,211 @@
+"""
+🚦 Readiness di ComfyUI: health vero + warm-up dei modelli prima di accettare job
+
+    python -m havas.readiness --url http://127.0.0.1:8188 --timeout 600
+
+Dopo il lancio di main.py il server non risponde subito e, quando risponde, i
+pesi (UNet Qwen-Image-Edit fp8, text encoder 7B, VAE, LoRA) non sono ancora
+in VRAM: il primo job li paga tutti. Readiness:
+
+1. starting  polling di /system_stats finché il server non risponde
+2. warming   per ogni workflow installato un prompt minimo (immagine 64x64,
+             1 step, input sovrascritti da havas.workflows "warmup") così i
+             pesi restano caricati
+3. ready     da qui i frontend accettano job; il health viene ricontrollato
+             ogni `recheck` secondi e se ComfyUI si riavvia si riparte da 1
+
+I frontend tengono in attesa (o rifiutano dopo un timeout) i job finché lo
+stato non è ready. Da riga di comando esce 0 quando il server è pronto (al
+posto dello `sleep 5` dopo l'avvio di main.py).
+"""
+
+import os
+import sys
+import time
+import logging
+import argparse
+import threading
+
+from havas.client import get_client, iter_output_files
+from havas.metrics import Trace
+from havas.tracker import find_output_nodes
+from havas.uploads import InputUploader
+
+log = logging.getLogger(__name__)
+
+WARMUP_DIR = "/tmp/havas"
+WARMUP_SIZE = 64
+POLL = 1.0
+RECHECK = 15.0
+WARMUP_TIMEOUT = 900
+
+STARTING, WARMING, READY, ERROR = "starting", "warming", "ready", "error"
+
+
+def warmup_image(size=WARMUP_SIZE, root=WARMUP_DIR):
+    from PIL import Image
+    path = os.path.join(root, f"warmup_{size}.png")
+    if not os.path.exists(path):
+        os.makedirs(root, exist_ok=True)
+        Image.new("RGB", (size, size), (128, 128, 128)).save(path, "PNG")
+    return path
+
+
+def apply_overrides(prompt, overrides):
+    """Copia del prompt con gli input sovrascritti per class_type (o id del nodo); solo input esistenti."""
+    out = dict(prompt)
+    for nid, node in prompt.items():
+        patch = overrides.get(nid) or overrides.get(node.get("class_type")) or {}
+        patch = {k: v for k, v in patch.items() if k in node.get("inputs", {})}
+        if patch: out[nid] = dict(node, inputs=dict(node["inputs"], **patch))
+    return out
+
+
+class Readiness:
+    """warmups = [(nome, template, overrides), ...]; template può essere una funzione che lo carica."""
+
+    def __init__(self, client, warmups=(), uploader=None, poll=POLL, recheck=RECHECK, timeout=WARMUP_TIMEOUT):
+        self.client = client
+        self.warmups = list(warmups)
+        self.uploader = uploader or InputUploader(client)
+        self.poll = poll
+        self.recheck = recheck
+        self.timeout = timeout
+        self.state = STARTING
+        self.message = "ComfyUI in avvio"
+        self.timings = {}
+        self.since = time.time()
+        self.cond = threading.Condition()
+        self.thread = None
+
+    # --- STATO ---
+    def _set(self, state, message):
+        with self.cond:
+            if state != self.state: self.since = time.time()
+            self.state, self.message = state, message
+            self.cond.notify_all()
+        log.info(f"🚦 {state}: {message}")
+
+    def is_ready(self):
+        return self.state == READY
+
+    def wait(self, timeout=None):
+        """Blocca finché il server non è pronto (True) o scade il timeout (False)."""
+        deadline = None if timeout is None else time.time() + timeout
+        with self.cond:
+            while self.state != READY:
+                left = None if deadline is None else deadline - time.time()
+                if left is not None and left <= 0: return False
+                self.cond.wait(left)
+        return True
+
+    def iter_wait(self, timeout=None, every=2.0):
+        """Come wait(), ma produce la descrizione dello stato (per i generatori Gradio)."""
+        deadline = None if timeout is None else time.time() + timeout
+        while not self.is_ready():
+            yield self.describe()
+            left = every if deadline is None else min(every, deadline - time.time())
+            if left <= 0: return
+            with self.cond: self.cond.wait(left)
+
+    def describe(self):
+        icon = {STARTING: "⏳", WARMING: "🔥", READY: "🟢", ERROR: "🔴"}[self.state]
+        return f"{icon} {self.message} ({time.time() - self.since:.0f}s)"
+
+    # --- CICLO ---
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._loop, name="havas-readiness", daemon=True)
+            self.thread.start()
+        return self
+
+    def _loop(self):
+        while True:
+            self.wait_health()
+            try:
+                self.warm()
+                self._set(READY, "Server pronto" + (f" (warm-up {sum(self.timings.values()):.0f}s)" if self.timings else ""))
+            except Exception as e:
+                # Un warm-up fallito non blocca i job: i modelli si caricheranno al primo
+                log.warning(f"Warm-up fallito: {e}")
+                self._set(READY, f"Server pronto (warm-up fallito: {e})")
+            while self._healthy():
+                time.sleep(self.recheck)
+            self._set(STARTING, "ComfyUI non risponde, attendo il riavvio")
+
+    def _healthy(self):
+        try:
+            self.client.system_stats()
+            return True
+        except Exception:
+            return False
+
+    def wait_health(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        while not self._healthy():
+            if deadline is not None and time.time() > deadline: return False
+            time.sleep(self.poll)
+        return True
+
+    def warm(self):
+        self.timings = {}
+        for name, template, overrides in self.warmups:
+            self._set(WARMING, f"Warm-up {name}: caricamento modelli")
+            t0 = time.time()
+            self.warm_one(name, template() if callable(template) else template, overrides)
+            self.timings[name] = time.time() - t0
+
+    def warm_one(self, name, template, overrides):
+        with Trace(f"warmup-{name}") as trace:
+            with trace.span("upload"):
+                image = self.uploader.upload_path(warmup_image())
+            values = {"image": image, "prompt": "warm-up", "seed": 1}
+            prompt = apply_overrides(template.render(**{k: v for k, v in values.items() if k in template.params}), overrides)
+            tracker = self.client.tracker()
+            tracker.connect()
+            try:
+                with trace.span("submit"):
+                    pid = self.client.submit(prompt, client_id=tracker.client_id)
+                trace.watch(prompt, pid)
+                for ev in self.client.wait(pid, tracker=tracker, output_nodes=find_output_nodes(prompt),
+                                           total_nodes=len(prompt), timeout=self.timeout):
+                    trace.feed(ev)
+                    if ev["type"] == "progress":
+                        self._set(WARMING, f"Warm-up {name}: step {ev['value']}/{ev['max']}")
+                    elif ev["type"] == "error":
+                        raise RuntimeError(ev["message"])
+                    elif ev["type"] == "done":
+                        trace.set(outputs=sum(1 for _ in iter_output_files(ev["outputs"])))
+            finally:
+                tracker.close()
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Attende ComfyUI pronto (health + warm-up opzionale)")
+    ap.add_argument("--url", default=os.environ.get("COMFY_URL", "http://127.0.0.1:8188"))
+    ap.add_argument("--timeout", type=float, default=600, help="secondi massimi di attesa del health")
+    ap.add_argument("--warmup", action="append", default=[], metavar="NOME=FILE",
+                    help="workflow di havas.workflows da scaldare (ripetibile), es. bg-change=bg-change.json")
+    args = ap.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    from havas.workflows import get_template, get_warmup
+    client = get_client(args.url)
+    warmups = []
+    for spec in args.warmup:
+        name, _, path = spec.partition("=")
+        warmups.append((name, get_template(name, path or None), get_warmup(name)))
+    ready = Readiness(client, warmups)
+    t0 = time.time()
+    if not ready.wait_health(args.timeout):
+        print(f"❌ ComfyUI non risponde su {args.url} dopo {args.timeout:.0f}s")
+        return 1
+    print(f"✅ ComfyUI risponde dopo {time.time() - t0:.1f}s")
+    if warmups:
+        ready.warm()
+        print("🔥 Warm-up: " + "  ".join(f"{k} {v:.1f}s" for k, v in ready.timings.items()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+"""
+⚡ Cache persistente dei risultati deterministici
+
+Chiave = sha256 di (hash dell'input, parametri patchati, hash del workflow,
+spec del preprocessing dell'input).
+Solo i job ripetibili (seed fisso) vanno messi in cache: la stessa combinazione
+immagine/prompt/seed torna in millisecondi senza passare dalla coda GPU.
+
+Su disco ogni voce è una cartella <root>/<key>/ con i file e un meta.json,
+scritto per ultimo (una cartella senza meta.json è una scrittura in corso);
+l'mtime di meta.json fa da orologio LRU. Oltre max_bytes si eliminano le voci
+usate meno di recente.
+"""
+
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+CACHE_DIR = "/tmp/havas/result_cache"
+MAX_BYTES = 2 * 1024 ** 3
+META = "meta.json"
+KEY_RE = re.compile(r"^[0-9a-f]{64}$")
+STALE = 3600  # residui di scritture interrotte
+
+
+def make_key(input_digest, params, workflow_hash, preprocess=None):
+    # Cambiando la spec del preprocessing (es. QWEN_EDIT_INPUT) cambia l'input che vede il grafo
+    if preprocess is not None: params = dict(params, preprocess=preprocess.tag)
+    blob = json.dumps({"input": input_digest, "params": params, "workflow": workflow_hash},
+                      sort_keys=True, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, root=CACHE_DIR, max_bytes=MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> dimensione in byte, dal meno al più recente
+        self.counters = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        os.makedirs(root, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        found = []
+        for key in os.listdir(self.root):
+            path = os.path.join(self.root, key)
+            meta_path = os.path.join(path, META)
+            if not KEY_RE.match(key) or not os.path.isfile(meta_path):
+                # Scritture interrotte o in corso (<key>.tmp-<pid>-<tid>, anche di un altro processo):
+                # mai voci della cache, si eliminano solo quando sono vecchie
+                try:
+                    if time.time() - os.path.getmtime(path) > STALE: shutil.rmtree(path, ignore_errors=True)
+                except OSError: pass
+                continue
+            found.append((os.path.getmtime(meta_path), key, _dir_size(path)))
+        for _, key, size in sorted(found): self.entries[key] = size
+
+    # --- LETTURA ---
+    def get(self, key):
+        """{"files": [path assoluti], "meta": {...}} oppure None."""
+        entry_dir = os.path.join(self.root, key)
+        with self.lock:
+            if key not in self.entries:
+                self.counters["misses"] += 1
+                return None
+            try:
+                with open(os.path.join(entry_dir, META), "r") as f: meta = json.load(f)
+                os.utime(os.path.join(entry_dir, META))
+            except (OSError, ValueError):
+                self.entries.pop(key, None)
+                self.counters["misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.counters["hits"] += 1
+        return {"files": [os.path.join(entry_dir, n) for n in meta.get("files", [])], "meta": meta.get("meta", {})}
+
+    # --- SCRITTURA ---
+    def put(self, key, files, meta=None):
+        """files = lista di (nome, bytes) oppure (nome, path di un file esistente)."""
+        entry_dir = os.path.join(self.root, key)
+        tmp_dir = f"{entry_dir}.tmp-{os.getpid()}-{threading.get_ident()}"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        names = []
+        for name, content in files:
+            name = os.path.basename(name)
+            dest = os.path.join(tmp_dir, name)
+            if isinstance(content, bytes):
+                with open(dest, "wb") as f: f.write(content)
+            else:
+                shutil.copyfile(content, dest)
+            names.append(name)
+
+        with self.lock:
+            if os.path.exists(entry_dir):
+                # Già scritta da un'altra richiesta (o da un altro processo)
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+            else:
+                os.replace(tmp_dir, entry_dir)
+                # meta.json per ultimo, in modo atomico: da qui la voce è valida
+                meta_tmp = os.path.join(entry_dir, f".{META}.tmp")
+                with open(meta_tmp, "w") as f:
+                    json.dump({"files": names, "meta": meta or {}, "created": time.time()}, f)
+                os.replace(meta_tmp, os.path.join(entry_dir, META))
+                self.counters["stores"] += 1
+            self.entries[key] = _dir_size(entry_dir)
+            self.entries.move_to_end(key)
+            self._evict()
+        return [os.path.join(entry_dir, n) for n in names]
+
+    def _evict(self):
+        total = sum(self.entries.values())
+        while total > self.max_bytes and len(self.entries) > 1:
+            key, size = self.entries.popitem(last=False)
+            shutil.rmtree(os.path.join(self.root, key), ignore_errors=True)
+            total -= size
+            self.counters["evictions"] += 1
+            log.info(f"Cache risultati: eliminato {key[:12]} ({size // 1024} KB)")
+
+    def stats(self):
+        with self.lock:
+            out = dict(self.counters)
+            out["entries"] = len(self.entries)
+            out["bytes"] = sum(self.entries.values())
+        lookups = out["hits"] + out["misses"]
+        out["hit_rate"] = out["hits"] / lookups if lookups else 0.0
+        return out
+
+
+def _dir_size(path):
+    total = 0
+    for name in os.listdir(path):
+        try: total += os.path.getsize(os.path.join(path, name))
+        except OSError: pass
+    return total
+
+
+_caches = {}
+
+
+def get_cache(root=CACHE_DIR, max_bytes=MAX_BYTES):
+    if root not in _caches: _caches[root] = ResultCache(root, max_bytes)
+    return _caches[root]
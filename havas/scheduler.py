@@ -0,0 +1,186 @@
+"""
+⚖️ Scheduler fair-share davanti a ComfyUI (per utente / sessione Gradio)
+
+demo.queue() serve i click in ordine di arrivo: chi lancia 10 job passa davanti
+a tutti quelli che arrivano dopo. Qui ogni job prende un Ticket e aspetta un
+turno; i turni (slot = job contemporaneamente dentro ComfyUI) vanno a chi ne
+sta usando meno:
+
+    1. meno job in esecuzione
+    2. meno secondi di GPU consumati di recente (decadimento con emivita)
+    3. ticket più vecchio
+
+Ogni utente può avere al massimo `per_user` job in sospeso (in attesa + in
+esecuzione): oltre, submit() alza QueueFull. cancel() toglie un ticket in
+attesa oppure chiama la callback registrata con bind() (es. ComfyClient.cancel,
+che toglie il prompt dalla coda o interrompe l'esecuzione): così un tab chiuso
+non lascia lavoro sul GPU.
+
+    ticket = scheduler.submit(session, "bg-change")
+    try:
+        for ahead in scheduler.iter_acquire(ticket): ...  # posizione reale dell'utente
+        ticket.bind(lambda: client.cancel(prompt_id))
+    finally:
+        scheduler.release(ticket, gpu_seconds)
+"""
+
+import time
+import uuid
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+SLOTS = 2           # job contemporaneamente dentro ComfyUI (uno in esecuzione + uno pronto)
+PER_USER = 3
+HALF_LIFE = 300.0   # secondi: dopo 5 minuti l'uso passato conta la metà
+
+WAITING, RUNNING, DONE, CANCELLED = "waiting", "running", "done", "cancelled"
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Ticket:
+    def __init__(self, user, job=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.user = user
+        self.job = job
+        self.created = time.time()
+        self.granted = None
+        self.state = WAITING
+        self.on_cancel = None
+
+    @property
+    def cancelled(self):
+        return self.state == CANCELLED
+
+    def bind(self, on_cancel):
+        """Cosa fare se il ticket viene annullato mentre il job è su ComfyUI (se è già annullato, subito)."""
+        self.on_cancel = on_cancel
+        if self.cancelled: self._fire()
+
+    def _fire(self):
+        fn, self.on_cancel = self.on_cancel, None
+        if fn is None: return
+        try: fn()
+        except Exception as e: log.warning(f"Cancel del ticket {self.id} fallito: {e}")
+
+
+class FairScheduler:
+    def __init__(self, slots=SLOTS, per_user=PER_USER, half_life=HALF_LIFE):
+        self.slots = max(1, slots)
+        self.per_user = per_user
+        self.half_life = half_life
+        self.cond = threading.Condition()
+        self.waiting = []
+        self.running = {}   # user -> ticket in esecuzione
+        self.usage = {}     # user -> (secondi GPU con decadimento, istante dell'ultimo aggiornamento)
+
+    # --- ORDINE ---
+    def _usage(self, user, now):
+        value, t = self.usage.get(user, (0.0, now))
+        return value * 0.5 ** ((now - t) / self.half_life)
+
+    def _order(self):
+        """Ordine in cui verrebbero serviti i ticket in attesa, simulando i turni."""
+        now = time.time()
+        running = {u: len(ts) for u, ts in self.running.items()}
+        usage = {t.user: self._usage(t.user, now) for t in self.waiting}
+        left, order = list(self.waiting), []
+        while left:
+            best = min(left, key=lambda t: (running.get(t.user, 0), usage[t.user], t.created))
+            order.append(best)
+            left.remove(best)
+            running[best.user] = running.get(best.user, 0) + 1
+        return order
+
+    def _dispatch(self):
+        busy = sum(len(ts) for ts in self.running.values())
+        if busy >= self.slots or not self.waiting: return
+        for t in self._order()[:self.slots - busy]:
+            self.waiting.remove(t)
+            t.state, t.granted = RUNNING, time.time()
+            self.running.setdefault(t.user, []).append(t)
+        self.cond.notify_all()
+
+    # --- API ---
+    def submit(self, user, job=None):
+        with self.cond:
+            pending = len(self.running.get(user, [])) + sum(t.user == user for t in self.waiting)
+            if self.per_user and pending >= self.per_user:
+                raise QueueFull(f"Hai già {pending} job in corso (massimo {self.per_user}): aspetta che finiscano")
+            ticket = Ticket(user, job)
+            self.waiting.append(ticket)
+            self._dispatch()
+            return ticket
+
+    def position(self, ticket):
+        """Job davanti a questo ticket (0 = il prossimo); None se non è più in attesa."""
+        with self.cond:
+            if ticket.state != WAITING: return None
+            return self._order().index(ticket)
+
+    def iter_acquire(self, ticket, every=1.0):
+        """Produce la posizione in coda finché il ticket non ha il turno (o viene annullato)."""
+        while True:
+            with self.cond:
+                if ticket.state != WAITING: return
+                ahead = self._order().index(ticket)
+            yield ahead
+            with self.cond:
+                if ticket.state == WAITING: self.cond.wait(every)
+
+    def acquire(self, ticket, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        with self.cond:
+            while ticket.state == WAITING:
+                left = None if deadline is None else deadline - time.time()
+                if left is not None and left <= 0: return False
+                self.cond.wait(left)
+            return ticket.state == RUNNING
+
+    def release(self, ticket, gpu_seconds=0.0):
+        """Fine del job (riuscito, fallito o annullato): libera lo slot e conteggia il GPU usato."""
+        with self.cond:
+            if ticket in self.waiting: self.waiting.remove(ticket)
+            mine = self.running.get(ticket.user, [])
+            if ticket in mine:
+                mine.remove(ticket)
+                if not mine: del self.running[ticket.user]
+            if gpu_seconds:
+                now = time.time()
+                self.usage[ticket.user] = (self._usage(ticket.user, now) + gpu_seconds, now)
+            if ticket.state in (WAITING, RUNNING): ticket.state = DONE
+            self._dispatch()
+            self.cond.notify_all()
+
+    def cancel(self, ticket):
+        with self.cond:
+            if ticket.state in (DONE, CANCELLED): return False
+            was_running = ticket.state == RUNNING
+            ticket.state = CANCELLED
+            if ticket in self.waiting: self.waiting.remove(ticket)
+            self.cond.notify_all()
+        # Fuori dal lock: la callback fa richieste HTTP
+        if was_running: ticket._fire()
+        return True
+
+    def cancel_user(self, user):
+        with self.cond:
+            tickets = [t for t in self.waiting if t.user == user] + list(self.running.get(user, []))
+        return sum(self.cancel(t) for t in tickets)
+
+    def describe(self, user=None):
+        with self.cond:
+            busy = sum(len(ts) for ts in self.running.values())
+            line = f"GPU: {busy}/{self.slots} slot occupati, {len(self.waiting)} in attesa"
+            if user is None: return line
+            running = len(self.running.get(user, []))
+            order = self._order()
+            mine = [i for i, t in enumerate(order) if t.user == user]
+        if not running and not mine: return line
+        you = f"I tuoi job: {running} in esecuzione, {len(mine)} in attesa"
+        if mine: you += f" (il primo ha {mine[0]} job davanti)"
+        return f"{line}\n{you}"
@@ -0,0 +1,272 @@
+"""
+💾 Cartella output: una sottocartella per sessione/job, quote e pulizia LRU
+
+    python -m havas.storage                       # uso attuale
+    python -m havas.storage --enforce --dry-run   # cosa verrebbe eliminato
+
+Tutto finiva in /tmp/comfyui/output senza mai essere cancellato: sui pod
+effimeri il disco si riempie e le scansioni della cartella rallentano. Qui:
+
+    new_session()          cartella unica output/session_<ms>_<hex>/ (anche tra processi)
+    unique_path(s, stem)   file con nome unico dentro la sessione (niente final_<secondi> doppi)
+    scope_outputs(prompt)  i nodi di salvataggio di ComfyUI scrivono in output/<sessione>/
+    hold(s) / release(s)   la sessione è in uso (gallery aperta, risultato da scaricare)
+
+Ogni voce dell'indice (SQLite in WAL, uno per root, condiviso dai processi)
+è un figlio diretto di output/: una cartella di sessione o un file sciolto
+dei vecchi percorsi. enforce() elimina prima le voci più vecchie di MAX_AGE, poi le meno
+usate finché il totale non scende sotto MAX_BYTES; salta le sessioni tenute,
+quelle scritte da meno di GRACE secondi e le cartelle in KEEP.
+"""
+
+import os
+import sys
+import time
+import uuid
+import shutil
+import hashlib
+import sqlite3
+import logging
+import argparse
+import threading
+
+from havas.metrics import REGISTRY
+from havas.tracker import OUTPUT_NODE_TYPES
+
+log = logging.getLogger(__name__)
+
+OUTPUT_DIR = "/tmp/comfyui/output"
+INDEX_DIR = "/tmp/havas"
+MAX_BYTES = int(float(os.environ.get("OUTPUT_MAX_GB", "20")) * 1024 ** 3)
+MAX_AGE = int(float(os.environ.get("OUTPUT_MAX_AGE_H", "48")) * 3600)
+LIVE_TTL = 2 * 3600       # una sessione tenuta scade da sola (tab chiuso senza release)
+GRACE = 600               # voci appena scritte: ComfyUI / ffmpeg potrebbero non aver finito
+CHECK_EVERY = 300
+# Gestite altrove: batch riprendibili (journal) e anteprime (prune_previews)
+KEEP = ("batch", "preview")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    name TEXT PRIMARY KEY,
+    bytes INTEGER NOT NULL DEFAULT 0,
+    files INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    used REAL NOT NULL,
+    live_until REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS entries_used ON entries (used);
+"""
+
+EVICTED = REGISTRY.counter("havas_storage_evicted_bytes_total", "Byte eliminati dalla cartella output (reason=age/quota)")
+
+
+def scope_outputs(prompt, subdir):
+    """Copia del prompt con i nodi di output che scrivono in output/<subdir>/ (gli altri nodi condivisi)."""
+    out = dict(prompt)
+    for nid, node in prompt.items():
+        prefix = (node.get("inputs") or {}).get("filename_prefix")
+        if node.get("class_type") in OUTPUT_NODE_TYPES and isinstance(prefix, str):
+            out[nid] = dict(node, inputs=dict(node["inputs"], filename_prefix=f"{subdir}/{prefix}"))
+    return out
+
+
+def _scan_size(path):
+    """(byte, file, mtime più recente) di un file o di una cartella."""
+    if not os.path.isdir(path):
+        st = os.stat(path)
+        return st.st_size, 1, st.st_mtime
+    total, files, newest = 0, 0, os.path.getmtime(path)
+    for root, _, names in os.walk(path):
+        for name in names:
+            try: st = os.stat(os.path.join(root, name))
+            except OSError: continue
+            total, files, newest = total + st.st_size, files + 1, max(newest, st.st_mtime)
+    return total, files, newest
+
+
+def _size(n):
+    return f"{n / 1024 ** 3:.1f} GB" if n >= 1024 ** 3 else f"{n / 1024 ** 2:.0f} MB"
+
+
+class StorageManager:
+    def __init__(self, root=OUTPUT_DIR, index=None, max_bytes=MAX_BYTES, max_age=MAX_AGE, keep=KEEP):
+        self.root = root
+        # Un indice per cartella output (condiviso dai processi che la usano)
+        digest = hashlib.sha1(os.path.realpath(root).encode("utf-8")).hexdigest()[:12]
+        self.index = index or os.path.join(INDEX_DIR, f"storage_{digest}.db")
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.keep = set(keep)
+        self.local = threading.local()
+        self.thread = None
+        self.counters = {"evictions": 0, "evicted_bytes": 0}
+        os.makedirs(root, exist_ok=True)
+        if os.path.dirname(self.index): os.makedirs(os.path.dirname(self.index), exist_ok=True)
+        self._db().executescript(SCHEMA)
+
+    def _db(self):
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = self.local.db = sqlite3.connect(self.index, timeout=10, isolation_level=None)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    # --- ALLOCAZIONE ---
+    def new_session(self, prefix="session"):
+        name = f"{prefix}_{int(time.time() * 1000)}_{uuid.uuid4().hex[:6]}"
+        self.session_dir(name)
+        return name
+
+    def session_dir(self, name=None):
+        """Path della cartella della sessione (creata e registrata se manca); None = sessione nuova."""
+        if not name: name = self.new_session()
+        path = os.path.join(self.root, name)
+        os.makedirs(path, exist_ok=True)
+        now = time.time()
+        self._db().execute("INSERT OR IGNORE INTO entries (name, created, used) VALUES (?, ?, ?)", (name, now, now))
+        return path
+
+    def unique_path(self, session, stem, ext):
+        """File nuovo dentro la sessione: <stem>_<hex><ext>."""
+        return os.path.join(self.session_dir(session), f"{stem}_{uuid.uuid4().hex[:8]}{ext}")
+
+    def session_of(self, path):
+        """Cartella di sessione (figlio diretto di output/) che contiene path; None se è fuori o sciolto."""
+        rel = os.path.relpath(os.path.realpath(path), os.path.realpath(self.root))
+        parts = rel.split(os.sep, 1)
+        if rel.startswith("..") or len(parts) < 2 or parts[0] in self.keep: return None
+        return parts[0]
+
+    # --- USO ---
+    def track(self, name):
+        """Aggiorna dimensione e orologio LRU dopo una scrittura (name o path dentro output/)."""
+        if os.sep in name: name = self.session_of(name)
+        path = os.path.join(self.root, name or "")
+        if not name or not os.path.exists(path): return
+        size, files, _ = _scan_size(path)
+        now = time.time()
+        self._db().execute(
+            "INSERT INTO entries (name, bytes, files, created, used) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET bytes=excluded.bytes, files=excluded.files, used=excluded.used",
+            (name, size, files, now, now))
+
+    def hold(self, name, ttl=LIVE_TTL):
+        """Sessione in uso per ttl secondi: enforce() non la tocca."""
+        if not name: return
+        self.track(name)
+        self._db().execute("UPDATE entries SET live_until=MAX(live_until, ?) WHERE name=?", (time.time() + ttl, name))
+
+    def release(self, name):
+        if name: self._db().execute("UPDATE entries SET live_until=0 WHERE name=?", (name,))
+
+    # --- PULIZIA ---
+    def scan(self):
+        """Allinea l'indice al disco: voci nuove (file sciolti, sessioni di n8n), sparite, dimensioni."""
+        known = {r["name"]: r for r in self._db().execute("SELECT * FROM entries")}
+        names = set(os.listdir(self.root)) - self.keep
+        db = self._db()
+        for name in names:
+            try: size, files, newest = _scan_size(os.path.join(self.root, name))
+            except OSError: continue
+            if name in known:
+                db.execute("UPDATE entries SET bytes=?, files=?, used=MAX(used, ?) WHERE name=?", (size, files, newest, name))
+            else:
+                db.execute("INSERT OR IGNORE INTO entries (name, bytes, files, created, used) VALUES (?, ?, ?, ?, ?)",
+                           (name, size, files, newest, newest))
+        gone = [n for n in known if n not in names]
+        db.executemany("DELETE FROM entries WHERE name=?", [(n,) for n in gone])
+
+    def enforce(self, dry_run=False):
+        """Elimina le voci scadute e poi le meno usate oltre la quota. Restituisce [(nome, byte, motivo)]."""
+        now = time.time()
+        rows = self._db().execute("SELECT * FROM entries ORDER BY used").fetchall()
+        total = sum(r["bytes"] for r in rows)
+        evicted = []
+        for r in rows:
+            if r["name"] in self.keep or r["live_until"] > now or now - r["used"] < GRACE: continue
+            if self.max_age and now - r["used"] > self.max_age: reason = "age"
+            elif self.max_bytes and total > self.max_bytes: reason = "quota"
+            else: continue
+            evicted.append((r["name"], r["bytes"], reason))
+            total -= r["bytes"]
+            if dry_run: continue
+            path = os.path.join(self.root, r["name"])
+            if os.path.isdir(path): shutil.rmtree(path, ignore_errors=True)
+            else:
+                try: os.remove(path)
+                except FileNotFoundError: pass
+            self._db().execute("DELETE FROM entries WHERE name=?", (r["name"],))
+            self.counters["evictions"] += 1
+            self.counters["evicted_bytes"] += r["bytes"]
+            EVICTED.inc(r["bytes"], reason=reason)
+        if evicted and not dry_run:
+            log.info(f"💾 Output: eliminate {len(evicted)} voci ({_size(sum(b for _, b, _ in evicted))})")
+        return evicted
+
+    def usage(self):
+        now = time.time()
+        row = self._db().execute(
+            "SELECT COUNT(*) AS entries, COALESCE(SUM(bytes), 0) AS bytes, COALESCE(SUM(files), 0) AS files, "
+            "COALESCE(SUM(live_until > ?), 0) AS live, MIN(used) AS oldest FROM entries", (now,)).fetchone()
+        out = dict(row)
+        out["oldest_age"] = now - out.pop("oldest") if out["oldest"] is not None else 0.0
+        out.update(self.counters, max_bytes=self.max_bytes, max_age=self.max_age)
+        return out
+
+    def describe(self):
+        u = self.usage()
+        quota = f" / {_size(self.max_bytes)}" if self.max_bytes else ""
+        return f"💾 Output: {_size(u['bytes'])}{quota}, {u['entries']} voci ({u['live']} in uso), {u['files']} file"
+
+    def start(self, every=CHECK_EVERY):
+        """scan() + enforce() in un thread, subito e poi ogni `every` secondi."""
+        if self.thread is not None: return self
+
+        def run():
+            while True:
+                try:
+                    self.scan()
+                    self.enforce()
+                except Exception as e:
+                    log.warning(f"Pulizia output fallita: {e}")
+                time.sleep(every)
+
+        self.thread = threading.Thread(target=run, name="havas-storage", daemon=True)
+        self.thread.start()
+        return self
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_storage(root=OUTPUT_DIR):
+    with _managers_lock:
+        if root not in _managers: _managers[root] = StorageManager(root)
+        return _managers[root]
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Uso e pulizia della cartella output")
+    ap.add_argument("--root", default=OUTPUT_DIR)
+    ap.add_argument("--index", default=None, help=f"default: {INDEX_DIR}/storage_<hash della root>.db")
+    ap.add_argument("--max-gb", type=float, default=MAX_BYTES / 1024 ** 3)
+    ap.add_argument("--max-age-h", type=float, default=MAX_AGE / 3600)
+    ap.add_argument("--enforce", action="store_true", help="elimina le voci scadute / oltre la quota")
+    ap.add_argument("--dry-run", action="store_true", help="con --enforce: elenca soltanto")
+    args = ap.parse_args(argv)
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO, format='%(asctime)s - %(message)s')
+
+    store = StorageManager(args.root, args.index, int(args.max_gb * 1024 ** 3), int(args.max_age_h * 3600))
+    store.scan()
+    print(store.describe())
+    if args.enforce:
+        for name, size, reason in store.enforce(dry_run=args.dry_run):
+            print(f"   {'(dry-run) ' if args.dry_run else ''}🗑️ {name}  {_size(size)}  [{reason}]")
+        print(store.describe())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,112 @@
+"""
+🧩 Workflow template (formato API) con parametri nominali
+
+Ogni file viene letto e validato una volta sola e resta in cache finché non
+cambia l'mtime. I parametri (image, prompt, seed, ...) sono mappati sugli input
+dei nodi; render() copia solo i nodi patchati e condivide tutti gli altri con
+il template, quindi il costo per richiesta non dipende dalla grandezza del grafo.
+
+Con optimize=True (default) render() passa anche da havas.graph_opt: niente
+nodi di anteprima o morti, testo costante (CR Text / Text Concatenate) piegato
+in letterali. L'analisi del grafo si fa una volta, al caricamento.
+
+Attenzione: il dict restituito da render() condivide i nodi non patchati con la
+cache, va trattato come sola lettura (json.dumps e invio).
+"""
+
+import os
+import json
+import hashlib
+import logging
+import threading
+
+from havas import graph_opt
+
+log = logging.getLogger(__name__)
+
+
+class TemplateError(Exception):
+    pass
+
+
+def _normalize_params(params):
+    """{"seed": ("6", "seed")} oppure {"seed": [("6", "seed"), ("65", "seed")]} -> tuple di target."""
+    out = {}
+    for name, targets in (params or {}).items():
+        if isinstance(targets, tuple) and len(targets) == 2 and isinstance(targets[1], str):
+            targets = [targets]
+        out[name] = tuple((str(nid), key) for nid, key in targets)
+    return out
+
+
+class WorkflowTemplate:
+    def __init__(self, path, params=None, optimize=True):
+        self.path = path
+        self.params = _normalize_params(params)
+        try: st = os.stat(path)
+        except OSError as e: raise TemplateError(f"{path}: {e}")
+        self.stamp = (st.st_mtime_ns, st.st_size)
+
+        try:
+            with open(path, "r", encoding="utf-8") as f: raw = json.load(f)
+        except (OSError, ValueError) as e:
+            raise TemplateError(f"{path}: {e}")
+
+        if not isinstance(raw, dict) or ("nodes" in raw and "links" in raw):
+            raise TemplateError(f"{path}: non è in formato API (usa 'Export (API)' da ComfyUI)")
+
+        # Solo i nodi veri (via eventuali chiavi extra come in clean_wf)
+        self.prompt = {k: v for k, v in raw.items() if isinstance(v, dict) and "class_type" in v}
+        if not self.prompt: raise TemplateError(f"{path}: nessun nodo trovato")
+        self._check_bindings()
+        self.hash = hashlib.sha256(json.dumps(self.prompt, sort_keys=True).encode("utf-8")).hexdigest()
+        self.plan = graph_opt.plan(self.prompt) if optimize else None
+        if self.plan is not None and self.plan.changed:
+            log.info(f"🧹 {os.path.basename(path)}: " + self.plan.report().replace("\n", "; "))
+
+    def _check_bindings(self):
+        for name, targets in self.params.items():
+            if not targets: raise TemplateError(f"{self.path}: parametro '{name}' senza nodi")
+            for nid, key in targets:
+                node = self.prompt.get(nid)
+                if node is None:
+                    raise TemplateError(f"{self.path}: parametro '{name}' -> nodo {nid} inesistente")
+                inputs = node.get("inputs") or {}
+                if key not in inputs:
+                    raise TemplateError(f"{self.path}: parametro '{name}' -> input '{key}' assente nel nodo {nid} ({node['class_type']})")
+                if isinstance(inputs[key], list):
+                    raise TemplateError(f"{self.path}: parametro '{name}' -> input '{key}' del nodo {nid} è collegato a un altro nodo")
+
+    def defaults(self):
+        """Valori dei parametri così come sono salvati nel file."""
+        return {name: self.prompt[t[0][0]]["inputs"][t[0][1]] for name, t in self.params.items()}
+
+    def render(self, **values):
+        """Prompt per una richiesta: copia solo i nodi toccati dai parametri."""
+        prompt = dict(self.prompt)
+        for name, value in values.items():
+            targets = self.params.get(name)
+            if targets is None: raise TemplateError(f"{self.path}: parametro sconosciuto '{name}'")
+            for nid, key in targets:
+                node = prompt[nid]
+                if node is self.prompt[nid]:
+                    node = prompt[nid] = dict(node, inputs=dict(node["inputs"]))
+                node["inputs"][key] = value
+        return graph_opt.apply(prompt, self.plan) if self.plan is not None else prompt
+
+
+# --- CACHE (per path + parametri, invalidata su mtime/size) ---
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def load_template(path, params=None, optimize=True):
+    key = (os.path.abspath(path), tuple(sorted(_normalize_params(params).items())), optimize)
+    try: st = os.stat(path)
+    except OSError as e: raise TemplateError(f"{path}: {e}")
+    with _cache_lock:
+        tpl = _cache.get(key)
+        if tpl is not None and tpl.stamp == (st.st_mtime_ns, st.st_size): return tpl
+    tpl = WorkflowTemplate(path, params, optimize)
+    with _cache_lock: _cache[key] = tpl
+    return tpl
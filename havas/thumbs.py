@@ -0,0 +1,104 @@
+"""
+🖼️ Miniature in cache per le gallery (niente full-res decodificate per sessione)
+
+La gallery riceve il path di una miniatura JPEG (lato lungo THUMB_SIZE) invece
+di un np.array dell'immagine piena: Gradio serve il file così com'è, senza
+decodificare, copiare in numpy e ricodificare ogni variante. Il file originale
+si apre solo quando l'utente seleziona la variante.
+
+Le miniature sono su disco in THUMB_DIR con nome = hash di (path, mtime, size),
+quindi la stessa immagine non viene mai ridotta due volte (anche tra sessioni e
+riavvii) e un file riscritto ne produce una nuova. Vengono generate in un
+thread pool; iter_ready() le restituisce man mano che sono pronte.
+
+    for i, thumb in thumbs.iter_ready(paths): ...
+"""
+
+import os
+import time
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+log = logging.getLogger(__name__)
+
+THUMB_DIR = "/tmp/havas/thumbs"
+THUMB_SIZE = 384
+QUALITY = 85
+WORKERS = 4
+MAX_AGE = 7 * 24 * 3600
+
+
+class ThumbStore:
+    def __init__(self, root=THUMB_DIR, size=THUMB_SIZE, quality=QUALITY, workers=WORKERS):
+        self.root = root
+        self.size = size
+        self.quality = quality
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="havas-thumbs")
+        self.stats = {"made": 0, "hits": 0}
+
+    def path_for(self, src):
+        st = os.stat(src)
+        key = f"{os.path.abspath(src)}|{st.st_mtime_ns}|{st.st_size}|{self.size}"
+        return os.path.join(self.root, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".jpg")
+
+    def get(self, src):
+        """Path della miniatura di `src` (creata se manca)."""
+        from PIL import Image
+
+        dest = self.path_for(src)
+        if os.path.exists(dest):
+            self.stats["hits"] += 1
+            try: os.utime(dest)  # per prune(): conta l'ultimo uso, non la creazione
+            except OSError: pass
+            return dest
+        with Image.open(src) as im:
+            im.draft("RGB", (self.size, self.size))  # JPEG: decodifica già ridotta
+            im.thumbnail((self.size, self.size), Image.LANCZOS)
+            if im.mode != "RGB": im = im.convert("RGB")
+            os.makedirs(self.root, exist_ok=True)
+            tmp = f"{dest}.{os.getpid()}.{threading.get_ident()}.tmp"
+            im.save(tmp, "JPEG", quality=self.quality)
+        os.replace(tmp, dest)
+        self.stats["made"] += 1
+        return dest
+
+    def submit(self, src):
+        return self.pool.submit(self.get, src)
+
+    def iter_ready(self, paths):
+        """(indice in `paths`, miniatura) in ordine di completamento; se una fallisce si usa l'originale."""
+        futures = {self.submit(p): i for i, p in enumerate(paths)}
+        for fut in as_completed(futures):
+            i = futures[fut]
+            try:
+                yield i, fut.result()
+            except Exception as e:
+                log.warning(f"Miniatura di {paths[i]} fallita: {e}")
+                yield i, paths[i]
+
+    def prune(self, max_age=MAX_AGE):
+        """Via le miniature non usate da più di max_age secondi."""
+        if not os.path.isdir(self.root): return 0
+        cutoff, n = time.time() - max_age, 0
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    n += 1
+            except OSError:
+                pass
+        return n
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_thumbs():
+    global _store
+    with _store_lock:
+        if _store is None: _store = ThumbStore()
+        return _store
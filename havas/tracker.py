@@ -0,0 +1,457 @@
+"""
+📡 Tracking dei job ComfyUI via WebSocket (/ws?clientId=...)
+
+Segue gli eventi executing / progress / executed del nostro prompt_id e chiude
+il job appena i nodi di output hanno finito, senza aspettare il giro di polling.
+Se il socket non si apre o cade a metà, si passa al polling di /history + /queue.
+
+Ogni evento è un dict con una chiave "type":
+    queued    -> {"ahead": n}                  lavori davanti al nostro
+    started   -> {}
+    executing -> {"node", "fraction"}
+    progress  -> {"node", "value", "max", "fraction"}
+    executed  -> {"node", "output"}
+    fallback  -> {"reason"}                    WebSocket perso, si continua in polling
+    unreachable -> {"message"}                 polling fallito (server giù?), si riprova
+    preview   -> {"node", "image", "format"}   anteprima latente (bytes jpeg/png), solo con
+                                               preview_rate > 0 e al massimo preview_rate al secondo
+    done      -> {"outputs"}                   terminale
+    error     -> {"message"}                   terminale
+"""
+
+import json
+import time
+import struct
+import asyncio
+import uuid
+import logging
+
+import requests
+
+try:
+    import websocket  # pacchetto websocket-client
+except ImportError:
+    websocket = None
+
+try:
+    import aiohttp  # solo per AsyncJobTracker
+except ImportError:
+    aiohttp = None
+
+log = logging.getLogger(__name__)
+
+# Nodi che producono i file finali (type == "output")
+OUTPUT_NODE_TYPES = ("SaveImage", "VHS_VideoCombine", "SaveAnimatedWEBP")
+
+# Frame binari del WebSocket (ComfyUI avviato con --preview-method): 4 byte tipo evento, poi
+#   1 PREVIEW_IMAGE:               4 byte formato (1 jpeg, 2 png) + immagine
+#   4 PREVIEW_IMAGE_WITH_METADATA: 4 byte lunghezza + JSON (prompt_id, node_id, ...) + immagine
+PREVIEW_IMAGE = 1
+PREVIEW_IMAGE_WITH_METADATA = 4
+IMAGE_FORMATS = {1: "jpeg", 2: "png"}
+
+
+def new_client_id():
+    return uuid.uuid4().hex
+
+
+def ws_url(base_url, client_id):
+    base = base_url.rstrip("/")
+    if base.startswith("https://"): base = "wss://" + base[len("https://"):]
+    elif base.startswith("http://"): base = "ws://" + base[len("http://"):]
+    return f"{base}/ws?clientId={client_id}"
+
+
+def parse_preview(raw):
+    """Frame binario -> {"image", "format", "prompt_id", "node"} (None se non è un'anteprima)."""
+    if len(raw) < 8: return None
+    event, = struct.unpack(">I", raw[:4])
+    if event == PREVIEW_IMAGE:
+        kind, = struct.unpack(">I", raw[4:8])
+        return {"image": raw[8:], "format": IMAGE_FORMATS.get(kind, "jpeg"), "prompt_id": None, "node": None}
+    if event == PREVIEW_IMAGE_WITH_METADATA:
+        size, = struct.unpack(">I", raw[4:8])
+        try: meta = json.loads(raw[8:8 + size])
+        except ValueError: return None
+        fmt = (meta.get("image_type") or "image/jpeg").split("/")[-1]
+        return {"image": raw[8 + size:], "format": fmt, "prompt_id": meta.get("prompt_id"), "node": meta.get("node_id")}
+    return None
+
+
+def find_output_nodes(prompt):
+    """Id dei nodi di salvataggio in un workflow API-format."""
+    return [nid for nid, node in prompt.items()
+            if isinstance(node, dict) and node.get("class_type") in OUTPUT_NODE_TYPES]
+
+
+# --- STATO DI UN JOB ---
+class JobState:
+    def __init__(self, prompt_id, output_nodes=None, total_nodes=None, preview_rate=0):
+        self.prompt_id = prompt_id
+        self.output_nodes = set(output_nodes or [])
+        self.total_nodes = total_nodes
+        self.started = False
+        self.cached = set()
+        self.seen = set()
+        self.current = None
+        self.step = (0, 0)
+        self.outputs = {}
+        self.preview_every = 1.0 / preview_rate if preview_rate else None
+        self.last_preview = 0.0
+
+    def fraction(self):
+        if not self.total_nodes: return 0.0
+        done = len(self.cached) + max(len(self.seen) - 1, 0)
+        value, maximum = self.step
+        if maximum: done += value / maximum
+        return min(done / self.total_nodes, 1.0)
+
+    def done(self):
+        return {"type": "done", "outputs": self.outputs}
+
+    def handle(self, msg):
+        """Traduce un messaggio ComfyUI in un evento (o None se non ci riguarda)."""
+        t = msg.get("type")
+        data = msg.get("data") or {}
+
+        if t == "status":
+            if self.started: return None
+            remaining = data.get("status", {}).get("exec_info", {}).get("queue_remaining", 0)
+            return {"type": "queued", "ahead": max(remaining - 1, 0)}
+
+        if data.get("prompt_id") != self.prompt_id: return None
+
+        if t == "execution_start":
+            self.started = True
+            return {"type": "started"}
+
+        if t == "execution_cached":
+            self.cached.update(data.get("nodes") or [])
+            return None
+
+        if t == "executing":
+            node = data.get("node")
+            if node is None: return self.done()
+            self.started = True
+            self.current = node
+            self.seen.add(node)
+            self.step = (0, 0)
+            return {"type": "executing", "node": node, "fraction": self.fraction()}
+
+        if t == "progress":
+            self.step = (data.get("value", 0), data.get("max", 0))
+            return {"type": "progress", "node": data.get("node", self.current),
+                    "value": self.step[0], "max": self.step[1], "fraction": self.fraction()}
+
+        if t == "executed":
+            node = data.get("node")
+            self.outputs[node] = data.get("output") or {}
+            if self.output_nodes and self.output_nodes <= set(self.outputs): return self.done()
+            return {"type": "executed", "node": node, "output": self.outputs[node]}
+
+        if t == "execution_success":
+            return self.done()
+
+        if t == "execution_error":
+            return {"type": "error", "message": data.get("exception_message") or "Errore di esecuzione"}
+
+        if t == "execution_interrupted":
+            return {"type": "error", "message": "Esecuzione interrotta"}
+
+        return None
+
+    def preview(self, raw):
+        """Frame binario -> evento "preview" (o None: anteprime spente, troppo presto, altro prompt)."""
+        if self.preview_every is None or not self.started: return None
+        now = time.time()
+        if now - self.last_preview < self.preview_every: return None
+        frame = parse_preview(raw)
+        if frame is None or frame["prompt_id"] not in (None, self.prompt_id): return None
+        self.last_preview = now
+        return {"type": "preview", "node": frame["node"] or self.current, "image": frame["image"], "format": frame["format"]}
+
+
+# --- TRACKER ---
+class JobTracker:
+    """
+    Uso tipico: connect() PRIMA di inviare il prompt (con client_id=tracker.client_id),
+    poi iterare track(prompt_id) fino a un evento "done" o "error".
+    """
+
+    def __init__(self, base_url, client_id=None, poll_interval=1.0, idle_check=10.0,
+                 connect_timeout=5.0, session=None, preview_rate=0):
+        self.base_url = base_url.rstrip("/")
+        self.client_id = client_id or new_client_id()
+        self.poll_interval = poll_interval
+        self.idle_check = idle_check
+        self.connect_timeout = connect_timeout
+        self.http = session or requests
+        self.preview_rate = preview_rate  # anteprime al secondo (0 = frame binari ignorati)
+        self.ws = None
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def connect(self):
+        if websocket is None:
+            log.warning("websocket-client non installato, uso il polling")
+            return False
+        try:
+            self.ws = websocket.create_connection(ws_url(self.base_url, self.client_id),
+                                                  timeout=self.connect_timeout)
+            return True
+        except Exception as e:
+            log.warning(f"WebSocket non disponibile ({e}), uso il polling")
+            self.ws = None
+            return False
+
+    def close(self):
+        if self.ws is not None:
+            try: self.ws.close()
+            except Exception: pass
+        self.ws = None
+
+    def track(self, prompt_id, output_nodes=None, total_nodes=None, timeout=600):
+        state = JobState(prompt_id, output_nodes, total_nodes, self.preview_rate)
+        deadline = time.time() + timeout
+
+        if self.ws is not None:
+            for ev in self._track_ws(state, deadline):
+                yield ev
+                if ev["type"] in ("done", "error"): return
+            if time.time() >= deadline:
+                yield {"type": "error", "message": "Timeout"}
+                return
+            yield {"type": "fallback", "reason": "WebSocket chiuso"}
+
+        for ev in self._track_poll(state, deadline):
+            yield ev
+            if ev["type"] in ("done", "error"): return
+
+    # --- WEBSOCKET ---
+    def _track_ws(self, state, deadline):
+        self.ws.settimeout(self.poll_interval)
+        last_msg = time.time()
+
+        while time.time() < deadline:
+            try:
+                raw = self.ws.recv()
+            except websocket.WebSocketTimeoutException:
+                # Nessun evento da un po': controllo /history nel caso ne avessimo perso qualcuno
+                if time.time() - last_msg >= self.idle_check:
+                    last_msg = time.time()
+                    ev = self._history_event(state.prompt_id)
+                    if ev: yield ev
+                continue
+            except Exception as e:
+                log.warning(f"WebSocket perso: {e}")
+                self.close()
+                return
+
+            last_msg = time.time()
+            if not raw:
+                self.close()
+                return
+            if isinstance(raw, bytes):
+                ev = state.preview(raw)
+                if ev: yield ev
+                continue
+
+            try: msg = json.loads(raw)
+            except ValueError: continue
+
+            ev = state.handle(msg)
+            if ev is None: continue
+            if ev["type"] == "done": ev = self._complete_outputs(state, ev)
+            yield ev
+
+    def _complete_outputs(self, state, ev):
+        """I nodi in cache non emettono 'executed': in quel caso gli output li prende /history."""
+        missing = state.output_nodes - set(state.outputs) if state.output_nodes else not state.outputs
+        if not missing: return ev
+        hist = self._history_event(state.prompt_id)
+        return hist if hist and hist["type"] == "done" else ev
+
+    # --- POLLING ---
+    def _track_poll(self, state, deadline):
+        while time.time() < deadline:
+            try:
+                ev = self._history_event(state.prompt_id)
+                if ev:
+                    yield ev
+                    return
+                ahead = self._queue_ahead(state.prompt_id)
+                if ahead is None: yield {"type": "started"}
+                else: yield {"type": "queued", "ahead": ahead}
+            except Exception as e:
+                log.warning(f"Polling fallito: {e}")
+                # Server irraggiungibile: chi segue il job (es. havas.dispatch) può decidere di spostarlo
+                yield {"type": "unreachable", "message": str(e)}
+            time.sleep(self.poll_interval)
+        yield {"type": "error", "message": "Timeout"}
+
+    def _history_event(self, prompt_id):
+        try:
+            hist = self.http.get(f"{self.base_url}/history/{prompt_id}", timeout=10).json()
+        except Exception as e:
+            log.warning(f"Errore /history: {e}")
+            return None
+        return history_event(hist, prompt_id)
+
+    def _queue_ahead(self, prompt_id):
+        return queue_ahead(self.http.get(f"{self.base_url}/queue", timeout=10).json(), prompt_id)
+
+
+# --- TRACKER ASYNCIO (aiohttp) ---
+class AsyncJobTracker:
+    """Come JobTracker, ma su una aiohttp.ClientSession condivisa."""
+
+    def __init__(self, base_url, session, client_id=None, poll_interval=1.0, idle_check=10.0,
+                 connect_timeout=5.0, preview_rate=0):
+        self.base_url = base_url.rstrip("/")
+        self.session = session
+        self.client_id = client_id or new_client_id()
+        self.poll_interval = poll_interval
+        self.idle_check = idle_check
+        self.connect_timeout = connect_timeout
+        self.preview_rate = preview_rate
+        self.ws = None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def connect(self):
+        try:
+            self.ws = await self.session.ws_connect(ws_url(self.base_url, self.client_id),
+                                                    timeout=self.connect_timeout, max_msg_size=0)
+            return True
+        except Exception as e:
+            log.warning(f"WebSocket non disponibile ({e}), uso il polling")
+            self.ws = None
+            return False
+
+    async def close(self):
+        if self.ws is not None:
+            try: await self.ws.close()
+            except Exception: pass
+        self.ws = None
+
+    async def track(self, prompt_id, output_nodes=None, total_nodes=None, timeout=600):
+        state = JobState(prompt_id, output_nodes, total_nodes, self.preview_rate)
+        deadline = time.time() + timeout
+
+        if self.ws is not None:
+            async for ev in self._track_ws(state, deadline):
+                yield ev
+                if ev["type"] in ("done", "error"): return
+            if time.time() >= deadline:
+                yield {"type": "error", "message": "Timeout"}
+                return
+            yield {"type": "fallback", "reason": "WebSocket chiuso"}
+
+        async for ev in self._track_poll(state, deadline):
+            yield ev
+            if ev["type"] in ("done", "error"): return
+
+    async def _track_ws(self, state, deadline):
+        last_msg = time.time()
+
+        while time.time() < deadline:
+            try:
+                msg = await self.ws.receive(timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                if time.time() - last_msg >= self.idle_check:
+                    last_msg = time.time()
+                    ev = await self._history_event(state.prompt_id)
+                    if ev: yield ev
+                continue
+            except Exception as e:
+                log.warning(f"WebSocket perso: {e}")
+                await self.close()
+                return
+
+            last_msg = time.time()
+            if msg.type == aiohttp.WSMsgType.BINARY:
+                ev = state.preview(msg.data)
+                if ev: yield ev
+                continue
+            if msg.type != aiohttp.WSMsgType.TEXT:
+                await self.close()
+                return
+
+            try: ev = state.handle(json.loads(msg.data))
+            except ValueError: continue
+            if ev is None: continue
+            if ev["type"] == "done": ev = await self._complete_outputs(state, ev)
+            yield ev
+
+    async def _complete_outputs(self, state, ev):
+        missing = state.output_nodes - set(state.outputs) if state.output_nodes else not state.outputs
+        if not missing: return ev
+        hist = await self._history_event(state.prompt_id)
+        return hist if hist and hist["type"] == "done" else ev
+
+    async def _track_poll(self, state, deadline):
+        while time.time() < deadline:
+            try:
+                ev = await self._history_event(state.prompt_id)
+                if ev:
+                    yield ev
+                    return
+                ahead = await self._queue_ahead(state.prompt_id)
+                if ahead is None: yield {"type": "started"}
+                else: yield {"type": "queued", "ahead": ahead}
+            except Exception as e:
+                log.warning(f"Polling fallito: {e}")
+                # Server irraggiungibile: chi segue il job (es. havas.dispatch) può decidere di spostarlo
+                yield {"type": "unreachable", "message": str(e)}
+            await asyncio.sleep(self.poll_interval)
+        yield {"type": "error", "message": "Timeout"}
+
+    async def _history_event(self, prompt_id):
+        try:
+            async with self.session.get(f"{self.base_url}/history/{prompt_id}") as res:
+                hist = await res.json(content_type=None)
+        except Exception as e:
+            log.warning(f"Errore /history: {e}")
+            return None
+        return history_event(hist, prompt_id)
+
+    async def _queue_ahead(self, prompt_id):
+        async with self.session.get(f"{self.base_url}/queue") as res:
+            return queue_ahead(await res.json(content_type=None), prompt_id)
+
+
+# --- PARSING RISPOSTE HTTP ---
+def history_event(hist, prompt_id):
+    """Evento done/error dalla risposta di /history/{id}, None se il job non è ancora lì."""
+    entry = (hist or {}).get(prompt_id)
+    if not entry: return None
+    status = entry.get("status") or {}
+    if status.get("status_str") == "error":
+        return {"type": "error", "message": _history_error(status)}
+    return {"type": "done", "outputs": entry.get("outputs", {})}
+
+
+def queue_ahead(data, prompt_id):
+    """Lavori davanti al nostro in /queue, None se è già in esecuzione."""
+    running = data.get("queue_running", [])
+    if any(item[1] == prompt_id for item in running): return None
+    pending = sorted(data.get("queue_pending", []), key=lambda item: item[0])
+    for i, item in enumerate(pending):
+        if item[1] == prompt_id: return len(running) + i
+    return len(running) + len(pending)
+
+
+def _history_error(status):
+    for name, data in status.get("messages", []):
+        if name == "execution_error": return data.get("exception_message", "Errore di esecuzione")
+    return "Errore di esecuzione"
@@ -0,0 +1,193 @@
+"""
+📤 Upload input content-addressed (niente più input_gradio.png condiviso)
+
+Il file caricato prende il nome dallo sha256 del contenuto, quindi due utenti
+non si sovrascrivono più a metà job. Un indice locale (per istanza ComfyUI,
+SQLite condiviso dai processi del pod) ricorda gli hash già caricati: la
+stessa foto non viene mai inviata due volte.
+L'hash di un file viene calcolato una volta sola (memo su path + mtime + size).
+"""
+
+import os
+import asyncio
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+INDEX_FILE = "/tmp/havas/upload_index.db"
+NAME_PREFIX = "havas_"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploads (
+    base_url TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    name TEXT NOT NULL,
+    PRIMARY KEY (base_url, digest)
+)
+"""
+
+MIME = {".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".webp": "image/webp"}
+
+
+# --- HASH (memo per file) ---
+_digests = OrderedDict()
+_digests_lock = threading.Lock()
+_DIGEST_MEMO = 512
+
+
+def file_digest(path):
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+    with _digests_lock:
+        if key in _digests:
+            _digests.move_to_end(key)
+            return _digests[key]
+
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""): h.update(chunk)
+    digest = h.hexdigest()
+
+    with _digests_lock:
+        _digests[key] = digest
+        while len(_digests) > _DIGEST_MEMO: _digests.popitem(last=False)
+    return digest
+
+
+def content_name(digest, ext):
+    return f"{NAME_PREFIX}{digest[:32]}{ext.lower()}"
+
+
+# --- INDICE HASH GIÀ CARICATI ---
+class UploadIndex:
+    """(base_url, digest) -> nome su ComfyUI, in SQLite (WAL) condiviso da API e frontend."""
+
+    def __init__(self, path=INDEX_FILE):
+        self.path = path
+        self.local = threading.local()
+        self.data = {}  # senza path: solo in memoria
+        if not path: return
+        if os.path.dirname(path): os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db().execute(SCHEMA)
+
+    def _db(self):
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = self.local.db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    def get(self, base_url, digest):
+        if not self.path: return self.data.get((base_url, digest))
+        row = self._db().execute("SELECT name FROM uploads WHERE base_url=? AND digest=?", (base_url, digest)).fetchone()
+        return row[0] if row else None
+
+    def put(self, base_url, digest, name):
+        # Riga per riga: gli altri processi non perdono le loro voci
+        if not self.path:
+            self.data[(base_url, digest)] = name
+            return
+        self._db().execute("INSERT OR REPLACE INTO uploads (base_url, digest, name) VALUES (?, ?, ?)",
+                           (base_url, digest, name))
+
+
+_indexes = {}
+
+
+def get_index(path=INDEX_FILE):
+    if path not in _indexes: _indexes[path] = UploadIndex(path)
+    return _indexes[path]
+
+
+def _read(path):
+    with open(path, "rb") as f: return f.read()
+
+
+# --- UPLOADER ---
+class InputUploader:
+    def __init__(self, client, index=None):
+        self.client = client
+        self.index = index or get_index()
+        # Hash già verificati su questo server in questo processo (niente HEAD ripetute)
+        self.verified = set()
+        self.locks = {}
+        self.locks_lock = threading.Lock()
+        self.stats = {"uploaded": 0, "skipped": 0, "bytes_sent": 0}
+
+    def _lock(self, digest):
+        with self.locks_lock: return self.locks.setdefault(digest, threading.Lock())
+
+    def upload_path(self, path):
+        ext = os.path.splitext(path)[1] or ".png"
+        digest = file_digest(path)
+        return self._ensure(digest, ext, lambda: _read(path))
+
+    def upload_bytes(self, data, ext=".png", digest=None):
+        digest = digest or hashlib.sha256(data).hexdigest()
+        return self._ensure(digest, ext, lambda: data)
+
+    def _ensure(self, digest, ext, read):
+        base = self.client.base_url
+        with self._lock(digest):
+            name = self.index.get(base, digest)
+            if name and (digest in self.verified or self._exists(name)):
+                self.verified.add(digest)
+                self.stats["skipped"] += 1
+                return name
+
+            data = read()
+            name = self.client.upload_image(data, content_name(digest, ext), mime=MIME.get(ext.lower(), "image/png"))
+            self.index.put(base, digest, name)
+            self.verified.add(digest)
+            self.stats["uploaded"] += 1
+            self.stats["bytes_sent"] += len(data)
+            return name
+
+    def _exists(self, name):
+        """Il file è ancora in input/? (pod effimero: l'indice può essere più vecchio del server)"""
+        try:
+            res = self.client.request("HEAD", "view", "/view", params={"filename": name, "type": "input"})
+            return res.status_code == 200
+        except Exception:
+            return False
+
+
+class AsyncInputUploader:
+    """Come InputUploader, su AsyncComfyClient (stesso indice su disco)."""
+
+    def __init__(self, client, index=None):
+        self.client = client
+        self.index = index or get_index()
+        self.verified = set()
+        self.locks = {}
+        self.stats = {"uploaded": 0, "skipped": 0, "bytes_sent": 0}
+
+    async def upload_path(self, path):
+        ext = os.path.splitext(path)[1] or ".png"
+        digest = await asyncio.to_thread(file_digest, path)
+        base = self.client.base_url
+        lock = self.locks.setdefault(digest, asyncio.Lock())
+        async with lock:
+            name = await asyncio.to_thread(self.index.get, base, digest)
+            if name and (digest in self.verified or await self._exists(name)):
+                self.verified.add(digest)
+                self.stats["skipped"] += 1
+                return name
+
+            data = await asyncio.to_thread(_read, path)
+            name = await self.client.upload_image(data, content_name(digest, ext), mime=MIME.get(ext.lower(), "image/png"))
+            await asyncio.to_thread(self.index.put, base, digest, name)
+            self.verified.add(digest)
+            self.stats["uploaded"] += 1
+            self.stats["bytes_sent"] += len(data)
+            return name
+
+    async def _exists(self, name):
+        try:
+            status, _ = await self.client.request("HEAD", "view", "/view", read="bytes",
+                                                  params={"filename": name, "type": "input"})
+            return status == 200
+        except Exception:
+            return False
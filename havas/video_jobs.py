@@ -0,0 +1,173 @@
+"""
+🎬 Job video remoti (fal.ai Kling) gestiti da un solo loop asyncio
+
+Sostituisce il giro Wait Loop -> Check Status -> Is Finished? di
+_ALIEXPRESS__02___Video_Generator.json:
+- polling adattivo: si parte con intervalli brevi e si rallenta (backoff
+  esponenziale) finché lo stato non cambia; a ogni cambio si riparte veloci
+- tetto di job contemporanei per provider (coda locale oltre il limite)
+- l'MP4 finale viene scritto a chunk direttamente nella cartella di sessione
+- cancel: il job viene annullato anche sul provider (cancel_url)
+"""
+
+import os
+import base64
+import asyncio
+import logging
+import mimetypes
+
+from havas.client import FAL_URL, AsyncFalClient, FalError
+from havas.jobs import Job, JobManager
+from havas.metrics import Trace
+
+log = logging.getLogger(__name__)
+
+KLING_MODEL = "fal-ai/kling-video/v1.5/pro/image-to-video"
+
+# Job remoti contemporanei per provider
+PROVIDER_LIMITS = {"fal": 4}
+
+# Polling: primo controllo dopo MIN, poi x FACTOR fino a MAX (secondi)
+POLL_MIN = 2.0
+POLL_MAX = 20.0
+POLL_FACTOR = 1.5
+
+
+def data_uri(path):
+    mime = mimetypes.guess_type(path)[0] or "image/png"
+    with open(path, "rb") as f: return f"data:{mime};base64,{base64.b64encode(f.read()).decode('ascii')}"
+
+
+class VideoJob(Job):
+    def __init__(self, provider, model, image_path, prompt, dest, params):
+        super().__init__()
+        self.provider = provider
+        self.model = model
+        self.image_path = image_path
+        self.prompt = prompt
+        self.dest = dest
+        self.params = params
+        self.request_id = None
+        self.cancel_url = None
+        self.remote_status = None
+        self.polls = 0
+
+    def extra(self):
+        return {"provider": self.provider, "request_id": self.request_id, "remote_status": self.remote_status,
+                "polls": self.polls, "dest": self.dest}
+
+
+class VideoJobManager(JobManager):
+    def __init__(self, clients, limits=None, poll_min=POLL_MIN, poll_max=POLL_MAX, poll_factor=POLL_FACTOR,
+                 timeout=900, job_ttl=3600):
+        """clients = {"fal": AsyncFalClient(...)}"""
+        super().__init__(timeout, job_ttl)
+        self.clients = clients
+        self.limits = dict(PROVIDER_LIMITS, **(limits or {}))
+        self.poll_min = poll_min
+        self.poll_max = poll_max
+        self.poll_factor = poll_factor
+        self.sems = {}
+
+    async def submit(self, image_path, prompt, dest, provider="fal", model=KLING_MODEL, **params):
+        if provider not in self.sems: self.sems[provider] = asyncio.Semaphore(self.limits.get(provider, 1))
+        return self.add(VideoJob(provider, model, image_path, prompt, dest, params))
+
+    def submit_sync(self, image_path, prompt, dest, **kw):
+        return self.call(self.submit(image_path, prompt, dest, **kw))
+
+    async def _cancel(self, job):
+        if not job.cancel_url: return
+        try:
+            await self.clients[job.provider].cancel(job.cancel_url)
+        except Exception as e:
+            log.warning(f"Cancel {job.request_id} fallito: {e}")
+
+    # ========================================
+    # ESECUZIONE DI UN JOB
+    # ========================================
+
+    async def _run(self, job):
+        client = self.clients[job.provider]
+        if self.sems[job.provider].locked():
+            job.update(message=f"In attesa di uno slot {job.provider}")
+        with Trace(f"video-{job.provider}", job.id, model=job.model) as trace:
+            with trace.span("slot"):
+                await self.sems[job.provider].acquire()
+            try:
+                await self._execute(job, client, trace)
+            finally:
+                self.sems[job.provider].release()
+            trace.set(polls=job.polls)
+
+    async def _execute(self, job, client, trace):
+        job.update(status="submitting", progress=0.05, message="Invio a Kling")
+        with trace.span("encode"):
+            image = await asyncio.to_thread(data_uri, job.image_path)
+        payload = {"prompt": job.prompt, "image_url": image, "duration": "5", "aspect_ratio": "16:9"}
+        payload.update(job.params)
+        with trace.span("submit"):
+            sub = await client.submit(job.model, payload)
+        job.update(status="queued", progress=0.1, request_id=sub.get("request_id"), cancel_url=sub.get("cancel_url"),
+                   message="In coda sul provider")
+        trace.set(request_id=sub.get("request_id"))
+        trace.begin("queued")
+
+        try:
+            result = await asyncio.wait_for(self._poll(job, client, sub, trace), self.timeout)
+        except asyncio.TimeoutError:
+            # Il job remoto non deve restare in coda (e a pagamento) sul provider
+            await self._cancel(job)
+            raise FalError(f"Timeout dopo {self.timeout:.0f}s ({job.remote_status or 'IN_QUEUE'})")
+
+        url = (result.get("video") or {}).get("url")
+        if not url: raise FalError(f"Nessun video nella risposta: {result}")
+        job.update(status="downloading", progress=0.9, message="Download video")
+        os.makedirs(os.path.dirname(job.dest) or ".", exist_ok=True)
+
+        def on_chunk(done, total):
+            if total: job.update(progress=0.9 + 0.1 * done / total, message=f"Download video {done // 1024} KB")
+
+        with trace.span("download"):
+            size = await client.stream_to(url, job.dest, on_chunk=on_chunk)
+        trace.set(bytes=size)
+        job.update(status="done", progress=1.0, outputs=[job.dest], message=f"Video pronto ({size // 1024} KB)")
+
+    async def _poll(self, job, client, sub, trace):
+        """Polling con backoff: riparte da poll_min quando lo stato o la posizione in coda cambia."""
+        interval = self.poll_min
+        last = None
+        while True:
+            await asyncio.sleep(interval)
+            st = await client.status(sub["status_url"])
+            job.polls += 1
+            state = (st.get("status"), st.get("queue_position"))
+            if st.get("status") in ("IN_PROGRESS", "COMPLETED"): trace.switch("queued", "executing")
+            if st.get("status") == "COMPLETED":
+                trace.end("executing")
+                if st.get("error"): raise FalError(st["error"])
+                job.update(remote_status="COMPLETED", message="Generazione completata")
+                with trace.span("result"):
+                    return await client.result(sub["response_url"])
+            if st.get("status") == "IN_QUEUE":
+                job.update(status="queued", remote_status="IN_QUEUE",
+                           message=f"In coda sul provider (posizione {st.get('queue_position', '?')})")
+            elif st.get("status") == "IN_PROGRESS":
+                job.update(status="running", remote_status="IN_PROGRESS", progress=min(job.progress + 0.05, 0.85),
+                           message="Generazione video in corso")
+            else:
+                raise FalError(f"Stato sconosciuto: {st}")
+            interval = self.poll_min if state != last else min(interval * self.poll_factor, self.poll_max)
+            last = state
+
+
+_managers = {}
+
+
+def get_video_manager(key=None, base_url=None):
+    """Un manager (e un thread) per processo; la chiave fal arriva da FAL_KEY se non passata."""
+    key = key or os.environ.get("FAL_KEY")
+    base_url = base_url or os.environ.get("FAL_URL", FAL_URL)
+    if (key, base_url) not in _managers:
+        _managers[(key, base_url)] = VideoJobManager({"fal": AsyncFalClient(base_url, key=key)}).start()
+    return _managers[(key, base_url)]
@@ -0,0 +1,68 @@
+"""
+📚 Registro dei workflow API-format usati dai frontend
+
+Per ogni workflow: file JSON e parametri nominali -> (nodo, input).
+Il path è relativo alla cartella del frontend (dove gira app.py).
+
+"warmup" = input sovrascritti (per class_type) nel prompt minimo che
+havas.readiness lancia all'avvio: stessi modelli caricati, quasi niente calcolo.
+
+"preprocess" = cosa consuma il grafo dell'immagine di input (havas.preprocess):
+l'input viene ridimensionato e ricodificato prima dell'upload.
+"""
+
+from havas.preprocess import get_preprocessor
+from havas.templates import load_template
+
+# Qwen edit + RMBG lavorano a ~1024x1024 px di area: 1536 di lato lungo copre fino a 2.25:1.
+# Il LoRA white_to_scene vuole fondo bianco: la trasparenza dei PNG prodotto va appiattita su bianco.
+QWEN_EDIT_INPUT = {"max_side": 1536, "mode": "RGB", "alpha": "#FFFFFF", "format": "jpeg", "quality": 95}
+
+WORKFLOWS = {
+    "bg-change": {
+        "file": "bg-change.json",
+        "params": {
+            "image": ("49", "image"),   # LoadImage
+            "prompt": ("57", "text"),   # CR Text
+            "seed": ("6", "seed"),      # KSampler
+        },
+        "warmup": {
+            "KSampler": {"steps": 1},
+            "TextEncodeQwenImageEditPlusAdvance_lrzjason": {"target_size": 256},
+            "SaveImage": {"filename_prefix": "warmup/bg-change"},
+        },
+        "preprocess": QWEN_EDIT_INPUT,
+    },
+    # Step 1 AliExpress: 3 varianti (KSampler 6 / 63 / 67 -> SaveImage 54 / 65 / 69)
+    "aliexpress-images": {
+        "file": "aliexpress_api.json",
+        "params": {
+            "image": ("49", "image"),
+            "prompt": [("1", "prompt"), ("57", "text")],
+            "seed": ("6", "seed"),
+            "seed_2": ("63", "seed"),
+            "seed_3": ("67", "seed"),
+        },
+        "warmup": {
+            "KSampler": {"steps": 1},
+            "TextEncodeQwenImageEditPlusAdvance_lrzjason": {"target_size": 256},
+            "SaveImage": {"filename_prefix": "warmup/aliexpress"},
+        },
+        "preprocess": QWEN_EDIT_INPUT,
+    },
+}
+
+
+def get_warmup(name):
+    return WORKFLOWS[name].get("warmup", {})
+
+
+def get_preprocess(name):
+    """Preprocessor condiviso del workflow (None = input caricato così com'è)."""
+    spec = WORKFLOWS[name].get("preprocess")
+    return get_preprocessor(**spec) if spec else None
+
+
+def get_template(name, path=None):
+    spec = WORKFLOWS[name]
+    return load_template(path or spec["file"], spec["params"])
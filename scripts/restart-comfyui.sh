@@ -47,6 +47,15 @@ sync_workflows() {
 sync_models() {
     echo -e "${YELLOW}⏳ Sincronizzo modelli...${NC}"
     wget -q "$MODELS_LIST_URL" -O /tmp/modelli.txt || { echo -e "${RED}Impossibile scaricare modelli.txt${NC}"; return; }
+    # Con i moduli havas installati: download paralleli, ripresa dei file troncati e verifica sha256
+    for src in /tmp/comfyui/frontends/aliexpress /tmp/havas_frontends/bg-change; do
+        if [ -f "$src/havas/fetch_models.py" ]; then
+            (cd "$src" && python3 -m havas.fetch_models --manifest /tmp/modelli.txt --models-dir "$MODELS_DIR") \
+                && echo -e "${GREEN}Sincronizzazione modelli completa${NC}" \
+                || echo -e "${RED}Alcuni modelli non sono stati scaricati${NC}"
+            return
+        fi
+    done
     while IFS='|' read -r filename url tipo; do
         [[ "$filename" =~ ^[[:space:]]*# ]] && continue
         [[ -z "$filename" ]] && continue
@@ -65,6 +74,15 @@ sync_models() {
 sync_custom_nodes() {
     echo -e "${YELLOW}⏳ Sincronizzo custom nodes...${NC}"
     wget -q "$CUSTOM_NODES_FILE" -O /tmp/custom_nodes.txt || { echo -e "${RED}Impossibile scaricare custom_nodes.txt${NC}"; return; }
+    # Con i moduli havas installati: commit fissati, lockfile unico e wheel in cache
+    for src in /tmp/comfyui/frontends/aliexpress /tmp/havas_frontends/bg-change; do
+        if [ -f "$src/havas/build_env.py" ]; then
+            (cd "$src" && python3 -m havas.build_env --nodes /tmp/custom_nodes.txt --comfy-dir /tmp/comfyui) \
+                && echo -e "${GREEN}Sincronizzazione custom nodes completata${NC}" \
+                || echo -e "${RED}Alcuni custom nodes non sono stati configurati${NC}"
+            return
+        fi
+    done
     while IFS='|' read -r name repo; do
         [[ "$name" =~ ^[[:space:]]*# ]] && continue
         [[ -z "$name" ]] && continue
@@ -98,7 +116,15 @@ fi
 echo "🚀 Avvio ComfyUI..."
 cd /tmp/comfyui
 python main.py --listen 0.0.0.0 --port 8188 --enable-cors-header --force-fp16 --preview-method auto &
-sleep 5
+# Attende che il server risponda davvero (i frontend poi rifanno il warm-up da soli)
+for src in /tmp/comfyui/frontends/aliexpress /tmp/havas_frontends/bg-change ""; do
+    if [ -z "$src" ]; then sleep 5; break; fi
+    if [ -f "$src/havas/readiness.py" ]; then
+        (cd "$src" && python3 -m havas.readiness --url http://127.0.0.1:8188 --timeout 600) \
+            || { echo -e "${RED}ComfyUI non risponde${NC}"; exit 1; }
+        break
+    fi
+done
 echo -e "${GREEN}✔ ComfyUI avviato.${NC}"
 
 EOF
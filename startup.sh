@@ -37,7 +37,30 @@ fi
 
 cd "$COMFY_DIR"
 
-if [ -f "requirements.txt" ]; then
+# Requirements di ComfyUI + ComfyUI-Manager con havas.build_env: lockfile e wheel in cache
+# (HAVAS_CACHE_DIR, default /workspace/.havas-cache), pip solo se qualcosa è cambiato
+if [ -z "${HAVAS_CACHE_DIR:-}" ]; then
+  if [ -d /workspace ]; then HAVAS_CACHE_DIR="/workspace/.havas-cache"; else HAVAS_CACHE_DIR="/tmp/havas-cache"; fi
+fi
+export HAVAS_CACHE_DIR
+# Checkout del repo in cache: clonato solo la prima volta; l'aggiornamento scaricato
+# in background al boot precedente si applica in locale, senza rete sul percorso critico
+HAVAS_SRC="$HAVAS_CACHE_DIR/havas-src"
+ENV_BUILT=0
+if [ -d "$HAVAS_SRC/.git" ]; then
+  git -C "$HAVAS_SRC" reset -q --hard FETCH_HEAD 2>/dev/null || true
+  (git -C "$HAVAS_SRC" fetch -q --depth 1 origin HEAD >/dev/null 2>&1 &)
+else
+  mkdir -p "$HAVAS_CACHE_DIR"
+  rm -rf "$HAVAS_SRC.tmp"
+  git clone -q --depth 1 https://github.com/werhealthy/-runpod-comfyui-Havas.git "$HAVAS_SRC.tmp" \
+    && mv "$HAVAS_SRC.tmp" "$HAVAS_SRC"
+fi
+if [ -f "$HAVAS_SRC/havas/build_env.py" ]; then
+  (cd "$HAVAS_SRC" && python -m havas.build_env --nodes custom_nodes.txt --comfy-dir "$COMFY_DIR") && ENV_BUILT=1
+fi
+
+if [ "$ENV_BUILT" != 1 ] && [ -f "requirements.txt" ]; then
   echo "📦 Installo/aggiorno requirements di ComfyUI..."
   pip install --no-cache-dir -r requirements.txt
 fi
@@ -59,7 +82,9 @@ echo "alias restartcomfy='/usr/local/bin/restart-comfyui.sh'" >> /root/.bashrc
 
 echo "🔧 Installazione ComfyUI-Manager..."
 MANAGER_DIR="$CUSTOM_NODES_DIR/ComfyUI-Manager"
-if [ ! -d "$MANAGER_DIR/.git" ]; then
+if [ "$ENV_BUILT" = 1 ]; then
+  echo "✓ ComfyUI-Manager configurato da havas.build_env"
+elif [ ! -d "$MANAGER_DIR/.git" ]; then
   git clone --depth=1 https://github.com/ltdrdata/ComfyUI-Manager.git "$MANAGER_DIR"
   if [ -f "$MANAGER_DIR/requirements.txt" ]; then
     pip install -q --no-cache-dir -r "$MANAGER_DIR/requirements.txt"
@@ -98,7 +123,13 @@ python main.py \
   --enable-cors-header \
   > /tmp/comfyui.log 2>&1 &
 
-sleep 5
+# Health vero invece di uno sleep fisso (il warm-up dei modelli lo fanno i frontend)
+if [ -f "$HAVAS_SRC/havas/readiness.py" ]; then
+  (cd "$HAVAS_SRC" && python -m havas.readiness --url http://127.0.0.1:8188 --timeout 600) \
+    || echo "⚠️ ComfyUI non risponde, controlla /tmp/comfyui.log"
+else
+  sleep 5
+fi
 
 ########################################
 # 7. INSTALLA JUPYTER LAB + TERMINALS
@@ -0,0 +1,50 @@
+"""
+Fixture comuni: mock ComfyUI/n8n (havas.mock_comfy) su porte libere, un'istanza per test.
+
+    python -m pytest -q tests
+"""
+
+import os
+import sys
+import socket
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path: sys.path.insert(0, ROOT)
+
+from havas.mock_comfy import MockBackend  # noqa: E402
+
+# Mock veloce: qualche decimo di secondo per prompt, niente latenza aggiunta
+MOCK_DEFAULTS = {"gpu_time": 0.4, "steps": 4, "latency": 0, "image_size": 32,
+                 "video_time": 0.1, "final_time": 0.1, "video_bytes": 1024}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_mock(output_dir, **kw):
+    backend = MockBackend(output_dir=str(output_dir), **dict(MOCK_DEFAULTS, **kw))
+    return backend.start("127.0.0.1", free_port(), free_port())
+
+
+def graph(samplers=1):
+    """Workflow minimo in API-format: n KSampler + SaveImage (+ PreviewImage, che non è un output finale)."""
+    prompt = {str(i): {"class_type": "KSampler", "inputs": {"seed": i}} for i in range(1, samplers + 1)}
+    prompt["90"] = {"class_type": "PreviewImage", "inputs": {}}
+    prompt["99"] = {"class_type": "SaveImage", "inputs": {"filename_prefix": "test"}}
+    return prompt
+
+
+@pytest.fixture
+def comfy(tmp_path):
+    return start_mock(tmp_path / "comfyui")
+
+
+@pytest.fixture
+def dead_url():
+    """URL su cui non ascolta nessuno."""
+    return f"http://127.0.0.1:{free_port()}"
@@ -0,0 +1,87 @@
+"""havas.api: upload multipart, parametri non validi, job che finisce prima di _follow."""
+
+import os
+import time
+import asyncio
+import hashlib
+import logging
+
+import aiohttp
+from aiohttp.test_utils import TestServer, TestClient
+
+from havas.api import JobApi, HOUSEKEEPING
+from havas.job_store import JobStore
+
+PNG = b"\x89PNG upload " * 1000
+
+
+class InstantManager:
+    """Job già finito quando _follow si iscrive: subscribe() non produce snapshot."""
+
+    def __init__(self):
+        self.jobs, self.params = {}, []
+
+    def get(self, job_id):
+        now = time.time()
+        return {"id": job_id, "status": "done", "progress": 1.0, "message": "", "outputs": [], "error": None,
+                "created": now, "updated": now}
+
+    async def subscribe(self, job_id):
+        return
+        yield
+
+    async def submit(self, params):
+        self.params.append(params)
+        return f"job{len(self.params)}"
+
+
+async def with_client(tmp_path, check):
+    api = JobApi(JobStore(str(tmp_path / "jobs.db")), out_dir=str(tmp_path / "comfyui"), allow_dirs=())
+    manager = InstantManager()
+    api.add_pipeline("echo", manager, manager.submit)
+    app = api.app()
+    client = TestClient(TestServer(app))
+    await client.start_server()
+    try: await check(client, manager)
+    finally: await client.close()
+    return app
+
+
+def test_multipart_upload_and_follow(tmp_path, caplog):
+    async def check(client, manager):
+        form = aiohttp.FormData()
+        form.add_field("pipeline", "echo")
+        form.add_field("params", '{"prompt": "p"}')
+        form.add_field("image", PNG, filename="Foto.PNG", content_type="image/png")
+        res = await client.post("/jobs", data=form)
+        assert res.status == 202
+        await asyncio.sleep(0.1)  # _follow in background
+        path = manager.params[0]["image"]
+        assert os.path.basename(path) == hashlib.sha256(PNG).hexdigest()[:32] + ".png"
+        with open(path, "rb") as f: assert f.read() == PNG
+        assert os.listdir(os.path.dirname(path)) == [os.path.basename(path)]  # niente .upload_ rimasti
+        assert (await (await client.get("/jobs/job1")).json())["status"] == "done"
+
+    with caplog.at_level(logging.ERROR, logger="havas.api"):
+        asyncio.run(with_client(tmp_path, check))
+    assert not [r for r in caplog.records if "non salvato" in r.getMessage()]
+
+
+def test_list_limit_validation(tmp_path):
+    async def check(client, manager):
+        for bad in ("abc", "0", "-3", "1.5"):
+            res = await client.get("/jobs", params={"limit": bad})
+            assert res.status == 400 and "limit" in (await res.json())["error"]
+        res = await client.get("/jobs", params={"limit": "5000"})
+        assert res.status == 200 and await res.json() == []
+
+    asyncio.run(with_client(tmp_path, check))
+
+
+def test_housekeeping_cancelled_on_cleanup(tmp_path):
+    async def check(client, manager):
+        task = client.app[HOUSEKEEPING]
+        assert not task.done()
+
+    app = asyncio.run(with_client(tmp_path, check))
+    assert app[HOUSEKEEPING].cancelled()
@@ -0,0 +1,62 @@
+"""havas.build_env contro repo git locali: nodi senza pin congelati in cache, --update, --pin senza installazione."""
+
+import sys
+import sysconfig
+import subprocess
+
+import pytest
+
+from havas.build_env import interpreter, local_head, parse_nodes, pin_nodes, sync_node
+
+pytestmark = pytest.mark.skipif(subprocess.run(["git", "--version"], capture_output=True).returncode != 0,
+                                reason="git non disponibile")
+
+
+def git(cwd, *args):
+    return subprocess.run(["git", *args], cwd=cwd, check=True, capture_output=True, text=True).stdout.strip()
+
+
+def commit(repo, text):
+    (repo / "nodes.py").write_text(text)
+    git(repo, "add", "-A")
+    git(repo, "-c", "user.name=t", "-c", "user.email=t@t", "commit", "-q", "-m", text)
+    return git(repo, "rev-parse", "HEAD")
+
+
+@pytest.fixture
+def upstream(tmp_path):
+    repo = tmp_path / "upstream"
+    repo.mkdir()
+    git(repo, "init", "-q")
+    return repo
+
+
+def test_unpinned_node_stays_on_cached_commit(upstream, tmp_path):
+    first = commit(upstream, "v1")
+    node = {"name": "Node", "repo": str(upstream), "commit": None}
+    nodes_dir, cache = tmp_path / "custom_nodes", tmp_path / "cache"
+    assert sync_node(node, str(nodes_dir), str(cache)) == (first, True)
+
+    second = commit(upstream, "v2")  # push upstream: il boot successivo non se ne accorge
+    assert sync_node(node, str(nodes_dir), str(cache)) == (first, False)
+    # Pod nuovo (custom_nodes vuoto): copia dalla cache, sempre al primo commit
+    assert sync_node(node, str(tmp_path / "pod2"), str(cache)) == (first, True)
+    # Solo --update riallinea all'HEAD remoto
+    assert sync_node(node, str(nodes_dir), str(cache), update=True) == (second, True)
+    assert local_head(str(cache / "nodes" / "Node")) == second
+
+
+def test_pin_without_installed_nodes(upstream, tmp_path):
+    head = commit(upstream, "v1")
+    manifest = tmp_path / "custom_nodes.txt"
+    manifest.write_text(f"# nome|repo|commit\nNode|{upstream}|\nFixed|{upstream}|abc123\n")
+    assert pin_nodes(str(manifest), str(tmp_path / "comfyui")) == 1
+    assert [n["commit"] for n in parse_nodes(str(manifest))] == [head, "abc123"]
+    assert manifest.read_text().startswith("# nome|repo|commit\n")
+
+
+def test_interpreter_of_target_python():
+    # Versione e tag del --python passato, usati per la chiave dell'ambiente e la cartella delle wheel
+    version, tag = interpreter(sys.executable)
+    assert version == sys.version
+    assert tag.startswith(sys.implementation.cache_tag + "-") and sysconfig.get_platform().replace("/", "_") in tag
@@ -0,0 +1,60 @@
+"""havas.client (asyncio): risposte di errore non JSON del proxy davanti a ComfyUI / fal."""
+
+import asyncio
+
+import pytest
+from aiohttp import web
+
+from havas.client import AsyncComfyClient, AsyncFalClient, ComfyError, FalError
+
+from conftest import free_port
+
+BAD_GATEWAY = "<html><body><h1>502 Bad Gateway</h1></body></html>"
+
+
+async def serve(routes):
+    app = web.Application()
+    app.router.add_routes(routes)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    port = free_port()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner, f"http://127.0.0.1:{port}"
+
+
+def test_html_error_page_raises_with_status():
+    hits = []
+
+    async def gateway(request):
+        hits.append(request.method)
+        return web.Response(status=502, text=BAD_GATEWAY, content_type="text/html")
+
+    async def invalid(request):
+        return web.json_response({"error": {"message": "Prompt vuoto"}}, status=400)
+
+    async def run():
+        runner, url = await serve([web.get("/queue", gateway), web.post("/upload/image", gateway),
+                                   web.post("/prompt", invalid), web.post("/fal/model", gateway)])
+        client = AsyncComfyClient(url, retries=2, backoff=0.01)
+        fal = AsyncFalClient(url, retries=2, backoff=0.01)
+        try:
+            with pytest.raises(ComfyError, match="HTTP 502"):
+                await client.queue()
+            assert hits == ["GET"] * 3  # i 5xx dei GET vengono ripetuti
+            hits.clear()
+            with pytest.raises(ComfyError, match="HTTP 502"):
+                await client.upload_image(b"png", "a.png")
+            assert hits == ["POST"]  # le POST no
+            # Errore JSON di ComfyUI: il corpo arriva al chiamante come prima
+            with pytest.raises(ComfyError, match="Prompt vuoto"):
+                await client.submit({"1": {}})
+            status, body = await client.request("POST", "prompt", "/prompt", json={})
+            assert status == 400 and body["error"]["message"] == "Prompt vuoto"
+            with pytest.raises(FalError, match="HTTP 502"):
+                await fal.submit("fal/model", {})
+        finally:
+            await client.close()
+            await fal.close()
+            await runner.cleanup()
+
+    asyncio.run(run())
@@ -0,0 +1,81 @@
+"""havas.dispatch con due mock ComfyUI: scelta del meno carico, BackendDown dal tracker, retry sull'altro backend."""
+
+import pytest
+
+from havas.client import ComfyClient
+from havas.dispatch import Dispatcher, Backend, BackendDown, UNREACHABLE_LIMIT
+from havas.tracker import JobTracker
+
+from conftest import start_mock, graph
+
+WORKFLOW = "test"
+
+
+def make_dispatcher(*mocks):
+    return Dispatcher([Backend(m.url, client=ComfyClient(m.url, retries=0)) for m in mocks])
+
+
+def run_job(dispatcher, kill=None):
+    """Come ImageOrchestrator._run: un job per lease, ripartito altrove su BackendDown.
+
+    kill(node) viene chiamato subito dopo il submit (pod che cade a metà job).
+    Ritorna (url del backend che l'ha finito, evento done, eventi visti, backend provati).
+    """
+    tried, events = [], []
+    while True:
+        try:
+            with dispatcher.lease(WORKFLOW, exclude=tried) as node:
+                pid = node.client.submit(graph())
+                if kill: kill(node)
+                tracker = JobTracker(node.url, poll_interval=0.02, session=node.client.session)
+                for ev in node.watch(tracker.track(pid, timeout=10)):
+                    events.append(ev)
+                    if ev["type"] in ("done", "error"): return node.url, ev, events, tried
+        except BackendDown as e:
+            tried.append(e.url)
+
+
+def test_pick_least_loaded(tmp_path):
+    a, b = start_mock(tmp_path / "a", gpu_time=5.0), start_mock(tmp_path / "b", gpu_time=5.0)
+    dispatcher = make_dispatcher(a, b)
+    for _ in range(3): dispatcher.get(a.url).client.submit(graph())
+    for backend in dispatcher.backends: dispatcher.refresh(backend)
+    assert [backend.depth for backend in dispatcher.backends] == [3, 0]
+    assert dispatcher.pick(WORKFLOW).url == b.url
+
+    # A code vuote decidono le lease aperte da questo processo
+    c, d = start_mock(tmp_path / "c"), start_mock(tmp_path / "d")
+    dispatcher = make_dispatcher(c, d)
+    first, second = dispatcher.lease(WORKFLOW), dispatcher.lease(WORKFLOW)
+    assert (first.url, second.url) == (c.url, d.url)
+    first.release()
+    assert dispatcher.pick(WORKFLOW).url == c.url
+
+
+def test_backend_down_after_unreachable_polls(tmp_path):
+    a, b = start_mock(tmp_path / "a", gpu_time=30.0), start_mock(tmp_path / "b")
+    dispatcher = make_dispatcher(a, b)
+    events = []
+    with pytest.raises(BackendDown) as exc:
+        with dispatcher.lease(WORKFLOW) as node:
+            pid = node.client.submit(graph())
+            a.stop()
+            for ev in node.watch(JobTracker(node.url, poll_interval=0.02).track(pid, timeout=10)):
+                events.append(ev)
+    assert exc.value.url == a.url
+    assert [ev["type"] for ev in events] == ["unreachable"] * (UNREACHABLE_LIMIT - 1)
+    down = dispatcher.get(a.url)
+    assert not down.healthy and down.inflight == 0
+    assert dispatcher.pick(WORKFLOW).url == b.url
+
+
+def test_lease_retries_on_other_backend(tmp_path):
+    a, b = start_mock(tmp_path / "a", gpu_time=30.0), start_mock(tmp_path / "b")
+    dispatcher = make_dispatcher(a, b)
+    url, done, events, tried = run_job(dispatcher, kill=lambda node: node.url == a.url and a.stop())
+    assert tried == [a.url] and url == b.url
+    assert done["type"] == "done" and done["outputs"]
+    assert sum(ev["type"] == "unreachable" for ev in events) == UNREACHABLE_LIMIT - 1
+    assert not dispatcher.get(a.url).healthy
+    assert [backend.inflight for backend in dispatcher.backends] == [0, 0]
+    assert WORKFLOW in dispatcher.get(b.url).loaded
@@ -0,0 +1,152 @@
+"""havas.fetch_models contro un server HTTP locale: ripresa con Range, hash sbagliato, pin dai metadati LFS."""
+
+import os
+import hashlib
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+import requests
+
+from havas.fetch_models import FetchError, download, fetch, parse_manifest, pin_manifest, read_marker, target_path
+
+CONTENT = os.urandom(3 * 1024 * 1024 + 123)
+DIGEST = hashlib.sha256(CONTENT).hexdigest()
+
+
+class ModelServer:
+    """File unico a /model.safetensors; HEAD con gli header X-Linked-* come Hugging Face."""
+
+    def __init__(self, content=CONTENT, linked=DIGEST):
+        self.content = content
+        self.linked = linked
+        self.ranges = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args): pass
+
+            def do_HEAD(self):
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(server.content)))
+                if server.linked:
+                    self.send_header("X-Linked-Etag", f'"{server.linked}"')
+                    self.send_header("X-Linked-Size", str(len(server.content)))
+                self.end_headers()
+
+            def do_GET(self):
+                rng = self.headers.get("Range")
+                server.ranges.append(rng)
+                start = int(rng.split("=")[1].split("-")[0]) if rng else 0
+                if start >= len(server.content):
+                    self.send_response(416)
+                    self.send_header("Content-Range", f"bytes */{len(server.content)}")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                body = server.content[start:]
+                self.send_response(206 if rng else 200)
+                if rng: self.send_header("Content-Range", f"bytes {start}-{len(server.content) - 1}/{len(server.content)}")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}/model.safetensors"
+
+    def close(self):
+        self.httpd.shutdown()
+
+
+@pytest.fixture
+def server():
+    s = ModelServer()
+    yield s
+    s.close()
+
+
+def entry(url, sha256=None, size=None):
+    return {"filename": "model.safetensors", "url": url, "type": "loras", "sha256": sha256, "size": size}
+
+
+def test_range_resume(server, tmp_path):
+    e = entry(server.url, DIGEST, len(CONTENT))
+    path = target_path(e, str(tmp_path))
+    os.makedirs(os.path.dirname(path))
+    done = 1024 * 1024 + 7
+    with open(path + ".part", "wb") as f: f.write(CONTENT[:done])  # boot interrotto a metà download
+    status, fetched, _ = fetch(requests.Session(), e, str(tmp_path), retries=1)
+    assert status == "ok" and fetched == len(CONTENT) - done
+    assert server.ranges == [f"bytes={done}-"]
+    with open(path, "rb") as f: assert f.read() == CONTENT
+    assert read_marker(path)["sha256"] == DIGEST and not os.path.exists(path + ".part")
+    # Secondo boot: il marker basta, niente download né hash
+    assert fetch(requests.Session(), e, str(tmp_path), retries=1)[0] == "skip"
+    assert len(server.ranges) == 1
+
+
+def test_truncated_final_file_is_resumed(server, tmp_path):
+    e = entry(server.url, DIGEST, len(CONTENT))
+    path = target_path(e, str(tmp_path))
+    os.makedirs(os.path.dirname(path))
+    with open(path, "wb") as f: f.write(CONTENT[:1000])  # troncato da un wget interrotto
+    assert fetch(requests.Session(), e, str(tmp_path), retries=1)[:2] == ("ok", len(CONTENT) - 1000)
+    assert server.ranges == ["bytes=1000-"]
+
+
+def test_stale_larger_file_is_replaced(server, tmp_path):
+    e = entry(server.url, DIGEST, len(CONTENT))
+    path = target_path(e, str(tmp_path))
+    os.makedirs(os.path.dirname(path))
+    with open(path, "wb") as f: f.write(os.urandom(len(CONTENT) + 5000))  # revisione vecchia, più grande
+    assert fetch(requests.Session(), e, str(tmp_path), retries=1)[:2] == ("ok", len(CONTENT))
+    assert server.ranges == [None]
+    with open(path, "rb") as f: assert f.read() == CONTENT
+
+
+def test_range_past_end_restarts(server, tmp_path):
+    # Senza dimensione nel manifest: il 416 con .part più lungo del file remoto fa ripartire da zero
+    e = entry(server.url)
+    path = target_path(e, str(tmp_path))
+    os.makedirs(os.path.dirname(path))
+    with open(path + ".part", "wb") as f: f.write(b"x" * (len(CONTENT) + 5000))
+    assert download(requests.Session(), e, path) == len(CONTENT)
+    assert server.ranges == [f"bytes={len(CONTENT) + 5000}-", None]
+    with open(path, "rb") as f: assert f.read() == CONTENT
+    assert not os.path.exists(path + ".part")
+
+
+def test_hash_mismatch(server, tmp_path):
+    e = entry(server.url, "0" * 64, len(CONTENT))
+    path = target_path(e, str(tmp_path))
+    with pytest.raises(FetchError, match="sha256"):
+        fetch(requests.Session(), e, str(tmp_path), retries=2, backoff=0)
+    # Contenuto sbagliato: niente file finale e niente .part da cui riprendere
+    assert not os.path.exists(path) and not os.path.exists(path + ".part")
+    assert server.ranges == [None, None]
+
+
+def test_unpinned_entry_uses_lfs_hash(tmp_path):
+    bad = ModelServer(linked="f" * 64)  # il server dichiara un hash diverso dal contenuto
+    try:
+        with pytest.raises(FetchError, match="sha256"):
+            fetch(requests.Session(), entry(bad.url), str(tmp_path), retries=1)
+    finally:
+        bad.close()
+    good = ModelServer()
+    try:
+        path = target_path(entry(good.url), str(tmp_path))
+        assert fetch(requests.Session(), entry(good.url), str(tmp_path), retries=1)[0] == "ok"
+        assert read_marker(path)["sha256"] == DIGEST
+    finally:
+        good.close()
+
+
+def test_pin_from_remote_metadata(server, tmp_path):
+    manifest = tmp_path / "models.txt"
+    manifest.write_text(f"# commento\nmodel.safetensors|{server.url}|loras||\n")
+    assert pin_manifest(str(manifest), str(tmp_path / "models")) == 1
+    assert parse_manifest(str(manifest)) == [entry(server.url, DIGEST, len(CONTENT))]
+    assert manifest.read_text().startswith("# commento\n")
+    assert server.ranges == []  # solo HEAD
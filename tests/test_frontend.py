@@ -0,0 +1,33 @@
+"""frontend_product_demo contro il mock ComfyUI (caricato come fa havas.bench): anteprime e immagine finale."""
+
+import pytest
+
+pytest.importorskip("gradio")
+
+from havas.bench import load_app, make_input, noop  # noqa: E402
+
+from conftest import start_mock  # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    comfy = start_mock(tmp_path / "comfyui", gpu_time=2.0, steps=20, image_size=32)
+    monkeypatch.setenv("COMFY_URL", comfy.url)
+    monkeypatch.setenv("COMFY_URLS", comfy.url)
+    monkeypatch.delenv("HAVAS_API_URL", raising=False)
+    return load_app("bg-change")
+
+
+def test_previews_then_final_image(app, tmp_path):
+    app.PREVIEW_FPS = 2
+    image = make_input(str(tmp_path / "product.png"), size=64)
+    frames = [img for img, _ in app.run_process(image, "prodotto su marmo", 42, True, progress=noop) if img is not None]
+    # Anteprime latenti del mock (256px) a PREVIEW_FPS, poi l'output finale (32px) al posto dell'ultima
+    *previews, final = frames
+    assert 3 <= len(previews) <= 5
+    assert all(im.size == (256, 256) for im in previews)
+    assert final.size == (32, 32)
+
+    app.PREVIEW_FPS = 0  # anteprime spente: solo l'immagine finale
+    frames = [img for img, _ in app.run_process(image, "prodotto su marmo", 42, True, progress=noop) if img is not None]
+    assert [im.size for im in frames] == [(32, 32)]
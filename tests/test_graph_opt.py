@@ -0,0 +1,62 @@
+"""havas.graph_opt: pruning dei nodi di sola anteprima e folding del testo costante sui grafi veri."""
+
+import os
+import copy
+import json
+
+from havas.graph_opt import plan, apply, optimize
+from havas.workflows import get_template
+
+from conftest import ROOT
+
+BG_CHANGE = os.path.join(ROOT, "frontend_product_demo", "bg-change.json")
+
+
+def load(path):
+    with open(path, "r", encoding="utf-8") as f: return json.load(f)
+
+
+def test_prune_preview_and_comparer():
+    p = plan(load(BG_CHANGE))
+    # GGUFLoaderKJ scollegato, Image Comparer (rgthree), PreviewImage
+    assert [nid for nid, _ in p.removed] == ["17", "45", "59"]
+    assert sorted(nid for nid, _ in p.folded) == ["55", "56", "57"]
+    assert not {"17", "45", "59", "55", "56", "57"} & set(p.keep)
+    # RMBG resta: lo usa anche l'encoder, non solo la PreviewImage
+    assert {"47", "49", "1", "6", "9", "54"} <= set(p.keep)
+
+
+def test_fold_text_after_render():
+    tpl = get_template("bg-change", BG_CHANGE)
+    prompt = tpl.render(image="in.png", prompt="zaino su una spiaggia", seed=7)
+    assert prompt["1"]["inputs"]["prompt"] == "白底图转场景, zaino su una spiaggia"
+    assert not {"55", "56", "57", "45", "59"} & set(prompt)
+    # Ogni link rimasto punta a un nodo inviato
+    links = [v for node in prompt.values() for v in node["inputs"].values() if isinstance(v, list)]
+    assert all(v[0] in prompt for v in links)
+
+
+def test_foldable_used_on_other_output_stays():
+    prompt = {
+        "5": {"class_type": "CR Text", "inputs": {"text": "ciao"}},
+        "6": {"class_type": "CLIPTextEncode", "inputs": {"text": ["5", 0], "note": ["5", 1]}},
+        "7": {"class_type": "KSampler", "inputs": {"positive": ["6", 0]}},
+        "8": {"class_type": "SaveImage", "inputs": {"images": ["7", 0]}},
+    }
+    out, p = optimize(prompt)
+    assert "5" in p.keep and p.folded == []
+    assert out["6"]["inputs"] == {"text": "ciao", "note": ["5", 1]}
+
+
+def test_template_not_mutated():
+    tpl = get_template("bg-change", BG_CHANGE)
+    before = copy.deepcopy(tpl.prompt)
+    tpl.render(image="a.png", prompt="uno", seed=1)
+    tpl.render(image="b.png", prompt="due", seed=2)
+    assert tpl.prompt == before
+
+    raw = load(BG_CHANGE)
+    snapshot = copy.deepcopy(raw)
+    out = apply(raw, plan(raw))
+    assert raw == snapshot
+    assert out["1"] is not raw["1"] and out["6"] is raw["6"]  # copiati solo i consumatori dei nodi piegati
@@ -0,0 +1,45 @@
+"""havas.metrics: contatori e istogrammi aggiornati da più thread mentre /metrics li legge."""
+
+import sys
+import threading
+
+from havas.metrics import Registry
+
+THREADS, N = 8, 5000
+
+
+def test_concurrent_updates_are_not_lost():
+    registry = Registry()
+    counter = registry.counter("t_total", "test")
+    hist = registry.histogram("t_seconds", "test", buckets=(1, 10))
+    start, stop = threading.Barrier(THREADS + 1), threading.Event()
+
+    def work():
+        start.wait()
+        for i in range(N):
+            counter.inc(stage="x")
+            hist.observe(i % 20, stage="x")
+
+    def scrape():
+        start.wait()
+        while not stop.is_set(): registry.render()
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)  # cambi di thread frequenti: senza lock gli incrementi si perdono
+    try:
+        threads = [threading.Thread(target=work) for _ in range(THREADS)]
+        reader = threading.Thread(target=scrape)
+        for t in threads + [reader]: t.start()
+        for t in threads: t.join()
+        stop.set()
+        reader.join()
+    finally:
+        sys.setswitchinterval(interval)
+
+    total = THREADS * N
+    assert counter.series[(("stage", "x"),)] == total
+    counts, sum_, n = hist.series[(("stage", "x"),)]
+    assert n == total and counts == [total // 10, total * 11 // 20]
+    assert sum_ == THREADS * sum(i % 20 for i in range(N))
+    text = registry.render()
+    assert f't_total{{stage="x"}} {total}' in text and f't_seconds_count{{stage="x"}} {total}' in text
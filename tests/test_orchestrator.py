@@ -0,0 +1,88 @@
+"""havas.orchestrator contro il mock ComfyUI: varianti, retry su un altro backend, annullamento, timeout."""
+
+import time
+
+from havas.client import AsyncComfyClient
+from havas.dispatch import Dispatcher, Backend
+from havas.orchestrator import ImageOrchestrator
+from havas.workflows import get_template
+from havas.campaign import IMAGES_WORKFLOW
+
+from conftest import start_mock
+
+SEEDS = {"6": 0, "63": 1, "67": 2}  # KSampler delle tre varianti -> offset sul seed
+
+
+def make_orchestrator(tmp_path, backends, **kw):
+    dispatcher = Dispatcher([Backend(url, aclient=AsyncComfyClient(url, retries=0)) for url in backends])
+    template = get_template("aliexpress-images", IMAGES_WORKFLOW)
+    return ImageOrchestrator(None, template, comfy_dir=str(tmp_path / "comfyui"), dispatcher=dispatcher, **kw).start()
+
+
+def make_image(tmp_path):
+    image = tmp_path / "product.png"
+    image.write_bytes(b"\x89PNG product")
+    return str(image)
+
+
+def wait_for(check, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if check(): return True
+        time.sleep(0.02)
+    return False
+
+
+def test_seed_fanout(comfy, tmp_path):
+    orch = make_orchestrator(tmp_path, [comfy.url])
+    params = orch.render_params("in.png", "p", 42)
+    assert (params["seed"], params["seed_2"], params["seed_3"]) == (42, 43, 44)
+
+    job_id = orch.submit_sync(make_image(tmp_path), "studio", seed=1000)
+    snaps = list(orch.iter_updates(job_id))
+    assert snaps[-1]["status"] == "done" and len(snaps[-1]["outputs"]) == 3
+    _, prompt, _ = comfy.prompts[snaps[-1]["prompt_id"]]
+    assert {nid: prompt[nid]["inputs"]["seed"] for nid in SEEDS} == {nid: 1000 + k for nid, k in SEEDS.items()}
+    # I SaveImage scrivono nella cartella della sessione del job
+    assert all(prompt[nid]["inputs"]["filename_prefix"].startswith(snaps[-1]["session_id"] + "/") for nid in ("54", "65", "69"))
+
+
+def test_retry_on_backend_down(comfy, tmp_path, dead_url):
+    # Il backend morto è il primo candidato (stima uguale, ordine della lista)
+    orch = make_orchestrator(tmp_path, [dead_url, comfy.url])
+    job_id = orch.submit_sync(make_image(tmp_path), "studio", seed=1)
+    snaps = list(orch.iter_updates(job_id))
+    assert snaps[-1]["status"] == "done"
+    assert snaps[-1]["backend"] == comfy.url
+    assert any("riprovo su un altro backend" in s["message"] for s in snaps)
+    dead = orch.dispatcher.get(dead_url)
+    assert not dead.healthy and dead.inflight == 0
+
+
+def test_cancel_removes_prompt_from_queue(tmp_path):
+    comfy = start_mock(tmp_path / "mock", gpu_time=3.0)
+    orch = make_orchestrator(tmp_path, [comfy.url])
+    image = make_image(tmp_path)
+    first, second = orch.submit_sync(image, "a", seed=1), orch.submit_sync(image, "b", seed=2)
+    assert wait_for(lambda: orch.get(second)["prompt_id"] and orch.get(first)["status"] == "running")
+    pid = orch.get(second)["prompt_id"]
+    assert pid in comfy.pending
+    assert orch.cancel_sync(second)
+    assert pid not in comfy.pending and orch.get(second)["status"] == "cancelled"
+    # Quello già sul GPU viene interrotto
+    running = orch.get(first)["prompt_id"]
+    assert orch.cancel_sync(first)
+    assert running in comfy.interrupted
+
+
+def test_iter_updates_timeout_cancels_job(tmp_path):
+    comfy = start_mock(tmp_path / "mock", gpu_time=5.0)
+    orch = make_orchestrator(tmp_path, [comfy.url])
+    job_id = orch.submit_sync(make_image(tmp_path), "studio", seed=1)
+    assert wait_for(lambda: orch.get(job_id)["status"] == "running")
+    snaps = list(orch.iter_updates(job_id, timeout=0.5))
+    assert snaps[-1]["status"] == "error" and "Timeout" in snaps[-1]["error"]
+    # Prompt interrotto su ComfyUI e lease restituita al dispatcher
+    assert orch.get(job_id)["prompt_id"] in comfy.interrupted
+    assert wait_for(lambda: orch.dispatcher.backends[0].inflight == 0)
+    assert orch.get(job_id)["status"] == "error"
@@ -0,0 +1,32 @@
+"""havas.overlays: sprite dello stesso testo renderizzati insieme da più thread."""
+
+import os
+import threading
+
+from PIL import ImageFont
+
+from havas import overlays
+
+
+def test_concurrent_sprite_render(tmp_path, monkeypatch):
+    # Font di Pillow al posto degli .otf AliExpress (che stanno solo sul pod)
+    monkeypatch.setattr(overlays, "load_font", lambda path, size: ImageFont.load_default(size))
+    font = tmp_path / "Bold.otf"
+    font.write_bytes(b"font")  # entra solo nella chiave dello sprite (mtime + size)
+    root = str(tmp_path / "sprites")
+    results, errors = [], []
+    for attempt in range(5):
+        barrier = threading.Barrier(8)
+        text = f"SALDI {attempt}"
+
+        def render():
+            barrier.wait()
+            try: results.append(overlays.render_sprite(text, str(font), root=root))
+            except Exception as e: errors.append(e)
+
+        threads = [threading.Thread(target=render) for _ in range(8)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+    assert errors == []
+    assert len({r[0] for r in results}) == 5
+    assert sorted(os.listdir(root)) == sorted(os.path.basename(r[0]) for r in set(results))
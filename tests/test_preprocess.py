@@ -0,0 +1,30 @@
+"""havas.preprocess: pulizia di PREP_DIR per ultimo uso."""
+
+import os
+import time
+
+from PIL import Image
+
+from havas.preprocess import Preprocessor, prune_prepared
+
+
+def test_prune_keeps_recently_used(tmp_path):
+    src = tmp_path / "photo.png"
+    Image.new("RGB", (800, 400), "red").save(src)
+    root = tmp_path / "prep"
+    prep = Preprocessor(max_side=200, root=str(root))
+    out = prep.prepare(str(src))
+    assert os.path.dirname(out) == str(root)
+    stale = root / "old.jpg.123.456.tmp"  # rimasto da un processo morto
+    stale.write_bytes(b"x")
+    old = time.time() - 7200
+    for path in (out, stale): os.utime(path, (old, old))
+
+    assert prep.prepare(str(src)) == out  # riusato: conta come uso recente
+    assert prune_prepared(str(root), max_age=3600) == 1
+    assert os.listdir(root) == [os.path.basename(out)]
+    os.utime(out, (old, old))
+    assert prune_prepared(str(root), max_age=3600) == 1 and os.listdir(root) == []
+    assert prune_prepared(str(tmp_path / "missing")) == 0
+    # Dopo la pulizia il file si rigenera
+    assert prep.prepare(str(src)) == out and os.path.exists(out)
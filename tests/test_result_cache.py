@@ -0,0 +1,56 @@
+"""havas.result_cache: voci su disco, scritture in corso di altri processi, chiave e LRU."""
+
+import os
+import json
+
+from havas.preprocess import Preprocessor
+from havas.result_cache import ResultCache, make_key, META
+
+
+def test_put_get_roundtrip(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    key = make_key("a" * 64, {"prompt": "p", "seed": 1}, "wf")
+    files = cache.put(key, [("out.png", b"png")], {"session_id": "s1"})
+    assert sorted(os.listdir(tmp_path / key)) == [META, "out.png"]
+    hit = ResultCache(str(tmp_path)).get(key)  # nuovo processo: la voce si ricarica dal disco
+    assert hit == {"files": files, "meta": {"session_id": "s1"}}
+    assert cache.get("f" * 64) is None
+
+
+def test_partial_writes_are_not_entries(tmp_path):
+    key = make_key("a" * 64, {"seed": 1}, "wf")
+    # Scrittura di un altro processo a metà (o interrotta), con meta.json già presente
+    tmp_dir = tmp_path / f"{key}.tmp-123-456"
+    tmp_dir.mkdir()
+    (tmp_dir / "out.png").write_bytes(b"x" * 4096)
+    (tmp_dir / META).write_text(json.dumps({"files": ["out.png"], "meta": {}}))
+    # Voce senza meta.json: rename fatto, meta non ancora scritto
+    (tmp_path / key).mkdir()
+    (tmp_path / key / "out.png").write_bytes(b"x")
+    cache = ResultCache(str(tmp_path), max_bytes=1)
+    assert cache.stats()["entries"] == 0 and cache.get(key) is None
+    other = make_key("b" * 64, {"seed": 1}, "wf")
+    cache.put(other, [("out.png", b"y" * 10)])
+    cache.put(make_key("c" * 64, {"seed": 1}, "wf"), [("out.png", b"z" * 10)])
+    # L'eviction tocca solo le voci complete, mai la scrittura in corso
+    assert tmp_dir.exists() and not (tmp_path / other).exists()
+
+
+def test_key_includes_preprocess_spec(tmp_path):
+    params = {"prompt": "p", "seed": 1}
+    small = Preprocessor(max_side=1024, root=str(tmp_path))
+    large = Preprocessor(max_side=1536, root=str(tmp_path))
+    keys = {make_key("a" * 64, params, "wf"), make_key("a" * 64, params, "wf", small), make_key("a" * 64, params, "wf", large)}
+    assert len(keys) == 3
+    assert make_key("a" * 64, params, "wf", small) == make_key("a" * 64, params, "wf", Preprocessor(max_side=1024))
+
+
+def test_lru_eviction(tmp_path):
+    cache = ResultCache(str(tmp_path), max_bytes=450)  # ~170 byte a voce con meta.json
+    keys = [make_key(f"{i:064x}", {}, "wf") for i in range(3)]
+    cache.put(keys[0], [("a.bin", b"0" * 100)])
+    cache.put(keys[1], [("a.bin", b"1" * 100)])
+    assert cache.get(keys[0]) is not None  # keys[0] ora è la più recente
+    cache.put(keys[2], [("a.bin", b"2" * 100)])
+    assert cache.get(keys[1]) is None and cache.get(keys[0]) is not None
+    assert cache.stats()["evictions"] == 1
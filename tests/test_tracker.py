@@ -0,0 +1,200 @@
+"""havas.tracker contro il mock ComfyUI: ordine degli eventi, fallback in polling, anteprime, coda."""
+
+import json
+import time
+import struct
+import asyncio
+
+import aiohttp
+
+from havas.client import ComfyClient
+from havas.tracker import JobTracker, AsyncJobTracker, JobState, parse_preview, queue_ahead, PREVIEW_IMAGE, PREVIEW_IMAGE_WITH_METADATA
+
+from conftest import graph, start_mock
+
+
+def squeeze(events):
+    """Tipi degli eventi senza ripetizioni consecutive (progress x N -> progress)."""
+    out = []
+    for ev in events:
+        if not out or out[-1] != ev["type"]: out.append(ev["type"])
+    return out
+
+
+def run_job(url, prompt, tracker=None, **kw):
+    client = ComfyClient(url)
+    tracker = tracker or client.tracker(poll_interval=0.1)
+    tracker.connect()
+    try:
+        pid = client.submit(prompt, client_id=tracker.client_id)
+        return pid, list(tracker.track(pid, timeout=kw.pop("timeout", 20), **kw))
+    finally:
+        tracker.close()
+
+
+def meta_frame(image, **meta):
+    blob = json.dumps(meta).encode("utf-8")
+    return struct.pack(">II", PREVIEW_IMAGE_WITH_METADATA, len(blob)) + blob + image
+
+
+# ========================================
+# ORDINE DEGLI EVENTI
+# ========================================
+
+def test_websocket_event_order(comfy):
+    _, events = run_job(comfy.url, graph())
+    assert squeeze(events) == ["queued", "started", "executing", "progress", "executing", "executed", "executing", "executed", "done"]
+    progress = [ev for ev in events if ev["type"] == "progress"]
+    assert [ev["value"] for ev in progress] == [1, 2, 3, 4]
+    assert set(events[-1]["outputs"]) == {"90", "99"}
+
+
+def test_websocket_done_on_output_nodes(comfy):
+    prompt = graph()
+    _, events = run_job(comfy.url, prompt, output_nodes=["99"], total_nodes=len(prompt))
+    # Chiude appena il SaveImage ha finito, senza aspettare execution_success
+    assert events[-1]["type"] == "done" and "99" in events[-1]["outputs"]
+    fractions = [ev["fraction"] for ev in events if "fraction" in ev]
+    assert fractions == sorted(fractions) and 0 < fractions[-1] <= 1
+
+
+def test_async_tracker_event_order(comfy):
+    async def run():
+        async with aiohttp.ClientSession() as session:
+            tracker = AsyncJobTracker(comfy.url, session, poll_interval=0.1)
+            async with tracker:
+                async with session.post(f"{comfy.url}/prompt", json={"prompt": graph(), "client_id": tracker.client_id}) as res:
+                    pid = (await res.json())["prompt_id"]
+                return [ev async for ev in tracker.track(pid, timeout=20)]
+
+    events = asyncio.run(run())
+    assert squeeze(events)[:3] == ["queued", "started", "executing"]
+    assert events[-1]["type"] == "done" and "99" in events[-1]["outputs"]
+
+
+# ========================================
+# FALLBACK IN POLLING
+# ========================================
+
+def test_polling_without_websocket(comfy):
+    client = ComfyClient(comfy.url)
+    tracker = client.tracker(poll_interval=0.05)
+    pid = client.submit(graph())
+    events = list(tracker.track(pid, timeout=20))
+    assert events[0]["type"] in ("queued", "started")
+    assert events[-1]["type"] == "done" and "99" in events[-1]["outputs"]
+
+
+def test_websocket_lost_falls_back_to_history(comfy):
+    client = ComfyClient(comfy.url)
+    tracker = client.tracker(poll_interval=0.05)
+    assert tracker.connect()
+    pid = client.submit(graph(), client_id=tracker.client_id)
+    events = []
+    for ev in tracker.track(pid, timeout=20):
+        events.append(ev)
+        # Socket che cade a metà esecuzione (pod riavviato, proxy che chiude)
+        if ev["type"] == "progress" and tracker.ws is not None: tracker.ws.shutdown()
+    types = squeeze(events)
+    assert "fallback" in types
+    assert types.index("fallback") > types.index("progress")
+    assert events[-1]["type"] == "done" and "99" in events[-1]["outputs"]
+
+
+def test_unreachable_server(dead_url):
+    tracker = JobTracker(dead_url, poll_interval=0.05)
+    assert not tracker.connect()
+    events = list(tracker.track("missing", timeout=0.5))
+    assert events[0]["type"] == "unreachable"
+    assert events[-1] == {"type": "error", "message": "Timeout"}
+
+
+# ========================================
+# ANTEPRIME (frame binari)
+# ========================================
+
+def test_parse_preview_frames():
+    jpeg = b"\xff\xd8jpeg"
+    frame = parse_preview(struct.pack(">II", PREVIEW_IMAGE, 2) + jpeg)
+    assert frame == {"image": jpeg, "format": "png", "prompt_id": None, "node": None}
+    frame = parse_preview(meta_frame(jpeg, prompt_id="p1", node_id="3", image_type="image/webp"))
+    assert frame == {"image": jpeg, "format": "webp", "prompt_id": "p1", "node": "3"}
+    assert parse_preview(b"\x00\x00") is None
+    assert parse_preview(struct.pack(">II", 3, 0) + jpeg) is None
+    assert parse_preview(struct.pack(">II", PREVIEW_IMAGE_WITH_METADATA, 4) + b"{bad" + jpeg) is None
+
+
+def test_preview_filters_other_prompts():
+    state = JobState("p1", preview_rate=1000)
+    raw = meta_frame(b"img", prompt_id="p1", node_id="3")
+    assert state.preview(raw) is None  # prima di execution_start
+    state.handle({"type": "execution_start", "data": {"prompt_id": "p1"}})
+    assert state.preview(meta_frame(b"img", prompt_id="p2", node_id="3")) is None
+    ev = state.preview(raw)
+    assert ev == {"type": "preview", "node": "3", "image": b"img", "format": "jpeg"}
+    assert JobState("p1").preview(raw) is None  # anteprime spente
+
+
+def test_websocket_previews_type1(comfy):
+    _, events = run_job(comfy.url, graph(), tracker=JobTracker(comfy.url, poll_interval=0.1, preview_rate=1000))
+    previews = [ev for ev in events if ev["type"] == "preview"]
+    assert len(previews) == comfy.steps
+    assert all(ev["format"] == "jpeg" and ev["node"] == "1" and ev["image"][:2] == b"\xff\xd8" for ev in previews)
+
+
+def test_websocket_previews_throttled(tmp_path):
+    # 20 frame in 2 secondi, 2 al secondo mostrati: PREVIEW_FPS dei frontend
+    comfy = start_mock(tmp_path / "comfyui", gpu_time=2.0, steps=20)
+    tracker = JobTracker(comfy.url, poll_interval=0.1, preview_rate=2)
+    tracker.connect()
+    stamps, types = [], []
+    try:
+        pid = ComfyClient(comfy.url).submit(graph(), client_id=tracker.client_id)
+        for ev in tracker.track(pid, timeout=20):
+            types.append(ev["type"])
+            if ev["type"] == "preview": stamps.append(time.time())
+    finally:
+        tracker.close()
+    assert 3 <= len(stamps) <= 5
+    assert all(b - a >= 0.45 for a, b in zip(stamps, stamps[1:]))
+    assert types[-1] == "done" and "preview" not in types[types.index("executed"):]
+
+
+def test_websocket_previews_type4(tmp_path):
+    frames = tmp_path / "frames"
+    frames.mkdir()
+    (frames / "0.bin").write_bytes(meta_frame(b"\x89PNG-a", node_id="1", image_type="image/png"))
+    (frames / "1.bin").write_bytes(meta_frame(b"\x89PNG-b", node_id="1", image_type="image/png", prompt_id="other"))
+    comfy = start_mock(tmp_path / "comfyui", preview_dir=str(frames))
+    _, events = run_job(comfy.url, graph(), tracker=JobTracker(comfy.url, poll_interval=0.1, preview_rate=1000))
+    previews = [ev for ev in events if ev["type"] == "preview"]
+    # I frame di un altro prompt (metadati) vengono scartati: 4 step, 2 frame a ciclo
+    assert [ev["image"] for ev in previews] == [b"\x89PNG-a", b"\x89PNG-a"]
+    assert all(ev["format"] == "png" for ev in previews)
+
+
+# ========================================
+# POSIZIONE IN CODA
+# ========================================
+
+def test_queue_ahead():
+    running = [[1, "a", {}, {}, []]]
+    pending = [[4, "d", {}, {}, []], [2, "b", {}, {}, []], [3, "c", {}, {}, []]]
+    data = {"queue_running": running, "queue_pending": pending}
+    assert queue_ahead(data, "a") is None
+    assert queue_ahead(data, "b") == 1
+    assert queue_ahead(data, "d") == 3
+    assert queue_ahead(data, "gone") == 4  # non ancora in /queue: dietro a tutti
+
+
+def test_queue_position_from_mock(tmp_path):
+    comfy = start_mock(tmp_path / "comfyui", gpu_time=2.0)
+    client = ComfyClient(comfy.url)
+    pids = [client.submit(graph()) for _ in range(3)]
+    time.sleep(0.2)
+    tracker = client.tracker()
+    assert tracker._queue_ahead(pids[0]) is None
+    assert tracker._queue_ahead(pids[1]) == 1
+    assert tracker._queue_ahead(pids[2]) == 2
+    client.delete_from_queue([pids[1]])
+    assert tracker._queue_ahead(pids[2]) == 1
@@ -0,0 +1,41 @@
+"""havas.uploads: indice condiviso tra processi e dedup degli upload sul mock ComfyUI."""
+
+import multiprocessing
+
+from havas.client import ComfyClient
+from havas.uploads import UploadIndex, InputUploader
+
+
+def _put_many(path, base_url, start, n):
+    index = UploadIndex(path)
+    for i in range(start, start + n): index.put(base_url, f"{i:064x}", f"name_{i}.png")
+
+
+def test_index_merges_writers(tmp_path):
+    path = str(tmp_path / "upload_index.db")
+    # Due processi (API e frontend) scrivono insieme: nessuno perde le voci dell'altro
+    procs = [multiprocessing.Process(target=_put_many, args=(path, "http://comfy", k * 50, 50)) for k in range(2)]
+    for p in procs: p.start()
+    for p in procs: p.join()
+    index = UploadIndex(path)
+    assert all(index.get("http://comfy", f"{i:064x}") == f"name_{i}.png" for i in range(100))
+    assert index.get("http://other", f"{0:064x}") is None
+
+
+def test_upload_dedup(comfy, tmp_path):
+    image = tmp_path / "input.png"
+    image.write_bytes(b"\x89PNG fake image")
+    index = UploadIndex(str(tmp_path / "upload_index.db"))
+    client = ComfyClient(comfy.url)
+    uploader = InputUploader(client, index)
+    name = uploader.upload_path(str(image))
+    assert name.startswith("havas_") and name in comfy.inputs
+    assert uploader.upload_path(str(image)) == name
+    # Nuovo processo, stesso indice: HEAD /view invece di un secondo upload
+    other = InputUploader(client, UploadIndex(index.path))
+    assert other.upload_path(str(image)) == name
+    assert (uploader.stats["uploaded"], uploader.stats["skipped"], other.stats["uploaded"]) == (1, 1, 0)
+    # Pod riavviato: il file non c'è più e viene ricaricato
+    comfy.inputs.clear()
+    third = InputUploader(client, UploadIndex(index.path))
+    assert third.upload_path(str(image)) == name and third.stats["uploaded"] == 1
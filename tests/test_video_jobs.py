@@ -0,0 +1,121 @@
+"""havas.video_jobs contro il finto fal.ai (havas.mock_fal): backoff, slot per provider, cancel, timeout, download."""
+
+import os
+import time
+import asyncio
+
+import pytest
+
+from havas.client import AsyncFalClient, FalError
+from havas.metrics import Trace
+from havas.mock_fal import MockFal
+from havas.video_jobs import VideoJobManager, VideoJob
+
+from conftest import free_port
+
+
+def start_fal(**kw):
+    return MockFal(**dict({"duration": 0.3, "workers": 8, "size": 300 * 1024}, **kw)).start("127.0.0.1", free_port())
+
+
+def make_manager(fal, **kw):
+    kw = dict({"poll_min": 0.05, "poll_max": 0.2}, **kw)
+    return VideoJobManager({"fal": AsyncFalClient(fal.url, key="test", retries=0)}, **kw).start()
+
+
+def make_image(tmp_path):
+    image = tmp_path / "variant.png"
+    image.write_bytes(b"\x89PNG variant")
+    return str(image)
+
+
+def wait_for(check, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if check(): return True
+        time.sleep(0.02)
+    return False
+
+
+class ScriptedFal:
+    """Client fal che risponde a status() con una sequenza fissa."""
+
+    def __init__(self, states):
+        self.states = list(states)
+
+    async def status(self, status_url):
+        status, position = self.states.pop(0)
+        return {"status": status, "queue_position": position} if position is not None else {"status": status}
+
+    async def result(self, response_url):
+        return {"video": {"url": "http://fal/video.mp4"}}
+
+
+def test_poll_backoff_resets_on_change(monkeypatch):
+    sleeps = []
+    real_sleep = asyncio.sleep
+
+    async def fake_sleep(delay):
+        sleeps.append(delay)
+        await real_sleep(0)
+
+    states = [("IN_QUEUE", 2), ("IN_QUEUE", 2), ("IN_QUEUE", 2), ("IN_QUEUE", 2), ("IN_QUEUE", 1),
+              ("IN_PROGRESS", None), ("IN_PROGRESS", None), ("COMPLETED", None)]
+    manager = VideoJobManager({}, poll_min=1, poll_max=3, poll_factor=2)
+    job = VideoJob("fal", "model", "in.png", "p", "out.mp4", {})
+    sub = {"status_url": "s", "response_url": "r"}
+    monkeypatch.setattr(asyncio, "sleep", fake_sleep)
+    result = asyncio.run(manager._poll(job, ScriptedFal(states), sub, Trace("video-test", trace_file=None)))
+    assert result["video"]["url"]
+    # x2 finché lo stato resta uguale (tetto 3), di nuovo 1 quando cambia posizione o stato
+    assert sleeps == [1, 1, 2, 3, 3, 1, 1, 2]
+    assert job.polls == len(states)
+
+
+def test_provider_slot_limit(tmp_path):
+    fal = start_fal(duration=0.3)
+    manager = make_manager(fal, limits={"fal": 2})
+    image = make_image(tmp_path)
+    ids = [manager.submit_sync(image, "zoom", str(tmp_path / f"v{i}.mp4")) for i in range(5)]
+    peak = 0
+    while not all(manager.get(i)["status"] == "done" for i in ids):
+        assert not any(manager.get(i)["status"] in ("error", "cancelled") for i in ids)
+        peak = max(peak, sum(j["status"] in ("IN_QUEUE", "IN_PROGRESS") for j in list(fal.jobs.values())))
+        time.sleep(0.01)
+    assert peak <= 2 and len(fal.jobs) == 5
+    assert all(os.path.getsize(tmp_path / f"v{i}.mp4") == fal.size for i in range(5))
+
+
+def test_cancel_reaches_provider(tmp_path):
+    fal = start_fal(duration=10)
+    manager = make_manager(fal)
+    job_id = manager.submit_sync(make_image(tmp_path), "zoom", str(tmp_path / "v.mp4"))
+    assert wait_for(lambda: manager.get(job_id)["request_id"])
+    assert manager.cancel_sync(job_id)
+    rid = manager.get(job_id)["request_id"]
+    assert fal.jobs[rid]["status"] == "CANCELLED" and fal.counts["cancel"] == 1
+    assert manager.get(job_id)["status"] == "cancelled"
+
+
+def test_timeout_cancels_remote_job(tmp_path):
+    fal = start_fal(duration=10)
+    manager = make_manager(fal, timeout=0.3)
+    job_id = manager.submit_sync(make_image(tmp_path), "zoom", str(tmp_path / "v.mp4"))
+    snap = manager.call(manager.wait(job_id), timeout=10)
+    assert snap["status"] == "error" and "Timeout" in snap["error"]
+    assert fal.jobs[snap["request_id"]]["status"] == "CANCELLED"
+    assert not os.path.exists(tmp_path / "v.mp4")
+
+
+def test_truncated_download_leaves_nothing(tmp_path):
+    fal = start_fal(truncate=100 * 1024)
+    dest = str(tmp_path / "v.mp4")
+
+    async def run():
+        client = AsyncFalClient(fal.url, retries=0)
+        try: await client.stream_to(f"{fal.url}/files/x.mp4", dest)
+        finally: await client.close()
+
+    with pytest.raises(FalError):
+        asyncio.run(run())
+    assert os.listdir(tmp_path) == []
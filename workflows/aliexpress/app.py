@@ -3,85 +3,305 @@
 """
 
 import gradio as gr
-import requests
 import os
+import sys
 import time
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+import uuid
+import random
+import shutil
+
+# Pacchetto condiviso "havas": accanto ad app.py (install) o nella root del repo
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from havas.client import get_client, get_n8n_client, get_api_client
+from havas.uploads import InputUploader, file_digest
+from havas.thumbs import get_thumbs
+from havas.storage import get_storage
+from havas.result_cache import get_cache, make_key
+from havas.workflows import get_template, get_warmup, get_preprocess
+from havas.preprocess import prune_prepared
+from havas.orchestrator import ImageOrchestrator
+from havas.video_jobs import get_video_manager
+from havas import overlays
+from havas.metrics import Trace, start_metrics_server
+from havas.dispatch import Dispatcher, parse_urls
 
 # ========================================
 # ⚙️ CONFIGURAZIONE
 # ========================================
 
-N8N_IMAGES_URL = "http://127.0.0.1:5678/webhook/generate-images-2"
-N8N_VIDEO_URL  = "http://127.0.0.1:5678/webhook/generate-video"
-N8N_FINAL_URL  = "http://127.0.0.1:5678/webhook/generate-final-video"
+N8N_BASE_URL   = os.environ.get("N8N_URL", "http://127.0.0.1:5678")
+N8N_IMAGES_URL = f"{N8N_BASE_URL}/webhook/generate-images-2"
+N8N_VIDEO_URL  = f"{N8N_BASE_URL}/webhook/generate-video"
+N8N_FINAL_URL  = f"{N8N_BASE_URL}/webhook/generate-final-video"
+
+# Stesso ComfyUI usato dal flow n8n (l'input viene caricato direttamente lì)
+COMFY_URL = os.environ.get("COMFY_URL", "http://127.0.0.1:8188")
+# Più pod ComfyUI per lo step immagini nativo: COMFY_URLS=http://a:8188,http://b:8188 (default: solo COMFY_URL)
+COMFY_URLS = parse_urls(os.environ.get("COMFY_URLS")) or [COMFY_URL]
 
 BASE_OUTPUT_DIR = "/tmp/comfyui"
 
+# Flow n8n installato da install.sh: il suo hash entra nella chiave della cache risultati
+N8N_IMAGES_WORKFLOW = "/tmp/comfyui/n8n_workflows/aliexpress/_ALIEXPRESS__01___Image_Generator.json"
+
+# Step 1 senza n8n: stesso grafo (API format) orchestrato direttamente da qui.
+# True = vecchio percorso via webhook (Wait/If in n8n)
+USE_N8N_IMAGES = False
+IMAGES_WORKFLOW = os.path.join(os.path.dirname(os.path.abspath(__file__)), "aliexpress_api.json")
+
+# Step 3 senza n8n: testi come sprite pre-renderizzati + overlay (ffmpeg locale)
+USE_N8N_FINAL = False
+FONT_MAP = dict(overlays.FONT_MAP)
+FOOTER_FONT = overlays.FOOTER_FONT
+PREVIEW_DIR = os.path.join(BASE_OUTPUT_DIR, "output", "preview")
+
+# Step 2 senza n8n: job Kling seguiti da havas.video_jobs (serve FAL_KEY nell'ambiente)
+USE_N8N_VIDEO = not os.environ.get("FAL_KEY")
+
+# Istogrammi Prometheus dei tempi per fase (9464 è del frontend bg-change)
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9465"))
+
+# Secondi di attesa di un job mentre ComfyUI si avvia / scalda i modelli, poi si rifiuta
+READY_TIMEOUT = int(os.environ.get("READY_TIMEOUT", "600"))
+
+# API headless (python -m havas.api): se impostata i 3 step girano lì e la UI è solo un client
+API_URL = os.environ.get("HAVAS_API_URL")
+
 # ========================================
-# 🔧 SESSIONE REQUESTS
+# 🔧 CLIENT N8N (pool keep-alive condiviso, retry e timeout per webhook)
 # ========================================
 
-def create_session():
-    session = requests.Session()
-    retry = Retry(total=3, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504])
-    adapter = HTTPAdapter(max_retries=retry)
-    session.mount('http://', adapter)
-    session.mount('https://', adapter)
-    return session
+n8n = get_n8n_client(N8N_BASE_URL)
+
+# Upload su ComfyUI (nome = hash, mai due volte lo stesso file)
+uploader = InputUploader(get_client(COMFY_URL))
+# Input ridimensionato/ricodificato per quello che il grafo usa davvero (thread pool, vedi havas/workflows.py)
+preprocess = get_preprocess("aliexpress-images")
+
+# Varianti già generate con seed fisso
+results = get_cache()
+
+# Miniature per la gallery (la full-res si apre solo alla selezione)
+thumbs = get_thumbs()
+
+# Una cartella output/<sessione>/ per job, quota e pulizia LRU (thread avviato in __main__)
+storage = get_storage(os.path.join(BASE_OUTPUT_DIR, "output"))
+
+# Orchestratore nativo (loop asyncio in un thread dedicato); ogni job va al backend meno carico
+images_template = get_template("aliexpress-images", IMAGES_WORKFLOW)
+dispatcher = Dispatcher(COMFY_URLS)
+orchestrator = None if USE_N8N_IMAGES or API_URL else ImageOrchestrator(None, images_template, comfy_dir=BASE_OUTPUT_DIR, dispatcher=dispatcher, preprocess=preprocess).start()
+
+# Job video remoti (polling adattivo, tetto per provider, download a chunk)
+videos = None if USE_N8N_VIDEO or API_URL else get_video_manager()
+
+# Health + warm-up del workflow immagini (avviato in __main__)
+readiness = None
+
+def restore_cached(hit):
+    """Rimette i file in cache al loro path originale (se nel frattempo sono spariti)."""
+    paths = hit["meta"].get("paths", [])
+    for src, dest in zip(hit["files"], paths):
+        if not os.path.exists(dest):
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            shutil.copyfile(src, dest)
+    return paths
+
+def gallery_updates(paths, session_id, msg):
+    """Gallery riempita man mano che le miniature sono pronte, nell'ordine delle varianti.
+    Gallery e state_filenames restano allineati: on_select usa lo stesso indice."""
+    if not paths:
+        yield [], session_id, [], msg
+        return
+    # Le varianti restano sul disco finché la sessione le usa (step 2 e 3)
+    storage.hold(storage.session_of(paths[0]))
+    ready = {}
+    for i, thumb in thumbs.iter_ready(paths):
+        ready[i] = thumb
+        order = sorted(ready)
+        status = msg if len(ready) == len(paths) else f"{msg} (anteprime {len(ready)}/{len(paths)})"
+        yield [ready[k] for k in order], session_id, [paths[k] for k in order], status
+
+def api_run(pipeline, params, files, progress):
+    """Job su havas.api: snapshot a ogni cambiamento. Generatore chiuso a metà = job annullato."""
+    api = get_api_client(API_URL)
+    job = api.submit(pipeline, params, files)
+    try:
+        for job in api.iter_updates(job["id"]):
+            progress(job["progress"], desc=job["message"])
+            yield job
+    finally:
+        if job["status"] not in ("done", "error", "cancelled"): api.cancel(job["id"])
+
+def api_outputs(job):
+    """Output del job scaricati in streaming (l'API può stare su un'altra macchina)."""
+    dest_dir = storage.session_dir(f"api_{job['id']}")
+    return [get_api_client(API_URL).download(job["id"], dest_dir, n) for n in range(len(job["outputs"]))]
 
 # ========================================
 # 📸 STEP 1: IMMAGINI
 # ========================================
 
-def generate_images(image_path, prompt, progress=gr.Progress()):
-    import io, base64
-    from PIL import Image
-    import numpy as np
+def generate_images(image_path, prompt, seed=42, rnd=True, progress=gr.Progress()):
+    """Generatore: (gallery di miniature, session_id, path full-res, stato)."""
+    if not image_path:
+        yield [], None, [], "⚠️ Carica immagine!"
+        return
+    if not prompt:
+        yield [], None, [], "⚠️ Scrivi prompt!"
+        return
+    
+    # Seed fisso = job ripetibile: prima si guarda in cache
+    seed_val = random.randint(1, 9**15) if rnd else int(seed)
+    cache_key = None
+    if not rnd:
+        try:
+            workflow_hash = file_digest(N8N_IMAGES_WORKFLOW) if USE_N8N_IMAGES else images_template.hash
+            cache_key = make_key(file_digest(image_path), {"prompt": prompt, "seed": seed_val}, workflow_hash, preprocess)
+            hit = results.get(cache_key)
+        except Exception as e:
+            print(f"⚠️ Cache non disponibile: {e}")
+            cache_key, hit = None, None
+        if hit:
+            paths = restore_cached(hit)
+            st = results.stats()
+            yield from gallery_updates(paths, hit["meta"].get("session_id"), f"⚡ {len(paths)} immagini da cache (hit {st['hits']} / miss {st['misses']})")
+            return
     
-    if not image_path: return [], None, [], "⚠️ Carica immagine!"
-    if not prompt: return [], None, [], "⚠️ Scrivi prompt!"
+    if API_URL:
+        yield from generate_images_api(image_path, prompt, seed_val, cache_key, progress)
+        return
     
+    # I job aspettano che ComfyUI sia su e con i modelli caricati
+    if readiness is not None and not readiness.is_ready():
+        progress(0, desc=readiness.describe())
+        if not readiness.wait(READY_TIMEOUT):
+            yield [], None, [], f"❌ Server non pronto dopo {READY_TIMEOUT}s ({readiness.describe()}), riprova più tardi"
+            return
+    
+    if not USE_N8N_IMAGES:
+        yield from generate_images_native(image_path, prompt, seed_val, cache_key, progress)
+        return
+    
+    # Il file va su ComfyUI così com'è (niente JPEG q95 + base64): a n8n passa solo il nome
     try:
-        img = Image.open(image_path)
-        buffered = io.BytesIO()
-        img.save(buffered, format="JPEG", quality=95)
-        img_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
+        image_filename = uploader.upload_path(preprocess.submit(image_path).result())
     except Exception as e:
-        return [], None, [], f"❌ Errore img: {str(e)}"
+        yield [], None, [], f"❌ Errore upload img: {str(e)}"
+        return
     
     try:
-        session = create_session()
-        response = session.post(N8N_IMAGES_URL, json={"prompt": prompt, "image": img_base64}, timeout=600)
+        response = n8n.webhook(N8N_IMAGES_URL, json={"prompt": prompt, "image_filename": image_filename, "seed": seed_val})
         
-        if response.status_code != 200: return [], None, [], f"❌ Errore n8n: {response.text}"
+        if response.status_code != 200:
+            yield [], None, [], f"❌ Errore n8n: {response.text}"
+            return
         
         result = response.json()
         if isinstance(result, list): result = result[0] if len(result) > 0 else {}
-        if not result.get("success"): return [], None, [], f"❌ Errore workflow: {result.get('error')}"
+        if not result.get("success"):
+            yield [], None, [], f"❌ Errore workflow: {result.get('error')}"
+            return
         
-        output_images = []
         filenames_list = []
         for img_meta in result.get("images", []):
             fname = img_meta.get("filename")
             sub = img_meta.get("subfolder", "")
             path = os.path.join(BASE_OUTPUT_DIR, "output" if img_meta.get("type")=="output" else img_meta.get("type"), sub, fname)
-            if os.path.exists(path):
-                try:
-                    output_images.append(np.array(Image.open(path)))
-                    filenames_list.append(path)
-                except: pass
-                
-        return output_images, result.get("session_id"), filenames_list, f"✅ Generate {len(output_images)} immagini"
+            if os.path.exists(path): filenames_list.append(path)
+        
+        if cache_key and filenames_list:
+            results.put(cache_key, [(p, p) for p in filenames_list], meta={"session_id": result.get("session_id"), "paths": filenames_list})
+    except Exception as e:
+        yield [], None, [], f"❌ Errore: {str(e)}"
+        return
+    yield from gallery_updates(filenames_list, result.get("session_id"), f"✅ Generate {len(filenames_list)} immagini")
+
+def generate_images_native(image_path, prompt, seed_val, cache_key, progress):
+    try:
+        job_id = orchestrator.submit_sync(image_path, prompt, seed_val)
+        job = None
+        for job in orchestrator.iter_updates(job_id):
+            progress(job["progress"], desc=job["message"])
+    except Exception as e:
+        yield [], None, [], f"❌ Errore: {str(e)}"
+        return
+    
+    if job["status"] != "done":
+        yield [], None, [], f"❌ Errore workflow: {job['error'] or job['message']}"
+        return
+    
+    paths = job["outputs"]
+    if cache_key and paths:
+        results.put(cache_key, [(p, p) for p in paths], meta={"session_id": job["session_id"], "paths": paths})
+    yield from gallery_updates(paths, job["session_id"], f"✅ Generate {len(paths)} immagini")
+
+def generate_images_api(image_path, prompt, seed_val, cache_key, progress):
+    try:
+        job = None
+        for job in api_run("aliexpress-images", {"prompt": prompt, "seed": seed_val}, {"image": image_path}, progress): pass
+        if job["status"] != "done":
+            yield [], None, [], f"❌ Errore workflow: {job['error'] or job['message']}"
+            return
+        paths = api_outputs(job)
     except Exception as e:
-        return [], None, [], f"❌ Errore: {str(e)}"
+        yield [], None, [], f"❌ Errore: {str(e)}"
+        return
+    
+    if cache_key and paths:
+        results.put(cache_key, [(p, p) for p in paths], meta={"session_id": job.get("session_id"), "paths": paths})
+    yield from gallery_updates(paths, job.get("session_id"), f"✅ Generate {len(paths)} immagini")
 
 # ========================================
 # 🎬 STEP 2: VIDEO BASE (AGGIORNATO PER PROMPT API)
 # ========================================
 
 def generate_video_base(selected_file, session_id, video_prompt, progress=gr.Progress()):
+    """
+    Video Base (Kling): job nativo se c'è FAL_KEY, altrimenti webhook n8n.
+    È un generatore: se l'utente annulla o chiude la pagina il job remoto viene cancellato.
+    """
+    if API_URL and selected_file:
+        yield from generate_video_api(selected_file, video_prompt, progress)
+        return
+    if USE_N8N_VIDEO or not selected_file:
+        yield generate_video_n8n(selected_file, session_id, video_prompt)
+        return
+    
+    session = session_id or storage.session_of(selected_file)
+    dest = os.path.join(storage.session_dir(session), f"video_{os.path.splitext(os.path.basename(selected_file))[0]}.mp4")
+    job = None
+    try:
+        job_id = videos.submit_sync(selected_file, video_prompt or "Cinematic zoom", dest)
+        for job in videos.iter_updates(job_id):
+            progress(job["progress"], desc=job["message"])
+            yield gr.update(), f"⏳ {job['message']}"
+    except Exception as e:
+        yield None, f"❌ Errore API: {str(e)}"
+        return
+    finally:
+        # Generatore chiuso a metà (Annulla / pagina chiusa): il job non serve più
+        if job and job["status"] not in ("done", "error", "cancelled"): videos.cancel_sync(job["id"])
+    
+    if job["status"] == "done":
+        storage.hold(storage.session_of(dest))
+        yield job["outputs"][0], f"✅ {job['message']}"
+    else:
+        yield None, f"❌ Errore video: {job['error'] or job['message']}"
+
+def generate_video_api(selected_file, video_prompt, progress):
+    try:
+        job = None
+        for job in api_run("video", {"prompt": video_prompt or "Cinematic zoom"}, {"image": selected_file}, progress):
+            yield gr.update(), f"⏳ {job['message']}"
+        if job["status"] != "done":
+            yield None, f"❌ Errore video: {job['error'] or job['message']}"
+            return
+        yield api_outputs(job)[0], f"✅ {job['message']}"
+    except Exception as e:
+        yield None, f"❌ Errore API: {str(e)}"
+
+def generate_video_n8n(selected_file, session_id, video_prompt):
     """
     Funzione di generazione Video Base che invia il Prompt alla Webhook N8n (Fal.ai).
     """
@@ -112,8 +332,7 @@ def generate_video_base(selected_file, session_id, video_prompt, progress=gr.Pro
     }
 
     try:
-        session = create_session()
-        response = session.post(N8N_VIDEO_URL, json=payload, timeout=600)
+        response = n8n.webhook(N8N_VIDEO_URL, json=payload)
         
         if response.status_code != 200:
             return None, f"❌ Errore n8n: {response.text}"
@@ -121,16 +340,15 @@ def generate_video_base(selected_file, session_id, video_prompt, progress=gr.Pro
         # 5. Verifica e Salvataggio (Assumiamo che il video ritorni in formato binario/file)
         expected_output_name = f"video_{clean_filename}" # Nome con suffisso video_
         
-        # Salvataggio del video scaricato nel percorso corretto
-        base_dir = os.path.join(BASE_OUTPUT_DIR, "output")
-        output_dir = os.path.join(base_dir, session_id) if session_id else base_dir
-        os.makedirs(output_dir, exist_ok=True)
+        # Salvataggio del video scaricato nella cartella della sessione (nuova se manca)
+        output_dir = storage.session_dir(session_id or storage.session_of(image_path))
         
         final_video_path = os.path.join(output_dir, expected_output_name)
         
         if len(response.content) > 1000:
             with open(final_video_path, 'wb') as f:
                 f.write(response.content)
+            storage.hold(storage.session_of(final_video_path))
             return final_video_path, f"✅ Video Scaricato ({len(response.content)//1024} KB)"
         
         return None, "❌ Video non ricevuto da N8n. Controlla i log."
@@ -142,6 +360,46 @@ def generate_video_base(selected_file, session_id, video_prompt, progress=gr.Pro
 # ✍️ STEP 3: VIDEO FINALE (Con Calcolo Larghezza)
 # ========================================
 
+def final_layers(lines, x_head, y_head, text_foot, x_foot, y_foot):
+    """lines = [(testo, "Bold"/"Normal"), ...] -> layer sprite per overlays.compose"""
+    return overlays.campaign_layers(lines, x_head, y_head, text_foot, x_foot, y_foot, fonts=FONT_MAP, footer_font=FOOTER_FONT)
+
+def footer_font():
+    return FOOTER_FONT if os.path.exists(FOOTER_FONT) else FONT_MAP["Bold"]
+
+def prune_previews(max_age=1800):
+    if not os.path.isdir(PREVIEW_DIR): return
+    for name in os.listdir(PREVIEW_DIR):
+        path = os.path.join(PREVIEW_DIR, name)
+        try:
+            if time.time() - os.path.getmtime(path) > max_age: os.remove(path)
+        except OSError: pass
+
+def generate_preview_video(base_video_path, 
+                           l1_text, l1_font, 
+                           l2_text, l2_font, 
+                           l3_text, l3_font, 
+                           l4_text, l4_font, 
+                           l5_text, l5_font, 
+                           x_head, y_head, 
+                           text_foot, x_foot, y_foot):
+    """Anteprima veloce (480p, 12 fps, ultrafast) a ogni modifica dei testi o degli slider."""
+    if not base_video_path: return None, "❌ Nessun video base caricato"
+    lines = [(l1_text, l1_font), (l2_text, l2_font), (l3_text, l3_font), (l4_text, l4_font), (l5_text, l5_font)]
+    prune_previews()
+    output = os.path.join(PREVIEW_DIR, f"preview_{uuid.uuid4().hex[:12]}.mp4")
+    trace = Trace("final-preview")
+    try:
+        with trace.span("sprites"):
+            layers = final_layers(lines, x_head, y_head, text_foot, x_foot, y_foot)
+        with trace.span("ffmpeg"):
+            overlays.compose(base_video_path, layers, output, preview=True)
+        seconds = trace.finish()["seconds"]
+        return output, f"👁️ Anteprima pronta in {seconds:.1f}s — clicca **Renderizza** per la versione finale"
+    except Exception as e:
+        trace.finish("error", e)
+        return None, f"❌ Errore anteprima: {str(e)}"
+
 def generate_final_video(base_video_path, 
                          l1_text, l1_font, 
                          l2_text, l2_font, 
@@ -158,22 +416,49 @@ def generate_final_video(base_video_path,
     print(f"\n{'='*50}")
     print(f"🎨 INIZIO POST-PRODUZIONE")
     
-    # 1. Mappa Font
-    font_map = {
-        "Bold": "/tmp/comfyui/AliExpress sans.otf", 
-        "Normal": "/tmp/comfyui/AliExpress sans regluar.otf"
-    }
+    # 1. Righe (testo, font)
+    lines = [(l1_text, l1_font), (l2_text, l2_font), (l3_text, l3_font), (l4_text, l4_font), (l5_text, l5_font)]
     
     # 2. Funzione Pulizia Testo
     def cln(t): return t.strip() if t and t.strip() else " "
     
-    # 3. CALCOLO LARGHEZZA RETTANGOLO (Nuova Parte)
-    # Pulisci il footer
-    clean_foot = cln(text_foot)
-    # Calcola i pixel: (Numero caratteri * 26px) + 80px di margine. Se vuoto = 0.
-    box_width = (len(clean_foot) * 26) + 80 if clean_foot != " " else 0
+    if API_URL:
+        params = {"lines": lines, "x_head": x_head, "y_head": y_head, "text_foot": text_foot or "", "x_foot": x_foot, "y_foot": y_foot}
+        try:
+            job = None
+            for job in api_run("final", params, {"video": base_video_path}, progress): pass
+            if job["status"] != "done": return None, f"❌ Errore: {job['error'] or job['message']}"
+            return api_outputs(job)[0], "✅ Video Finale Completato!"
+        except Exception as e:
+            return None, f"❌ Errore API: {str(e)}"
+    
+    if not USE_N8N_FINAL:
+        # Ogni riga/footer diventa uno sprite (in cache per testo+font): ffmpeg fa solo overlay.
+        # compose() ritorna quando ffmpeg ha finito: niente sleep + controllo del file
+        output = storage.unique_path(storage.session_of(base_video_path), "final", ".mp4")
+        trace = Trace("final")
+        try:
+            progress(0.1, desc="Preparo i testi")
+            with trace.span("sprites"):
+                layers = final_layers(lines, x_head, y_head, text_foot, x_foot, y_foot)
+            progress(0.3, desc="Render video")
+            with trace.span("ffmpeg"):
+                overlays.compose(base_video_path, layers, output)
+            trace.finish()
+            storage.hold(storage.session_of(output))
+            return output, "✅ Video Finale Completato!"
+        except Exception as e:
+            trace.finish("error", e)
+            return None, f"❌ Errore: {str(e)}"
+    
+    # n8n scrive in output/<output_name>: nome unico anche per due render nello stesso secondo
+    output_name = f"final_{int(time.time())}_{uuid.uuid4().hex[:6]}.mp4"
+    output = os.path.join(storage.root, output_name)
     
-    output_name = f"final_{int(time.time())}.mp4"
+    # 3. CALCOLO LARGHEZZA RETTANGOLO: misura reale col font (prima era len(testo)*26 + 80)
+    clean_foot = cln(text_foot)
+    box_width = 0
+    if clean_foot != " ": box_width = overlays.measure(clean_foot, footer_font())[0] + 2 * overlays.FOOT_PAD[0]
     
     # 4. Payload con il nuovo parametro 'box_width'
     payload = {
@@ -182,20 +467,17 @@ def generate_final_video(base_video_path,
         "text_foot": clean_foot, "x_foot": x_foot, "y_foot": y_foot,
         
         "box_width": box_width,  # <--- ECCOLO QUI!
-        
-        "l1_text": cln(l1_text), "l1_font": font_map.get(l1_font, font_map["Bold"]),
-        "l2_text": cln(l2_text), "l2_font": font_map.get(l2_font, font_map["Normal"]),
-        "l3_text": cln(l3_text), "l3_font": font_map.get(l3_font, font_map["Normal"]),
-        "l4_text": cln(l4_text), "l4_font": font_map.get(l4_font, font_map["Normal"]),
-        "l5_text": cln(l5_text), "l5_font": font_map.get(l5_font, font_map["Normal"]),
     }
+    for i, (text, font) in enumerate(lines, 1):
+        payload[f"l{i}_text"] = cln(text)
+        payload[f"l{i}_font"] = FONT_MAP.get(font, FONT_MAP["Bold" if i == 1 else "Normal"])
     
     try:
-        session = create_session()
-        response = session.post(N8N_FINAL_URL, json=payload, timeout=300)
-        expected = os.path.join(BASE_OUTPUT_DIR, "output", output_name)
-        time.sleep(1)
-        if os.path.exists(expected): return expected, "✅ Video Finale Completato!"
+        # Il webhook risponde solo dopo l'Execute Command: la risposta è il segnale di fine
+        response = n8n.webhook(N8N_FINAL_URL, json=payload)
+        result = response.json() if response.status_code == 200 else {}
+        if isinstance(result, list): result = result[0] if result else {}
+        if result.get("success") and os.path.exists(output): return output, "✅ Video Finale Completato!"
         return None, f"❌ Errore n8n: {response.text}"
     except Exception as e:
         return None, f"❌ Errore: {str(e)}"
@@ -222,6 +504,9 @@ with gr.Blocks(title="AI Campaign Manager") as demo:
                 with gr.Column(scale=1):
                     inp_img = gr.Image(type="filepath", height=300, label="Input Immagine")
                     inp_prompt = gr.Textbox(label="Prompt", lines=3)
+                    with gr.Row():
+                        inp_seed = gr.Number(value=42, label="Seed")
+                        inp_rnd = gr.Checkbox(value=True, label="Random")
                     btn_gen_img = gr.Button("🚀 Genera", variant="primary")
                 with gr.Column(scale=2):
                     out_gallery = gr.Gallery(columns=3, height="auto", interactive=False)
@@ -248,6 +533,7 @@ with gr.Blocks(title="AI Campaign Manager") as demo:
                     )
                     
                     btn_gen_vid = gr.Button("✨ Genera Video Base", variant="primary")
+                    btn_stop_vid = gr.Button("⏹️ Annulla", size="sm")
                 
                 with gr.Column(scale=2):
                     out_video = gr.Video(height=450, label="Video Base", interactive=False)
@@ -301,6 +587,7 @@ with gr.Blocks(title="AI Campaign Manager") as demo:
                         sl_x_foot = gr.Slider(0, 100, value=50, label="Pos X Footer")
                         sl_y_foot = gr.Slider(0, 100, value=85, label="Pos Y Footer")
 
+                    btn_preview = gr.Button("👁️ Anteprima veloce", size="lg")
                     btn_render_final = gr.Button("🎬 Renderizza", variant="primary", size="lg")
 
                 with gr.Column(scale=2):
@@ -314,12 +601,13 @@ with gr.Blocks(title="AI Campaign Manager") as demo:
     # 1. Genera Immagini
     btn_gen_img.click(
         fn=generate_images, 
-        inputs=[inp_img, inp_prompt], 
+        inputs=[inp_img, inp_prompt, inp_seed, inp_rnd], 
         outputs=[out_gallery, state_session_id, state_filenames, status_msg]
     )
     
     # 2. Selezione Immagine
     def on_select(filenames, evt: gr.SelectData):
+        # La gallery ha solo miniature: l'immagine piena si carica qui, per la variante scelta
         if not filenames: return None, gr.update(visible=False), None
         s = filenames[evt.index]
         return s, gr.update(visible=True), s
@@ -364,6 +652,8 @@ with gr.Blocks(title="AI Campaign Manager") as demo:
         outputs=[video_confirm_section]
     )
     
+    btn_stop_vid.click(fn=lambda: "⏹️ Video annullato", outputs=[video_status], cancels=[gen_vid_event])
+    
     # 5. Conferma Video (Passa al Tab 3)
     def confirm_step2(video_path):
         if not video_path: return None, gr.Tabs()
@@ -375,23 +665,37 @@ with gr.Blocks(title="AI Campaign Manager") as demo:
         outputs=[inp_video_step3, main_tabs]
     )
     
-    # 6. Render Finale
+    # 6. Anteprima (ogni modifica) e Render Finale (solo su conferma)
+    final_inputs = [
+        inp_video_step3, 
+        l1_txt, l1_font, 
+        l2_txt, l2_font, 
+        l3_txt, l3_font, 
+        l4_txt, l4_font, 
+        l5_txt, l5_font, 
+        sl_x_head, sl_y_head, 
+        txt_foot, sl_x_foot, sl_y_foot
+    ]
+    preview_kw = dict(fn=generate_preview_video, inputs=final_inputs, outputs=[out_final_video, final_status],
+                      trigger_mode="always_last", show_progress="minimal")
+    btn_preview.click(**preview_kw)
+    for sl in (sl_x_head, sl_y_head, sl_x_foot, sl_y_foot): sl.release(**preview_kw)
+    for tb in (l1_txt, l2_txt, l3_txt, l4_txt, l5_txt, txt_foot): tb.submit(**preview_kw)
+    for dd in (l1_font, l2_font, l3_font, l4_font, l5_font): dd.input(**preview_kw)
+    
     btn_render_final.click(
         fn=generate_final_video, 
-        inputs=[
-            inp_video_step3, 
-            l1_txt, l1_font, 
-            l2_txt, l2_font, 
-            l3_txt, l3_font, 
-            l4_txt, l4_font, 
-            l5_txt, l5_font, 
-            sl_x_head, sl_y_head, 
-            txt_foot, sl_x_foot, sl_y_foot
-        ],
+        inputs=final_inputs,
         outputs=[out_final_video, final_status]
     )
 
 if __name__ == "__main__":
+    start_metrics_server(METRICS_PORT)
+    thumbs.prune()
+    prune_prepared()
+    storage.start()
+    if API_URL: print(f"🌐 Job sull'API {API_URL}")
+    else: readiness = dispatcher.start([("aliexpress-images", images_template, get_warmup("aliexpress-images"))])
     demo.launch(server_name="0.0.0.0", server_port=7860, share=True)
 
     # ========================================
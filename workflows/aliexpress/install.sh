@@ -48,20 +48,14 @@ echo "✔️ Workflow copiato in $WORKFLOWS_DIR/aliexpress.json"
 
 echo "📥 Installazione modelli..."
 
-wget -c --show-progress "https://huggingface.co/aidiffuser/Qwen-Image-Edit-2509/resolve/main/Qwen-Image-Edit-2509_fp8_e4m3fn.safetensors" \
-  -O "$MODEL_DIR/diffusion_models/Qwen-Image-Edit-2509_fp8_e4m3fn.safetensors"
-
-wget -c --show-progress "https://huggingface.co/Comfy-Org/Qwen-Image_ComfyUI/resolve/main/split_files/text_encoders/qwen_2.5_vl_7b_fp8_scaled.safetensors" \
-  -O "$MODEL_DIR/text_encoders/qwen_2.5_vl_7b_fp8_scaled.safetensors"
-
-wget -c --show-progress "https://huggingface.co/Comfy-Org/Qwen-Image_ComfyUI/resolve/main/split_files/vae/qwen_image_vae.safetensors" \
-  -O "$MODEL_DIR/vae/qwen_image_vae.safetensors"
-
-wget -c --show-progress "https://huggingface.co/lightx2v/Qwen-Image-Lightning/resolve/main/Qwen-Image-Lightning-8steps-V1.1.safetensors" \
-  -O "$MODEL_DIR/loras/Qwen-Image-Lightning-8steps-V1.1.safetensors"
-
-wget -c --show-progress "https://huggingface.co/dx8152/Qwen-Image-Edit-2509-White_to_Scene/resolve/main/%E7%99%BD%E5%BA%95%E5%9B%BE%E8%BD%AC%E5%9C%BA%E6%99%AF.safetensors" \
-  -O "$MODEL_DIR/loras/white_to_scene.safetensors"
+# Manifest workflows/aliexpress/models.txt: download in parallelo, ripresa con Range,
+# sha256 verificato e rename atomico (un file troncato non viene più preso per buono)
+REPO_GIT="https://github.com/werhealthy/-runpod-comfyui-Havas.git"
+HAVAS_SRC="/tmp/havas-src-aliexpress"
+rm -rf "$HAVAS_SRC"
+git clone --depth 1 "$REPO_GIT" "$HAVAS_SRC"
+pip install -q requests
+(cd "$HAVAS_SRC" && python3 -m havas.fetch_models --manifest workflows/aliexpress/models.txt --models-dir "$MODEL_DIR" --workers 4)
 
 # --- FONTS ---
 echo "🔤 Installazione Fonts..."
@@ -87,40 +81,10 @@ wget -c "$FONT_BASE_URL/output.mov" -O "$COMFY_DIR/outro.mp4"
 
 echo "🧩 Installazione Custom Nodes..."
 
-CUSTOM_NODES=(
-  "ComfyUI-Manager|https://github.com/ltdrdata/ComfyUI-Manager.git"
-  "ComfyUI-KJNodes|https://github.com/kijai/ComfyUI-KJNodes.git"
-  "ComfyUI-RMBG|https://github.com/1038lab/ComfyUI-RMBG.git"
-  "rgthree-comfy|https://github.com/rgthree/rgthree-comfy.git"
-  "ComfyUI_essentials|https://github.com/cubiq/ComfyUI_essentials.git"
-  "ComfyUI_Comfyroll_CustomNodes|https://github.com/Suzie1/ComfyUI_Comfyroll_CustomNodes.git"
-  "Comfyui-QwenEditUtils|https://github.com/lrzjason/Comfyui-QwenEditUtils.git"
-  "was-node-suite-comfyui|https://github.com/ltdrdata/was-node-suite-comfyui.git"
-)
-
-for entry in "${CUSTOM_NODES[@]}"; do
-  NAME=$(echo "$entry" | cut -d'|' -f1)
-  REPO=$(echo "$entry" | cut -d'|' -f2)
-  DEST="$CUSTOM_NODES_DIR/$NAME"
-  rm -rf "$DEST"
-  echo "📥 Clono da zero $NAME"
-  git clone --depth=1 "$REPO" "$DEST"
-done
-
-echo "📦 Configurazione finale dei Nodi..."
-
-for folder in "$CUSTOM_NODES_DIR"/*; do
-  if [ -f "$folder/requirements.txt" ]; then
-     pip install -q --no-cache-dir -r "$folder/requirements.txt" || true
-  fi
-  
-  if [ -f "$folder/install.py" ]; then
-     echo "⚙️ Configuro nodo: $(basename "$folder")"
-     cd "$folder"
-     python install.py || true
-     cd ..
-  fi
-done
+# Manifest workflows/aliexpress/custom_nodes.txt: nodi riclonati solo se cambia il commit,
+# requirements di ComfyUI + nodi risolti insieme in un lockfile, wheel in cache, tempi per fase
+(cd "$HAVAS_SRC" && python3 -m havas.build_env --nodes workflows/aliexpress/custom_nodes.txt --comfy-dir "$COMFY_DIR") \
+  || echo "⚠️ Alcuni nodi non sono stati configurati"
 
 if [ -d "$CUSTOM_NODES_DIR/rgthree-comfy/web" ]; then
     echo "⚡ FIX: Copio manualmente interfaccia rgthree..."
@@ -128,13 +92,6 @@ if [ -d "$CUSTOM_NODES_DIR/rgthree-comfy/web" ]; then
     cp -rf "$CUSTOM_NODES_DIR/rgthree-comfy/web"/* "$COMFY_DIR/web/extensions/rgthree/"
 fi
 
-if [ -d "$CUSTOM_NODES_DIR/ComfyUI-Manager" ]; then
-    echo "🔧 Eseguo riparazione dipendenze Manager..."
-    cd "$CUSTOM_NODES_DIR/ComfyUI-Manager"
-    pip install -q -r requirements.txt || true
-    python cm-cli.py restore-dependencies || true
-fi
-
 echo "🧹 Pulizia cache finale..."
 rm -rf "$COMFY_DIR/user/default/node_cache"
 rm -rf "$COMFY_DIR/__pycache__"
@@ -150,12 +107,19 @@ echo "🔧 Setup frontend AliExpress..."
 FRONTEND_DIR="$COMFY_DIR/frontends/aliexpress"
 mkdir -p "$FRONTEND_DIR"
 
-APP_URL="https://raw.githubusercontent.com/werhealthy/-runpod-comfyui-Havas/refs/heads/main/workflows/aliexpress/app.py"
-echo "📥 Scarico app.py AliExpress..."
-curl -fSL "$APP_URL" -o "$FRONTEND_DIR/app.py" || echo "⚠️ Errore download app.py"
+echo "📥 Copio app.py AliExpress + moduli condivisi havas (repo già clonato per i modelli)..."
+if [ -d "$HAVAS_SRC/havas" ]; then
+  cp "$HAVAS_SRC/workflows/aliexpress/app.py" "$FRONTEND_DIR/app.py"
+  cp "$HAVAS_SRC/workflows/aliexpress/aliexpress_api.json" "$FRONTEND_DIR/aliexpress_api.json"
+  rm -rf "$FRONTEND_DIR/havas"
+  cp -r "$HAVAS_SRC/havas" "$FRONTEND_DIR/havas"
+  rm -rf "$HAVAS_SRC"
+else
+  echo "⚠️ Errore download app.py"
+fi
 
 echo "📦 Installo requirements frontend AliExpress..."
-pip install -q --no-cache-dir gradio requests || true
+pip install -q --no-cache-dir gradio requests websocket-client aiohttp Pillow || true
 
 echo "⚙️ Creo comando 'run-aliexpress-frontend'..."
 cat <<'EOF' >/usr/local/bin/run-aliexpress-frontend
@@ -53,28 +53,13 @@ echo "✔️ Workflow copiato in $WORKFLOWS_DIR/bg-change.json"
 
 echo "📥 Installazione modelli..."
 
-wget -c --show-progress "https://huggingface.co/aidiffuser/Qwen-Image-Edit-2509/resolve/main/Qwen-Image-Edit-2509_fp8_e4m3fn.safetensors" \
-  -O $MODEL_DIR/diffusion_models/Qwen-Image-Edit-2509_fp8_e4m3fn.safetensors
-
-wget -c --show-progress "https://huggingface.co/Comfy-Org/Qwen-Image_ComfyUI/resolve/main/split_files/text_encoders/qwen_2.5_vl_7b_fp8_scaled.safetensors" \
-  -O $MODEL_DIR/text_encoders/qwen_2.5_vl_7b_fp8_scaled.safetensors
-
-wget -c --show-progress "https://huggingface.co/Comfy-Org/Qwen-Image_ComfyUI/resolve/main/split_files/vae/qwen_image_vae.safetensors" \
-  -O $MODEL_DIR/vae/qwen_image_vae.safetensors
-
-wget -c --show-progress "https://huggingface.co/lightx2v/Qwen-Image-Lightning/resolve/main/Qwen-Image-Lightning-8steps-V1.1.safetensors" \
-  -O $MODEL_DIR/loras/Qwen-Image-Lightning-8steps-V1.1.safetensors
-
-wget -c --show-progress "https://huggingface.co/dx8152/Qwen-Image-Edit-2509-White_to_Scene/resolve/main/%E7%99%BD%E5%BA%95%E5%9B%BE%E8%BD%AC%E5%9C%BA%E6%99%AF.safetensors" \
-  -O $MODEL_DIR/loras/white_to_scene.safetensors
-  
-# --- MODELLI PER SUPIR UPSCALER ---
-# Nota: Questi vanno in 'checkpoints' standard
-wget -c --show-progress "https://huggingface.co/Kijai/SUPIR_pruned/resolve/main/SUPIR-v0F_fp16.safetensors?download=true" \
-  -O $MODEL_DIR/checkpoints/SUPIR-v0F_fp16.safetensors
-
-wget -c --show-progress "https://civitai.com/api/download/models/357609" \
-  -O $MODEL_DIR/checkpoints/juggernautXL_v9Rdphoto2Lightning.safetensors
+# Manifest workflows/bg-change/models.txt (Qwen Edit + SUPIR): download in parallelo,
+# ripresa con Range, sha256 verificato e rename atomico
+HAVAS_SRC="/tmp/havas-src-bg-change"
+rm -rf "$HAVAS_SRC"
+git clone --depth 1 "https://github.com/werhealthy/-runpod-comfyui-Havas.git" "$HAVAS_SRC"
+pip install -q requests
+(cd "$HAVAS_SRC" && python3 -m havas.fetch_models --manifest workflows/bg-change/models.txt --models-dir "$MODEL_DIR" --workers 4)
 
 ###############################################
 # 3. INSTALLAZIONE CUSTOM NODES (robusto e universale)
@@ -82,44 +67,11 @@ wget -c --show-progress "https://civitai.com/api/download/models/357609" \
 
 echo "🧩 Installazione Custom Nodes..."
 
-CUSTOM_NODES=(
-  "ComfyUI-Manager|https://github.com/ltdrdata/ComfyUI-Manager.git"
-  "ComfyUI-KJNodes|https://github.com/kijai/ComfyUI-KJNodes.git"
-  "ComfyUI-RMBG|https://github.com/1038lab/ComfyUI-RMBG.git"
-  "rgthree-comfy|https://github.com/rgthree/rgthree-comfy.git"
-  "ComfyUI_essentials|https://github.com/cubiq/ComfyUI_essentials.git"
-  "ComfyUI_Comfyroll_CustomNodes|https://github.com/Suzie1/ComfyUI_Comfyroll_CustomNodes.git"
-  "Comfyui-QwenEditUtils|https://github.com/lrzjason/Comfyui-QwenEditUtils.git"
-  "was-node-suite-comfyui|https://github.com/ltdrdata/was-node-suite-comfyui.git"
-  "ComfyUI-SUPIR|https://github.com/kijai/ComfyUI-SUPIR.git"
-)
-
-for entry in "${CUSTOM_NODES[@]}"; do
-  NAME=$(echo "$entry" | cut -d'|' -f1)
-  REPO=$(echo "$entry" | cut -d'|' -f2)
-  DEST="$CUSTOM_NODES_DIR/$NAME"
-  # Pulizia profonda e rimozione eventuale vecchia repo con nome diverso/simile
-  rm -rf "$DEST"
-  echo "📥 Clono da zero $NAME"
-  git clone --depth=1 "$REPO" "$DEST"
-done
-
-echo "📦 Configurazione finale dei Nodi..."
-
-# 1. Installa Requirements e Script di Setup (Solo se esistono)
-for folder in /tmp/comfyui/custom_nodes/*; do
-  if [ -f "$folder/requirements.txt" ]; then
-     pip install -q --no-cache-dir -r "$folder/requirements.txt"
-  fi
-  
-  # Questo controllo [ -f ] impedisce allo script di bloccarsi se install.py manca
-  if [ -f "$folder/install.py" ]; then
-     echo "⚙️ Configuro nodo: $(basename "$folder")"
-     cd "$folder"
-     python install.py
-     cd ..
-  fi
-done
+# 1. Manifest workflows/bg-change/custom_nodes.txt: nodi riclonati solo se cambia il commit,
+#    requirements di ComfyUI + nodi risolti insieme in un lockfile, wheel in cache, install.py
+#    solo dei nodi cambiati (al posto di restore-dependencies del Manager)
+(cd "$HAVAS_SRC" && python3 -m havas.build_env --nodes workflows/bg-change/custom_nodes.txt --comfy-dir "$COMFY_DIR")
+rm -rf "$HAVAS_SRC"
 
 # 2. FIX SPECIFICO PER RGTHREE (Copia Manuale)
 # Dato che install.py non esiste più, copiamo i file grafici a mano
@@ -129,15 +81,7 @@ if [ -d "/tmp/comfyui/custom_nodes/rgthree-comfy/web" ]; then
     cp -rf /tmp/comfyui/custom_nodes/rgthree-comfy/web/* /tmp/comfyui/web/extensions/rgthree/
 fi
 
-# 3. RIPARAZIONE VIA MANAGER (Cruciale per KJNodes e RMBG)
-if [ -d "/tmp/comfyui/custom_nodes/ComfyUI-Manager" ]; then
-    echo "🔧 Eseguo riparazione dipendenze Manager..."
-    cd /tmp/comfyui/custom_nodes/ComfyUI-Manager
-    pip install -q -r requirements.txt
-    python cm-cli.py restore-dependencies
-fi
-
-# 4. PULIZIA CACHE
+# 3. PULIZIA CACHE
 echo "🧹 Pulizia cache finale..."
 rm -rf /tmp/comfyui/user/default/node_cache
 rm -rf /tmp/comfyui/__pycache__
@@ -164,6 +108,8 @@ if [ ! -d "$FRONTEND_DIR" ]; then
 
   if [ -d "$FRONTEND_DIR-tmp/frontend_product_demo" ]; then
     mv "$FRONTEND_DIR-tmp/frontend_product_demo" "$FRONTEND_DIR"
+    # Moduli condivisi (tracker WebSocket, ecc.) accanto ad app.py
+    mv "$FRONTEND_DIR-tmp/havas" "$FRONTEND_DIR/havas"
     rm -rf "$FRONTEND_DIR-tmp"
   else
     echo "❌ ERRORE: frontend_product_demo non trovato"